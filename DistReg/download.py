@@ -1,98 +1,247 @@
 import os
+import json
+import argparse
+import concurrent.futures
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 
+from process_csv import parse_blocks
+
 output_dir = "csv_downloads"
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
+manifest_file = "manifest.json"
 
-index_url = "https://www.math.mun.ca/distanceregular/indexes/upto50vertices.html"
+index_urls = ["https://www.math.mun.ca/distanceregular/indexes/upto50vertices.html"]
 csv_base_url = "https://www.math.mun.ca/distanceregular/graphdata/"
 
 
-def download_file(url, save_path, filename_hint):
-    try:
-        file_response = requests.get(url)
-        if file_response.status_code == 200:
-            with open(save_path, 'wb') as f:
-                f.write(file_response.content)
-            print(f"Successfully downloaded {filename_hint} from {url}")
-            return True
-        else:
-            print(
-                f"HTTP {file_response.status_code} for {filename_hint} at {url}")
+class Downloader:
+    '''
+    concurrent downloader sharing one pooled session,
+    `manifest.json` in the output dir records ETag / Last-Modified of every finished file,
+    so an interrupted run resumes where it stopped and `refresh` only re-fetches changed files
+    '''
+
+    def __init__(self, output_dir: str, csv_base_url: str, max_workers: int = 16,
+                 refresh: bool = False, timeout: float = 30.) -> None:
+        self.output_dir = output_dir
+        self.csv_base_url = csv_base_url
+        self.max_workers = max_workers
+        self.refresh = refresh
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers,
+                              pool_maxsize=max_workers, max_retries=3)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        os.makedirs(output_dir, exist_ok=True)
+        self.manifest_path = os.path.join(output_dir, manifest_file)
+        self.manifest: dict = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+        self.lock = threading.Lock()
+
+    def save_manifest(self) -> None:
+        with self.lock:
+            tmp_path = self.manifest_path + ".part"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.manifest, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def is_valid(path: str) -> bool:
+        try:
+            with open(path, 'r') as f:
+                matrices = parse_blocks(f.read())
+        except (OSError, ValueError):
             return False
-    except requests.exceptions.RequestException as e:
-        print(f"Request error for {filename_hint} at {url}: {e}")
-        return False
-    except Exception as e:
-        print(f"Error saving {filename_hint}: {e}")
-        return False
-
-
-try:
-    response = requests.get(index_url)
-    response.raise_for_status()
-    soup = BeautifulSoup(response.content, 'html.parser')
-
-    for link in soup.find_all('a'):
-        href = link.get('href')
-
-        if href and 'graphs/' in href and href.endswith('.html'):
-
-            slug = href.split('/')[-1].replace('.html', '')
-            csv_filename = f"{slug}.am.csv"
-
-            # Phase 1: Try the direct URL construction method
-            csv_url_direct = f"{csv_base_url}{csv_filename}"
-            save_path = os.path.join(output_dir, csv_filename)
-
-            print(
-                f"Attempting direct download for {csv_filename} from {csv_url_direct}...")
-
-            if download_file(csv_url_direct, save_path, csv_filename):
-                continue  # Success, move to the next graph
-
-            # Phase 2: Fallback to accessing the graph page and scraping the link
-            print(
-                f"Direct download failed/skipped. Falling back to scraping {slug}'s page...")
+        return bool(matrices) and all(m is not None for m in matrices)
+
+    def fetch(self, url: str, filename: str, page_url: str | None = None) -> str:
+        '''
+        return: 'skipped', 'not modified', 'downloaded' or 'failed'
+        '''
+        save_path = os.path.join(self.output_dir, filename)
+        record = self.manifest.get(filename)
+        present = record is not None and os.path.exists(
+            save_path) and self.is_valid(save_path)
+
+        if present and not self.refresh:
+            return 'skipped'
+
+        headers = {}
+        if present:
+            if record.get('etag'):
+                headers['If-None-Match'] = record['etag']
+            if record.get('last_modified'):
+                headers['If-Modified-Since'] = record['last_modified']
+
+        try:
+            response = self.session.get(
+                url, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            print(f"Request error for {filename} at {url}: {e}")
+            return 'failed'
+
+        if response.status_code == 304 and present:
+            return 'not modified'
+        if response.status_code != 200:
+            print(f"HTTP {response.status_code} for {filename} at {url}")
+            return 'failed'
+
+        # write to a temporary file first, a killed run never leaves a truncated csv
+        tmp_path = save_path + ".part"
+        with open(tmp_path, 'wb') as f:
+            f.write(response.content)
+        if not self.is_valid(tmp_path):
+            os.remove(tmp_path)
+            print(f"Invalid adjacency matrix for {filename} at {url}")
+            return 'failed'
+        os.replace(tmp_path, save_path)
+
+        with self.lock:
+            self.manifest[filename] = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'page': page_url,
+            }
+        self.save_manifest()
+        return 'downloaded'
+
+    def fetch_graph(self, page_url: str) -> str:
+        slug = page_url.split('/')[-1].replace('.html', '')
+        csv_filename = f"{slug}.am.csv"
+
+        # a file found by scraping last time is fetched from the same url again
+        with self.lock:
+            records = list(self.manifest.items())
+        for filename, record in records:
+            if record.get('page') == page_url and filename != csv_filename:
+                return self.fetch(record['url'], filename, page_url)
+
+        # Phase 1: Try the direct URL construction method
+        status = self.fetch(
+            f"{self.csv_base_url}{csv_filename}", csv_filename, page_url)
+        if status != 'failed':
+            return status
+
+        # Phase 2: Fallback to accessing the graph page and scraping the link
+        try:
+            graph_response = self.session.get(page_url, timeout=self.timeout)
+            graph_response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"Error accessing graph page {page_url}: {e}")
+            return 'failed'
+
+        graph_soup = BeautifulSoup(graph_response.content, 'html.parser')
+        csv_link_tag = graph_soup.find(
+            'a', string='Adjacency matrix in CSV format')
+        if not csv_link_tag:
+            print(f"Failed to find CSV link on page {page_url}.")
+            return 'failed'
+
+        csv_url_fallback = urljoin(page_url, csv_link_tag.get('href'))
+        return self.fetch(csv_url_fallback, os.path.basename(csv_url_fallback), page_url)
+
+    def graph_pages(self, index_url: str) -> list[str]:
+        response = self.session.get(index_url, timeout=self.timeout)
+        response.raise_for_status()
+        soup = BeautifulSoup(response.content, 'html.parser')
+
+        pages = []
+        for link in soup.find_all('a'):
+            href = link.get('href')
+            if href and 'graphs/' in href and href.endswith('.html'):
+                pages.append(urljoin(index_url, href))
+        return list(dict.fromkeys(pages))
+
+    def run(self, index_urls: list[str]) -> dict[str, int]:
+        pages = []
+        for index_url in index_urls:
+            pages.extend(self.graph_pages(index_url))
+        pages = list(dict.fromkeys(pages))
+
+        counts: dict[str, int] = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for status in executor.map(self.fetch_graph, pages):
+                counts[status] = counts.get(status, 0) + 1
+
+        print(', '.join(f"{k}: {v}" for k, v in sorted(counts.items())))
+        return counts
+
+
+def _main1():
+    '''
+    check against a local `http.server` stand-in of the site: one graph csv at the direct url,
+    one only linked from its graph page, then a resumed run and a refresh revalidating both
+    '''
+    import functools
+    import http.server
+    import tempfile
+
+    site = tempfile.mkdtemp()
+    for sub in ('indexes', 'graphs', 'graphdata', 'files'):
+        os.makedirs(os.path.join(site, sub))
+    k4 = '\n'.join(','.join('0' if i == j else '1' for j in range(4)) for i in range(4))
+    c5 = '\n'.join(','.join('1' if (i - j) % 5 in (1, 4) else '0' for j in range(5)) for i in range(5))
+    files = {
+        'indexes/index.html': '<a href="../graphs/K4.html">K4</a> <a href="../graphs/C5.html">C5</a>',
+        'graphs/K4.html': '',
+        'graphs/C5.html': '<a href="../files/pentagon.csv">Adjacency matrix in CSV format</a>',
+        'graphdata/K4.am.csv': k4,
+        'files/pentagon.csv': c5,
+    }
+    for name, content in files.items():
+        with open(os.path.join(site, name), 'w') as f:
+            f.write(content)
+
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args) -> None:
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=site))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}/'
 
-            graph_page_url = urljoin(index_url, href)
-
-            try:
-                graph_response = requests.get(graph_page_url)
-                graph_response.raise_for_status()
-                graph_soup = BeautifulSoup(
-                    graph_response.content, 'html.parser')
-
-                csv_link_tag = graph_soup.find(
-                    'a', string='Adjacency matrix in CSV format')
-
-                if csv_link_tag:
-                    csv_relative_href = csv_link_tag.get('href')
-                    csv_url_fallback = urljoin(
-                        graph_page_url, csv_relative_href)
-
-                    # Get the correct filename from the fallback URL in case it differs slightly
-                    fallback_filename = os.path.basename(csv_url_fallback)
-                    save_path_fallback = os.path.join(
-                        output_dir, fallback_filename)
-
-                    print(
-                        f"Attempting fallback download for {fallback_filename} from {csv_url_fallback}...")
-
-                    if not download_file(csv_url_fallback, save_path_fallback, fallback_filename):
-                        print(
-                            f"Fallback download failed for {fallback_filename}.")
-
-                else:
-                    print(f"Failed to find CSV link on page {graph_page_url}.")
-
-            except requests.exceptions.RequestException as e:
-                print(f"Error accessing graph page {graph_page_url}: {e}")
-            except Exception as e:
-                print(f"Error during fallback scraping for {slug}: {e}")
-
-except Exception as e:
-    print(f"Fatal error: {e}")
+    try:
+        output = tempfile.mkdtemp()
+        index = [base + 'indexes/index.html']
+        assert Downloader(output, base + 'graphdata/', 4).run(index) == {'downloaded': 2}
+        assert sorted(f for f in os.listdir(output) if f.endswith('.csv')) == ['K4.am.csv', 'pentagon.csv']
+        assert Downloader(output, base + 'graphdata/', 4).run(index) == {'skipped': 2}
+        assert Downloader(output, base + 'graphdata/', 4, refresh=True).run(index) == {'not modified': 2}
+        print('local check passed')
+    finally:
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="download distance regular graphs as csv adjacency matrices")
+    parser.add_argument('--index', action='append', dest='index_urls',
+                        help="index page listing graph pages, may be repeated")
+    parser.add_argument('--csv-base-url', default=csv_base_url)
+    parser.add_argument('--output-dir', default=output_dir)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--refresh', action='store_true',
+                        help="revalidate present files with ETag / Last-Modified")
+    parser.add_argument('--check', action='store_true',
+                        help="run against a local http.server stand-in of the site instead")
+    args = parser.parse_args()
+    if args.check:
+        _main1()
+        return
+
+    downloader = Downloader(args.output_dir, args.csv_base_url,
+                            max_workers=args.workers, refresh=args.refresh)
+    downloader.run(args.index_urls or index_urls)
+
+
+if __name__ == "__main__":
+    main()
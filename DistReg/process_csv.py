@@ -1,82 +1,143 @@
 import os
 import csv
-import networkx as nx
+import concurrent.futures
+import numpy as np
 
 input_dir = "csv_downloads"
 output_file = "graph.csv"
-data_list = []
+store_file = "graph.npz"
 
-def process_matrix(matrix, filename):
-    if not matrix:
-        return None
-    
-    num_nodes = len(matrix)
-    if num_nodes == 0:
-        return None
 
-    try:
-        degree = sum(matrix[0])
-    except:
-        return None
+def parse_blocks(content: str) -> list[np.ndarray]:
+    '''
+    parse every blank-line separated adjacency matrix of a csv file
+    '''
+    matrices = []
+    for block in content.strip().split('\n\n'):
+        lines = [line for line in block.strip().split('\n') if line.strip()]
+        if not lines:
+            continue
 
-    for row in matrix:
-        if len(row) != num_nodes:
-            return None
-        if sum(row) != degree:
+        values = np.array(','.join(lines).replace(',', ' ').split(), dtype=np.uint8)
+        num_nodes = len(lines)
+        if values.size != num_nodes * num_nodes:
+            matrices.append(None)
+            continue
+        matrices.append(values.reshape(num_nodes, num_nodes))
+
+    return matrices
+
+
+def bitset_diameter(matrix: np.ndarray) -> int | None:
+    '''
+    bit-parallel BFS from all sources at once,
+    reach[v] is the bitset of nodes within distance k of v after k rounds
+    return: diameter, None if not connected
+    '''
+    num_nodes = matrix.shape[0]
+    full = (1 << num_nodes) - 1
+    neighbors = [np.flatnonzero(row).tolist() for row in matrix]
+    reach = [1 << v for v in range(num_nodes)]
+
+    diameter = 0
+    while any(r != full for r in reach):
+        new_reach = []
+        for v in range(num_nodes):
+            r = reach[v]
+            for w in neighbors[v]:
+                r |= reach[w]
+            new_reach.append(r)
+
+        if new_reach == reach:
             return None
 
-    G = nx.Graph()
-    G.add_nodes_from(range(num_nodes))
-    for i in range(num_nodes):
-        for j in range(i + 1, num_nodes):
-            if matrix[i][j] == 1:
-                G.add_edge(i, j)
+        reach = new_reach
+        diameter += 1
+
+    return diameter
+
+
+def process_matrix(matrix: np.ndarray | None, filename: str):
+    if matrix is None or matrix.size == 0:
+        return None
+
+    degrees = matrix.sum(axis=1, dtype=np.int64)
+    degree = int(degrees[0])
+    if not np.all(degrees == degree):
+        return None
+
+    # undirected graph: keep the upper triangle mirrored, as before
+    adjacency = np.triu(matrix == 1, 1)
+    adjacency = adjacency | adjacency.T
 
-    if nx.is_connected(G):
-        diameter = nx.diameter(G)
-    else:
+    diameter = bitset_diameter(adjacency)
+    if diameter is None:
         diameter = "Inf"
 
     clean_name = filename.replace(".am.csv", "")
-    return [clean_name, num_nodes, degree, diameter]
-
-if os.path.exists(input_dir):
-    for filename in os.listdir(input_dir):
-        if filename.endswith(".csv"):
-            filepath = os.path.join(input_dir, filename)
-            try:
-                with open(filepath, 'r') as f:
-                    content = f.read()
-
-                blocks = content.strip().split('\n\n')
-                sub_index = 0
-                
-                for block in blocks:
-                    block = block.strip()
-                    if not block:
-                        continue
-
-                    lines = block.split('\n')
-                    reader = csv.reader(lines)
-                    matrix = []
-                    for row in reader:
-                        if row:
-                            cleaned = [int(x) for x in row if x.strip() != '']
-                            if cleaned:
-                                matrix.append(cleaned)
-
-                    res = process_matrix(matrix, filename)
-                    if res:
-                        if len(blocks) > 1:
-                            res[0] = f"{res[0]}_{sub_index+1}"
-                        data_list.append(res)
-                        sub_index += 1
-            except:
-                pass
-
-data_list.sort(key=lambda x: (x[1], x[0]))
-
-with open(output_file, 'w', newline='') as f:
-    writer = csv.writer(f)
-    writer.writerow(['filename', 'nodes', 'degree', 'diameter'])
-    writer.writerows(data_list)
\ No newline at end of file
+    return [clean_name, matrix.shape[0], degree, diameter, np.packbits(adjacency.ravel())]
+
+
+def process_file(filepath: str) -> list:
+    filename = os.path.basename(filepath)
+    try:
+        with open(filepath, 'r') as f:
+            content = f.read()
+        matrices = parse_blocks(content)
+    except (OSError, ValueError):
+        return []
+
+    results = []
+    sub_index = 0
+    for matrix in matrices:
+        res = process_matrix(matrix, filename)
+        if res:
+            if len(matrices) > 1:
+                res[0] = f"{res[0]}_{sub_index+1}"
+            results.append(res)
+            sub_index += 1
+
+    return results
+
+
+def write_store(data_list: list, path: str) -> None:
+    '''
+    all adjacency matrices as one compressed array of packed bits,
+    matrix i is `adjacency[offsets[i]:offsets[i + 1]]` with `nodes[i]` ** 2 bits
+    '''
+    sizes = [len(res[4]) for res in data_list]
+    offsets = np.zeros(len(data_list) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(sizes)
+    adjacency = np.concatenate(
+        [res[4] for res in data_list]) if data_list else np.zeros(0, dtype=np.uint8)
+
+    np.savez_compressed(path,
+                        names=np.array([res[0] for res in data_list]),
+                        nodes=np.array([res[1] for res in data_list], dtype=np.int64),
+                        offsets=offsets,
+                        adjacency=adjacency)
+
+
+def main():
+    data_list = []
+
+    if os.path.exists(input_dir):
+        filepaths = [os.path.join(input_dir, filename)
+                     for filename in sorted(os.listdir(input_dir)) if filename.endswith(".csv")]
+
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            for results in executor.map(process_file, filepaths, chunksize=8):
+                data_list.extend(results)
+
+    data_list.sort(key=lambda x: (x[1], x[0]))
+
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['filename', 'nodes', 'degree', 'diameter'])
+        writer.writerows([res[:4] for res in data_list])
+
+    write_store(data_list, store_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+import argparse
+import json
+import multiprocessing as mp
+import platform
+import resource
+import subprocess
+import sys
+import time
+import networkx as nx
+
+
+class Case(NamedTuple):
+    name: str
+    kind: str               # 'bfb', 'line', 'degree' or 'finder'
+    family: str             # graph family, see `_GRAPHS`
+    params: Tuple           # arguments of the family, or (max_N, max_d) for 'finder'
+    depth: int = 0          # number of expansions for 'line' and 'degree'
+
+
+# family -> builder, imported lazily in the benchmark process
+_GRAPHS: Dict[str, Callable[..., nx.DiGraph]] = {
+    'ring': lambda n: __import__('graph').ring(n, False),
+    'torus': lambda *dims: __import__('graph').torus(list(dims)),
+    'circulant': lambda n, *gens: __import__('graph').circulant_graph(n, list(gens)),
+    'kautz': lambda d, m: __import__('graph').generalized_kautz_graph(d, m),
+    'bipartite': lambda d: nx.DiGraph(nx.complete_bipartite_graph(d, d)),
+    'complete': lambda n: __import__('graph').complete_graph(n),
+}
+
+
+def default_cases(quick: bool = False) -> List[Case]:
+    cases = [
+        Case('bfb/ring(16)', 'bfb', 'ring', (16,)),
+        Case('bfb/torus(4,4)', 'bfb', 'torus', (4, 4)),
+        Case('bfb/circulant(16,[2,3])', 'bfb', 'circulant', (16, 2, 3)),
+        Case('bfb/kautz(2,12)', 'bfb', 'kautz', (2, 12)),
+        Case('bfb/K(4,4)', 'bfb', 'bipartite', (4,)),
+        Case('line/K(3)^2', 'line', 'complete', (3,), 2),
+        Case('degree/ring(8)^1', 'degree', 'ring', (8,), 1),
+        Case('finder(256,4)', 'finder', '', (256, 4)),
+    ]
+    if not quick:
+        cases += [
+            Case('bfb/ring(64)', 'bfb', 'ring', (64,)),
+            Case('bfb/torus(8,8)', 'bfb', 'torus', (8, 8)),
+            Case('bfb/circulant(64,[5,6])', 'bfb', 'circulant', (64, 5, 6)),
+            Case('bfb/kautz(3,48)', 'bfb', 'kautz', (3, 48)),
+            Case('bfb/K(8,8)', 'bfb', 'bipartite', (8,)),
+            Case('line/K(4,4)^2', 'line', 'bipartite', (4,), 2),
+            Case('line/K(3)^4', 'line', 'complete', (3,), 4),
+            Case('degree/ring(8)^2', 'degree', 'ring', (8,), 2),
+            Case('finder(1024,4)', 'finder', '', (1024, 4)),
+            Case('finder(4096,8)', 'finder', '', (4096, 8)),
+        ]
+    return cases
+
+
+def _run(case: Case) -> Dict[str, Any]:
+    '''
+    body of one case, runs in its own process so that the peak RSS belongs to the case
+    '''
+    result: Dict[str, Any] = {}
+    begin = time.perf_counter()
+
+    if case.kind == 'finder':
+        from topology_finder import TopologyFinder
+        tf = TopologyFinder(*case.params)
+        tf.search()
+        result['entries'] = sum(len(tps) for cells in tf.topology_table.values()
+                                for tps in cells.values())
+    else:
+        # utils and bfb_schedule load cvxpy, the finder cases do not need it
+        import utils
+        import expansion
+        from bfb_schedule import BFB
+        from profiling import Profiler, SummarySink
+        G = _GRAPHS[case.family](*case.params)
+        summary = SummarySink(print_on_close=False)
+        A = BFB(G, False, profiler=Profiler([summary]))
+        # LPs built and solved by BFB
+        result['lp_count'] = summary.stats.get('solve LP', {}).get('count', 0)
+        for _ in range(case.depth):
+            if case.kind == 'line':
+                G, A = expansion.line_graph_expansion(G, A)
+            else:
+                G, A = expansion.degree_expansion(G, A, 2)
+        TL, TB = utils.get_TL_TB(G, A)
+        N = G.number_of_nodes()
+        result.update(N=N, TL=TL, TB=TB, TB_ratio=TB / ((N - 1) / N))
+
+    result['wall_time'] = time.perf_counter() - begin
+    # kilobytes on Linux
+    result['peak_rss_mb'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def _child(case: Case, queue) -> None:
+    try:
+        queue.put(_run(case))
+    except BaseException as e:
+        queue.put({'error': repr(e)})
+
+
+def run_case(case: Case, timeout: float | None = None) -> Dict[str, Any]:
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_child, args=(case, queue))
+    process.start()
+    try:
+        result = queue.get(timeout=timeout)
+    except Exception:
+        result = {'error': 'timeout'}
+    process.join(1)
+    if process.is_alive():
+        process.kill()
+    return {'name': case.name, **result}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_suite(cases: List[Case], repeat: int = 1, timeout: float | None = None, print_progress: bool = True) -> Dict[str, Any]:
+    '''
+    every case runs repeat times in fresh processes, the fastest run is kept
+    '''
+    results = []
+    for case in cases:
+        runs = [run_case(case, timeout) for _ in range(repeat)]
+        ok = [r for r in runs if 'error' not in r]
+        best = min(ok, key=lambda r: r['wall_time']) if ok else runs[0]
+        results.append(best)
+        if print_progress:
+            if 'error' in best:
+                print(f"{case.name:<28} error: {best['error']}")
+            else:
+                print(f"{case.name:<28} {best['wall_time']:8.3f} s {best['peak_rss_mb']:8.1f} MB"
+                      + (f"  TB = {best['TB']:.4f}" if 'TB' in best else ''))
+
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': _git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], time_tol: float = 0.2, rss_tol: float = 0.2,
+            tb_tol: float = 1e-6) -> List[str]:
+    '''
+    return: one line per regression of new against old,
+    wall time or peak RSS growing by more than the relative tolerance, TB or the number of LPs growing, or a case failing
+    '''
+    old_results = {r['name']: r for r in old['results']}
+    regressions = []
+    for r in new['results']:
+        o = old_results.get(r['name'])
+        if o is None or 'error' in o:
+            continue
+        if 'error' in r:
+            regressions.append(f"{r['name']}: {r['error']}")
+            continue
+        if r['wall_time'] > o['wall_time'] * (1 + time_tol):
+            regressions.append(f"{r['name']}: wall time {o['wall_time']:.3f} s -> {r['wall_time']:.3f} s")
+        if r['peak_rss_mb'] > o['peak_rss_mb'] * (1 + rss_tol):
+            regressions.append(f"{r['name']}: peak RSS {o['peak_rss_mb']:.1f} MB -> {r['peak_rss_mb']:.1f} MB")
+        if 'TB' in r and 'TB' in o and r['TB'] > o['TB'] + tb_tol:
+            regressions.append(f"{r['name']}: TB {o['TB']:.4f} -> {r['TB']:.4f}")
+        if 'lp_count' in r and 'lp_count' in o and r['lp_count'] > o['lp_count']:
+            regressions.append(f"{r['name']}: LPs {o['lp_count']} -> {r['lp_count']}")
+    return regressions
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Benchmark BFB, expansions and TopologyFinder.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='run the suite and write a results file')
+    run.add_argument('-o', '--output', default='benchmark.json')
+    run.add_argument('--quick', action='store_true', help='small cases only')
+    run.add_argument('-k', '--filter', default='', help='only cases whose name contains this')
+    run.add_argument('--repeat', type=int, default=1)
+    run.add_argument('--timeout', type=float, default=None, help='seconds per case')
+
+    cmp = sub.add_parser('compare', help='compare two results files')
+    cmp.add_argument('old')
+    cmp.add_argument('new')
+    cmp.add_argument('--time-tol', type=float, default=0.2)
+    cmp.add_argument('--rss-tol', type=float, default=0.2)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        cases = [c for c in default_cases(args.quick) if args.filter in c.name]
+        results = run_suite(cases, args.repeat, args.timeout)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'results written to {args.output}')
+
+    else:
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.time_tol, args.rss_tol)
+        for line in regressions:
+            print(line)
+        print(f'{len(regressions)} regressions')
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
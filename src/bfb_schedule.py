@@ -7,18 +7,266 @@ from typing import Dict
 from tqdm import tqdm
 
 from schedule_type import *
+import utils
+from profiling import Profiler, span
 
 
-def BFB(G: nx.DiGraph, print_detail: bool = True) -> Schedule:
+# (t, w, u) -> load of other traffic on link w -> u at time step t
+Background = Dict[Tuple[TimeStep, Node, Node], float]
+
+
+class ProblemTask:
+    def __init__(self, t: TimeStep, u: Node, problem: cp.Problem, x_vars: Dict[Tuple[Node, Node], cp.Variable], U: cp.Variable,
+                 capacities: Dict[Node, float] | None = None, background: Dict[Node, float] | None = None):
+        self.t = t
+        self.u = u
+        self.problem = problem
+        self.x_vars = x_vars
+        self.U = U
+        self.capacities = capacities if capacities is not None else {}
+        self.background = background if background is not None else {}
+
+
+def _build_problem_task(G: nx.DiGraph, path_lengths: Dict[Node, Dict[Node, int]], nodes: List[Node], t: TimeStep, u: Node,
+                        background: Background | None = None) -> ProblemTask | None:
+    sources_v = [v for v in nodes if path_lengths[v].get(u) == t]
+    if not sources_v:
+        return None
+
+    neighbors_w = list(G.predecessors(u))
+    valid_pairs = [(v, w) for v in sources_v for w in neighbors_w
+                   if path_lengths[v].get(w) == t - 1]
+
+    background_w = None
+    if background is not None:
+        background_w = {w: background[(t, w, u)] for w in neighbors_w if (t, w, u) in background}
+    return _problem_task_from_pairs(G, t, u, sources_v, neighbors_w, valid_pairs, background_w)
+
+
+def _problem_task_from_pairs(G: nx.DiGraph, t: TimeStep, u: Node, sources_v: List[Node], neighbors_w: List[Node],
+                             valid_pairs: List[Tuple[Node, Node]], background_w: Dict[Node, float] | None = None) -> ProblemTask | None:
+    """
+    LP of destination u at step t, valid_pairs are the (source v, in neighbor w) with v at distance t - 1 from w
+    background_w: load of other traffic on link w -> u during the step, in shards, takes capacity away from the transfers
+    """
+    capacities = {w: utils.link_capacity(G, w, u) for w in neighbors_w}
+    background_w = background_w if background_w is not None else {}
+
+    # LP vars
+    U = cp.Variable(nonneg=True, name=f"U_{u}_{t}")
+    x_vars = {}
+
+    for v, w in valid_pairs:
+        var = cp.Variable(
+            nonneg=True, name=f"x_{v}_{w}_{u}_{t}")
+        x_vars[(v, w)] = var
+
+    # LP constraints
+    constraints = []
+
+    # 1st constraints: correct max workload, link w -> u moves capacity c_w per unit time
+    for w in neighbors_w:
+        relevant_vs = [v for (v, ngh) in valid_pairs if ngh == w]
+        if relevant_vs:
+            constraints.append(
+                cp.sum([x_vars[(v, w)] for v in relevant_vs]) + background_w.get(w, 0.) <= U * capacities[w])
+
+    # 2nd constraints: u receiving all data shards
+    has_valid_flow = False
+    for v in sources_v:
+        relevant_ws = [w for (src, w) in valid_pairs if src == v]
+
+        # Check if there are any valid paths for v to u
+        if relevant_ws:
+            constraints.append(
+                cp.sum([x_vars[(v, w)] for w in relevant_ws]) == 1.0)
+            has_valid_flow = True
+        # If not, skip this source/dest pair as it's impossible to complete the flow.
+        else:
+            continue
+
+    # If no source has a valid path (w) to the destination u, skip this LP
+    if not has_valid_flow and sources_v:
+        return None
+
+    # 3rd constraints: valid x_vars
+    for (v, w), x in x_vars.items():
+        constraints.append(x <= 1.0)
+
+    # build LP
+    objective = cp.Minimize(U)
+    problem = cp.Problem(objective, constraints)
+
+    return ProblemTask(t, u, problem, x_vars, U, capacities, background_w)
+
+
+def _bfb_one_timestep_build(G: nx.DiGraph, path_lengths: Dict[Node, Dict[Node, int]], nodes: List[Node], t: TimeStep,
+                            profiler: Profiler | None = None, background: Background | None = None) -> List[ProblemTask]:
+    problems_to_solve: List[ProblemTask] = []
+
+    for u in nodes:
+        with span(profiler, 'build LP', 'lp', t=t, u=u):
+            task = _build_problem_task(G, path_lengths, nodes, t, u, background)
+        if task is not None:
+            problems_to_solve.append(task)
+
+    return problems_to_solve
+
+
+def _sparsest_transfers(task: ProblemTask, load_U: float, time_limit: float) -> TransferMap | None:
+    """
+    second phase: keep the max workload at its optimum and minimize the number of nonzero transfers,
+    a small MILP with one indicator per (v, w) pair
+    """
+    pairs = list(task.x_vars.keys())
+    x = {p: cp.Variable(nonneg=True) for p in pairs}
+    y = {p: cp.Variable(boolean=True) for p in pairs}
+    bound = load_U * (1 + 1e-6) + 1e-9
+
+    constraints = []
+    for w in {w for (_, w) in pairs}:
+        constraints.append(cp.sum([x[p] for p in pairs if p[1] == w]) + task.background.get(w, 0.)
+                           <= bound * task.capacities.get(w, 1.0))
+    for v in {v for (v, _) in pairs}:
+        constraints.append(cp.sum([x[p] for p in pairs if p[0] == v]) == 1.0)
+    for p in pairs:
+        constraints.append(x[p] <= y[p])
+
+    problem = cp.Problem(cp.Minimize(cp.sum(list(y.values()))), constraints)
+    try:
+        problem.solve(solver=cp.SCIP, scip_params={'limits/time': time_limit})
+    except cp.SolverError:
+        return None
+
+    if problem.status not in ('optimal', 'optimal_inaccurate'):
+        return None
+
+    transfers: TransferMap = {}
+    for (v, w), var in x.items():
+        if var.value is not None and var.value > 1e-5:
+            transfers[TransferKey(v, w)] = Fraction(var.value.item())
+    return transfers
+
+
+def _record_solve(profiler: Profiler, task: ProblemTask, start: float, submitted: float | None) -> None:
+    """
+    split the solve of one LP into cvxpy canonicalization and solver time, with the LP size
+    """
+    problem = task.problem
+    end = time.perf_counter()
+    args: Dict[str, Any] = {'t': task.t, 'u': task.u}
+    if submitted is not None:
+        args['queue_wait_ms'] = (start - submitted) * 1e3
+    sizes = problem.size_metrics
+    args['num_vars'] = sizes.num_scalar_variables
+    args['num_constraints'] = sizes.num_scalar_eq_constr + sizes.num_scalar_leq_constr
+
+    compile_time = getattr(problem, 'compilation_time', None) or 0.
+    stats = problem.solver_stats
+    solver_time = stats.solve_time if stats is not None and stats.solve_time is not None else None
+    profiler.record('solve LP', 'lp', start, end - start, **args)
+    profiler.record('canonicalize', 'lp', start, compile_time, t=task.t)
+    if solver_time is not None:
+        profiler.record('solver', 'lp', start + compile_time, solver_time, t=task.t)
+
+
+def _solve_problem_task(task: ProblemTask, print_detail: bool = False, sparsify: bool = False,
+                        sparsify_time_limit: float = 10., profiler: Profiler | None = None,
+                        submitted: float | None = None) -> Tuple[TimeStep, Node, ScheduleEntry | None, int]:
+    """
+    solves a single LP problem from the buffer
+    submitted: perf_counter time the task was queued, for the queue wait of the profiler
+    return: t, u, schedule entry, number of transfers before sparsification
+    """
+    t, u, problem = task.t, task.u, task.problem
+
+    try:
+        # Solve the LP problem
+        if profiler is not None:
+            start = time.perf_counter()
+            problem.solve(solver=cp.SCIP)
+            _record_solve(profiler, task, start, submitted)
+        else:
+            problem.solve(solver=cp.SCIP)
+    except cp.SolverError:
+        if print_detail:
+            print(f"Solver failed for node {u} at step {t}")
+        return (t, u, None, 0)
+
+    with span(profiler, 'extract', 'lp', t=t):
+        return _extract_result(task, sparsify, sparsify_time_limit)
+
+
+def _extract_result(task: ProblemTask, sparsify: bool, sparsify_time_limit: float) -> Tuple[TimeStep, Node, ScheduleEntry | None, int]:
+    t, u, problem, x_vars, U = task.t, task.u, task.problem, task.x_vars, task.U
+
+    # save results
+    u_schedule: TransferMap = {}
+    if problem.status == 'optimal':
+        for (v, w), var in x_vars.items():
+            if var.value is not None and var.value > 1e-5:
+                # v is the source, w is the via node (neighbor of u)
+                u_schedule[TransferKey(v, w)] = Fraction(var.value.item())
+
+        if u_schedule and U.value is not None:
+            num_transfers = len(u_schedule)
+            load_U = U.value.item()
+
+            if sparsify and num_transfers > len({v for (v, _) in u_schedule}):
+                sparse_schedule = _sparsest_transfers(
+                    task, load_U, sparsify_time_limit)
+                if sparse_schedule and len(sparse_schedule) < num_transfers:
+                    u_schedule = sparse_schedule
+                    # the MILP bound has a small slack, report what the links carry
+                    link_loads: Dict[Node, float] = dict(task.background)
+                    for (_, w), fraction in u_schedule.items():
+                        link_loads[w] = link_loads.get(w, 0.0) + fraction
+                    load_U = max(load / task.capacities.get(w, 1.0) for w, load in link_loads.items())
+
+            # Use the provided ScheduleEntry type structure
+            schedule_entry = ScheduleEntry(
+                load_U=load_U,
+                transfers=u_schedule
+            )
+            return (t, u, schedule_entry, num_transfers)
+        else:
+            return (t, u, None, 0)
+    else:
+        # The 'optimal' status check covers 'infeasible', 'unbounded', etc.
+        return (t, u, None, 0)
+
+
+def _solve_problem_buffer(problem_buffer: List[ProblemTask], desc: str, print_detail: bool = False,
+                          sparsify: bool = False, profiler: Profiler | None = None) -> List[Tuple[TimeStep, Node, ScheduleEntry | None, int]]:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        submitted = time.perf_counter() if profiler is not None else None
+        results_iterator = executor.map(
+            lambda task: _solve_problem_task(task, print_detail, sparsify, profiler=profiler, submitted=submitted), problem_buffer)
+
+        if print_detail:
+            return list(tqdm(results_iterator, total=len(
+                problem_buffer), desc=desc, unit='problem', leave=True))
+        else:
+            return list(results_iterator)
+
+
+def BFB(G: nx.DiGraph, print_detail: bool = True, sparsify: bool = False, profiler: Profiler | None = None,
+        background: Background | None = None) -> Schedule:
     """
     calculate breadth-first-broadcast (BFB) schedule
+    links have the bandwidth of their `capacity` edge attribute, 1 by default, load_U is in time units
+    sparsify: after each LP, re-solve with the optimal load fixed for the fewest nonzero transfers
+    profiler: records the phases and every LP (build, queue wait, canonicalization, solve, extraction)
+    background: (t, w, u) -> load of other jobs on link w -> u at step t, in shards, see `contention.rebalance`;
+        load_U then includes the background
     return: dict of schedule
     return type: `schedule[time_step][dest_node] = {'load_U': float, 'transfers': dict (src, ngh) -> fraction`}
     """
 
     time_begin = time.time()
 
-    path_lengths = dict(nx.all_pairs_shortest_path_length(G))
+    with span(profiler, 'shortest paths'):
+        path_lengths = dict(nx.all_pairs_shortest_path_length(G))
     nodes = list(G.nodes())
 
     try:
@@ -29,117 +277,15 @@ def BFB(G: nx.DiGraph, print_detail: bool = True) -> Schedule:
     if print_detail:
         print(f'Diameter: {diameter}')
 
-    class ProblemTask:
-        def __init__(self, t: TimeStep, u: Node, problem: cp.Problem, x_vars: Dict[Tuple[Node, Node], cp.Variable], U: cp.Variable):
-            self.t = t
-            self.u = u
-            self.problem = problem
-            self.x_vars = x_vars
-            self.U = U
-
-    def _bfb_one_timestep_build(t: TimeStep) -> List[ProblemTask]:
-        problems_to_solve: List[ProblemTask] = []
-
-        for u_index, u in enumerate(nodes):
-            sources_v = [v for v in nodes if path_lengths[v].get(u) == t]
-            if not sources_v:
-                continue
-
-            neighbors_w = list(G.predecessors(u))
-
-            # LP vars
-            U = cp.Variable(nonneg=True, name=f"U_{u}_{t}")
-            x_vars = {}
-            valid_pairs = []
-
-            for v in sources_v:
-                for w in neighbors_w:
-                    if path_lengths[v].get(w) == t - 1:
-                        valid_pairs.append((v, w))
-                        var = cp.Variable(
-                            nonneg=True, name=f"x_{v}_{w}_{u}_{t}")
-                        x_vars[(v, w)] = var
-
-            # LP constraints
-            constraints = []
-
-            # 1st constraints: correct max workload
-            for w in neighbors_w:
-                relevant_vs = [v for (v, ngh) in valid_pairs if ngh == w]
-                if relevant_vs:
-                    constraints.append(
-                        cp.sum([x_vars[(v, w)] for v in relevant_vs]) <= U)
-
-            # 2nd constraints: u receiving all data shards
-            has_valid_flow = False
-            for v in sources_v:
-                relevant_ws = [w for (src, w) in valid_pairs if src == v]
-
-                # Check if there are any valid paths for v to u
-                if relevant_ws:
-                    constraints.append(
-                        cp.sum([x_vars[(v, w)] for w in relevant_ws]) == 1.0)
-                    has_valid_flow = True
-                # If not, skip this source/dest pair as it's impossible to complete the flow.
-                else:
-                    continue
-
-            # If no source has a valid path (w) to the destination u, skip this LP
-            if not has_valid_flow and sources_v:
-                continue
-
-            # 3rd constraints: valid x_vars
-            for (v, w), x in x_vars.items():
-                constraints.append(x <= 1.0)
-
-            # build LP
-            objective = cp.Minimize(U)
-            problem = cp.Problem(objective, constraints)
-
-            # Store the task information
-            problems_to_solve.append(ProblemTask(t, u, problem, x_vars, U))
-
-        return problems_to_solve
-
-    def _solve_problem_task(task: ProblemTask) -> Tuple[TimeStep, Node, ScheduleEntry | None]:
-        # This function solves a single LP problem from the buffer.
-        t, u, problem, x_vars, U = task.t, task.u, task.problem, task.x_vars, task.U
-
-        try:
-            # Solve the LP problem
-            problem.solve(solver=cp.SCIP)
-        except cp.SolverError:
-            if print_detail:
-                print(f"Solver failed for node {u} at step {t}")
-            return (t, u, None)
-
-        # save results
-        u_schedule: TransferMap = {}
-        if problem.status == 'optimal':
-            for (v, w), var in x_vars.items():
-                if var.value is not None and var.value > 1e-5:
-                    # v is the source, w is the via node (neighbor of u)
-                    u_schedule[TransferKey(v, w)] = Fraction(var.value.item())
-
-            if u_schedule and U.value is not None:
-                # Use the provided ScheduleEntry type structure
-                schedule_entry = ScheduleEntry(
-                    load_U=U.value.item() if U.value is not None else float('-inf'),
-                    transfers=u_schedule
-                )
-                return (t, u, schedule_entry)
-            else:
-                return (t, u, None)
-        else:
-            # The 'optimal' status check covers 'infeasible', 'unbounded', etc.
-            return (t, u, None)
-
     full_schedule: Schedule = {}
+    messages_before: Dict[TimeStep, int] = {}
 
     for t in range(1, diameter + 1):
         current_t = TimeStep(t)
 
-        problem_buffer: List[ProblemTask] = _bfb_one_timestep_build(current_t)
+        with span(profiler, 'build', t=t):
+            problem_buffer: List[ProblemTask] = _bfb_one_timestep_build(
+                G, path_lengths, nodes, current_t, profiler, background)
 
         if not problem_buffer:
             continue
@@ -148,29 +294,156 @@ def BFB(G: nx.DiGraph, print_detail: bool = True) -> Schedule:
             print(
                 f'Time Step {current_t}: Solving {len(problem_buffer)} LP problems in parallel...')
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-            results_iterator = executor.map(
-                _solve_problem_task, problem_buffer)
-
-            if print_detail:
-                results = list(tqdm(results_iterator, total=len(
-                    problem_buffer), desc=f'Solving t={current_t} problems', unit='problem', leave=True))
-            else:
-                results = list(results_iterator)
+        with span(profiler, 'solve', t=t, num_problems=len(problem_buffer)):
+            results = _solve_problem_buffer(
+                problem_buffer, f'Solving t={current_t} problems', print_detail, sparsify, profiler)
 
         full_schedule[current_t] = {}
-        for _, u, schedule_entry in results:
+        messages_before[current_t] = 0
+        for _, u, schedule_entry, num_transfers in results:
             if schedule_entry is not None:
                 full_schedule[current_t][u] = schedule_entry
+                messages_before[current_t] += num_transfers
 
     time_end = time.time()
 
     if print_detail:
+        if sparsify:
+            messages_after = utils.message_stats(full_schedule)
+            for t, before in messages_before.items():
+                print(
+                    f'Time Step {t}: {before} messages before sparsification, {messages_after.get(t, 0)} after')
         print(f'\nBFB search time cost: {(time_end - time_begin):.3f}')
 
     return full_schedule
 
 
+def update_path_lengths(G: nx.DiGraph, path_lengths: Dict[Node, Dict[Node, int]],
+                        removed_edges: List[Tuple[Node, Node]], removed_nodes: List[Node] = []) -> Tuple[Dict[Node, Dict[Node, int]], List[Node]]:
+    """
+    shortest path lengths of G after removing edges and nodes, from the lengths before the removal,
+    only sources with a removed edge on one of their shortest paths are searched again
+    G: graph before the removal
+    return: new path lengths, sources whose row may have changed (including removed nodes)
+    """
+    removed_nodes = set(removed_nodes)
+    removed = set(removed_edges)
+    for x in removed_nodes:
+        removed.update(G.in_edges(x))
+        removed.update(G.out_edges(x))
+
+    G_new = G.copy()
+    G_new.remove_edges_from(removed)
+    G_new.remove_nodes_from(removed_nodes)
+
+    new_path_lengths: Dict[Node, Dict[Node, int]] = {}
+    changed: List[Node] = list(removed_nodes)
+
+    for v, lengths in path_lengths.items():
+        if v in removed_nodes:
+            continue
+
+        # an edge (a, b) only matters for v if it is tight, i.e. on a shortest path from v
+        tight = any(a in lengths and lengths.get(b) == lengths[a] + 1
+                    for a, b in removed)
+        if tight:
+            new_path_lengths[v] = nx.single_source_shortest_path_length(
+                G_new, v)
+            changed.append(v)
+        else:
+            new_path_lengths[v] = lengths
+
+    return new_path_lengths, changed
+
+
+def BFB_update(G: nx.DiGraph, A: Schedule, removed_edges: List[Tuple[Node, Node]] = [], removed_nodes: List[Node] = [],
+               path_lengths: Dict[Node, Dict[Node, int]] | None = None, print_detail: bool = True,
+               sparsify: bool = False) -> Tuple[nx.DiGraph, Schedule, Dict[Node, Dict[Node, int]]]:
+    """
+    incremental BFB after link or node failures,
+    only the (t, u) LPs whose sources or valid (v, w) pairs changed are solved again,
+    every other entry of A is reused
+    G, A: graph before the failure and its BFB schedule
+    path_lengths: `dict(nx.all_pairs_shortest_path_length(G))`, computed if None
+    return: graph after the failure, its BFB schedule, its path lengths
+    """
+    time_begin = time.time()
+
+    if path_lengths is None:
+        path_lengths = dict(nx.all_pairs_shortest_path_length(G))
+
+    removed_nodes = list(removed_nodes)
+    new_path_lengths, changed = update_path_lengths(
+        G, path_lengths, removed_edges, removed_nodes)
+
+    G_new = G.copy()
+    G_new.remove_edges_from(removed_edges)
+    G_new.remove_nodes_from(removed_nodes)
+    nodes = list(G_new.nodes())
+
+    # destinations which lost an in-link: every LP of theirs changes
+    lost_in_link = {b for (a, b) in removed_edges}
+    for x in removed_nodes:
+        lost_in_link.update(b for _, b in G.out_edges(x))
+
+    # LP (t, u) depends on d(v, u) and d(v, w) of the in-neighbours w of u
+    dirty: Dict[Node, set] = {}
+    for u in nodes:
+        targets = [u] + list(G_new.predecessors(u))
+        for v in changed:
+            old = path_lengths.get(v, {})
+            new = new_path_lengths.get(v, {})
+            if any(old.get(x) != new.get(x) for x in targets):
+                ts = dirty.setdefault(u, set())
+                ts.update(t for t in (old.get(u), new.get(u))
+                          if t is not None and t > 0)
+
+    try:
+        diameter = max(max(d.values()) for d in new_path_lengths.values())
+    except ValueError:
+        diameter = 0
+
+    full_schedule: Schedule = {}
+    num_solved = 0
+
+    for t in range(1, diameter + 1):
+        current_t = TimeStep(t)
+        old_step = A.get(current_t, {})
+        step_schedule: Dict[Node, ScheduleEntry] = {}
+
+        problem_buffer: List[ProblemTask] = []
+        for u in nodes:
+            if u in lost_in_link or current_t in dirty.get(u, ()):
+                task = _build_problem_task(
+                    G_new, new_path_lengths, nodes, current_t, u)
+                if task is not None:
+                    problem_buffer.append(task)
+            elif u in old_step:
+                step_schedule[u] = old_step[u]
+
+        if problem_buffer:
+            if print_detail:
+                print(
+                    f'Time Step {current_t}: Solving {len(problem_buffer)} of {len(nodes)} LP problems again...')
+            results = _solve_problem_buffer(
+                problem_buffer, f'Solving t={current_t} problems', print_detail, sparsify)
+            num_solved += len(problem_buffer)
+            for _, u, schedule_entry, _ in results:
+                if schedule_entry is not None:
+                    step_schedule[u] = schedule_entry
+
+        if step_schedule:
+            full_schedule[current_t] = step_schedule
+
+    time_end = time.time()
+
+    if print_detail:
+        print(f'\nBFB update: {num_solved} LP problems solved, {len(changed)} distance rows searched again')
+        print(f'BFB update time cost: {(time_end - time_begin):.3f}')
+
+    return G_new, full_schedule, new_path_lengths
+
+
 def _main1():
     G1 = nx.DiGraph()
     nodes = ['v1', 'v2', 'w1', 'w2', 'w3', 'u1', 'u2']
@@ -204,9 +477,28 @@ def _main2():
     # visualize_schedule(G3, A3, 5)
 
 
+def _main3():
+    import graph
+    G = graph.torus([6, 6])
+    path_lengths = dict(nx.all_pairs_shortest_path_length(G))
+
+    time_begin = time.time()
+    A = BFB(G, False)
+    time_full = time.time() - time_begin
+
+    failed = list(G.edges())[0]
+    time_begin = time.time()
+    G2, A2, _ = BFB_update(G, A, [failed], path_lengths=path_lengths)
+    time_update = time.time() - time_begin
+
+    print(f'full: {time_full:.3f}s, update: {time_update:.3f}s')
+    print(f'after failure of {failed}: {utils.get_TL_TB(G2, A2)}')
+    print(f'full solve after failure: {utils.get_TL_TB(G2, BFB(G2, False))}')
+
+
 if __name__ == "__main__":
     from visualize import *
     from graph import *
-    import utils
     # _main1()
     _main2()
+    # _main3()    # incremental update after a link failure
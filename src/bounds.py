@@ -0,0 +1,151 @@
+from typing import Tuple
+import numpy as np
+import networkx as nx
+
+import utils
+
+
+def moore_diameter(N: int, d: int) -> int:
+    '''
+    smallest diameter of a digraph with N nodes and out degree d (directed Moore bound):
+    at most d^k nodes are k hops away, so 1 + d + ... + d^D >= N
+    '''
+    if N <= 1:
+        return 0
+    if d <= 1:
+        return N - 1
+
+    D, reached, layer = 0, 1, 1
+    while reached < N:
+        layer *= d
+        reached += layer
+        D += 1
+    return D
+
+
+def optimal_TB(N: int) -> float:
+    '''
+    every node receives N - 1 shards through its in links, the same for every N-node graph
+    '''
+    return (N - 1) / N
+
+
+def meets_bounds(N: int, d: int, TL: float, TB: float, eps: float = 1e-4) -> bool:
+    '''
+    if True no (N, d) topology is better in TL or TB
+    '''
+    return TL <= moore_diameter(N, d) and TB <= optimal_TB(N) + eps
+
+
+def _adjacency(G: nx.DiGraph) -> Tuple['sp.csr_matrix', np.ndarray]:
+    '''
+    return: capacity weighted adjacency (row: from, column: to, unit capacity by default), node list in its order
+    '''
+    import scipy.sparse as sp
+    nodes = list(G.nodes())
+    A = nx.to_scipy_sparse_array(
+        G, nodelist=nodes, weight='capacity', dtype=np.float64, format='csr')
+    return sp.csr_matrix(A), np.array(nodes, dtype=object)
+
+
+def cut_TB_bound(G: nx.DiGraph, S_mask: np.ndarray, A: 'sp.csr_matrix | None' = None) -> float:
+    '''
+    every shard from outside S must cross into S at least once:
+    U >= |V - S| / c(V - S -> S), normalized like `utils.get_TL_TB`
+    S_mask: boolean array over G.nodes()
+    '''
+    if A is None:
+        A, _ = _adjacency(G)
+    N = len(S_mask)
+    outside = N - int(S_mask.sum())
+    if outside == 0 or outside == N:
+        return 0.0
+    cut = A[~S_mask][:, S_mask].sum()
+    return outside / cut * utils.min_in_capacity(G) / N
+
+
+def sweep_TB_bound(G: nx.DiGraph) -> Tuple[float, np.ndarray]:
+    '''
+    best cut bound over the prefixes and suffixes of the Fiedler vector order
+    of the symmetrized Laplacian, plus the single node cuts ((N - 1) / N for a regular graph)
+    return: bound, mask of the best S
+    '''
+    A, _ = _adjacency(G)
+    N = A.shape[0]
+    c_min = utils.min_in_capacity(G)
+
+    in_cap = np.asarray(A.sum(axis=0)).ravel()
+    best = (N - 1) / in_cap * c_min / N
+    best_u = int(np.argmax(best))
+    best_bound = float(best[best_u])
+    best_mask = np.zeros(N, dtype=bool)
+    best_mask[best_u] = True
+
+    if N <= 2:
+        return best_bound, best_mask
+
+    W = (A + A.T).toarray()
+    L = np.diag(W.sum(axis=1)) - W
+    _, vectors = np.linalg.eigh(L)
+    order = np.argsort(vectors[:, 1], kind='stable')
+
+    # cut(prefix k -> rest) and cut(rest -> prefix k) for every k, via prefix sums of the reordered matrix
+    P = A.toarray()[np.ix_(order, order)]
+    C = P.cumsum(axis=0).cumsum(axis=1)
+    total_out = C[:, -1]                # prefix rows, all columns
+    total_in = C[-1, :]                 # all rows, prefix columns
+    k = np.arange(1, N)
+    inner = C[k - 1, k - 1]
+    into_prefix = total_in[k - 1] - inner
+    into_suffix = total_out[k - 1] - inner
+
+    with np.errstate(divide='ignore'):
+        prefix_bounds = np.where(into_prefix > 0, (N - k) / into_prefix, np.inf)
+        suffix_bounds = np.where(into_suffix > 0, k / into_suffix, np.inf)
+    candidates = np.concatenate([prefix_bounds, suffix_bounds]) * c_min / N
+
+    i = int(np.argmax(candidates))
+    if candidates[i] > best_bound:
+        best_bound = float(candidates[i])
+        best_mask = np.zeros(N, dtype=bool)
+        if i < N - 1:
+            best_mask[order[:i + 1]] = True
+        else:
+            best_mask[order[i - (N - 1) + 1:]] = True
+
+    return best_bound, best_mask
+
+
+def TL_TB_bounds(G: nx.DiGraph) -> Tuple[int, float]:
+    '''
+    lower bounds of TL and TB of any allgather on G
+    '''
+    N = G.number_of_nodes()
+    d = max(dict(G.out_degree()).values())
+    return moore_diameter(N, d), sweep_TB_bound(G)[0]
+
+
+def _main1():
+    for N, d in [(8, 2), (16, 2), (16, 4), (256, 4)]:
+        print(f'N = {N}, d = {d}: Moore diameter = {moore_diameter(N, d)}')
+
+    cases = {
+        'BiRing(16)': graph.ring(16, False),
+        'Torus(4, 4)': graph.torus([4, 4]),
+        'C(16, [2, 3])': graph.circulant_graph(16, [2, 3]),
+    }
+    # two K(8) joined by a single pair of links, the bisection is the bottleneck
+    G = nx.disjoint_union(graph.complete_graph(8), graph.complete_graph(8))
+    G.add_edges_from([(0, 8), (8, 0)])
+    cases['2 x K(8)'] = G
+
+    for name, G in cases.items():
+        TL, TB = TL_TB_bounds(G)
+        A = BFB(G, False)
+        print(f'{name}: bounds TL >= {TL}, TB >= {TB:.4f}, BFB {utils.get_TL_TB(G, A)}')
+
+
+if __name__ == '__main__':
+    from bfb_schedule import BFB
+    import graph
+    _main1()
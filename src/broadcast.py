@@ -0,0 +1,166 @@
+from typing import Callable, Dict, List
+import numpy as np
+import networkx as nx
+
+from schedule_type import *
+import utils
+from profiling import Profiler, span
+
+
+def broadcast_schedule(G: nx.DiGraph, root: Node, print_detail: bool = False, sparsify: bool = False,
+                       profiler: Profiler | None = None) -> Schedule:
+    '''
+    `BFB` with the root's shard only: node u at distance t from the root receives the whole shard at step t
+    from its in neighbors at distance t - 1, one BFB LP per (t, u) spreads it over their links
+    return: `Schedule` whose transfers all have from_node root, `pipeline.pipeline_schedule` overlaps the layers
+    '''
+    from bfb_schedule import _build_problem_task, _solve_problem_buffer
+
+    with span(profiler, 'shortest paths'):
+        path_lengths = {root: nx.single_source_shortest_path_length(G, root)}
+    assert len(path_lengths[root]) == G.number_of_nodes(), "not connected graph"
+    diameter = max(path_lengths[root].values())
+
+    A: Schedule = {}
+    for t in range(1, diameter + 1):
+        current_t = TimeStep(t)
+        with span(profiler, 'build', t=t):
+            tasks = [task for u in G.nodes()
+                     if (task := _build_problem_task(G, path_lengths, [root], current_t, u)) is not None]
+        with span(profiler, 'solve', t=t, num_problems=len(tasks)):
+            results = _solve_problem_buffer(tasks, f'Solving t={current_t} problems', print_detail, sparsify, profiler)
+        A[current_t] = {u: entry for _, u, entry, _ in results if entry is not None}
+    return A
+
+
+def scatter_schedule(G: nx.DiGraph, root: Node) -> Schedule:
+    '''
+    the root holds one shard for every other node v and sends it to v along the distance layers of the root:
+    the shard of v crosses link w -> x at step t = dist(root, x) when x is on a shortest path to v,
+    one LP over all shards minimizes the sum of the per-step max link loads, solved with HiGHS
+    return: `Schedule` where from_node is the shard, i.e. its destination, as in `collective.reverse_schedule`
+    '''
+    import scipy.sparse as sp
+    from scipy.optimize import linprog
+
+    dist_root = nx.single_source_shortest_path_length(G, root)
+    assert len(dist_root) == G.number_of_nodes(), "not connected graph"
+    diameter = max(dist_root.values())
+    R = G.reverse(copy=False)
+
+    # variables: (shard v, link w -> x) on the shortest paths from the root to v, then U_t for t = 1..diameter
+    keys = []
+    for v in G.nodes():
+        if v == root:
+            continue
+        dist_v = nx.single_source_shortest_path_length(R, v)
+        for w, x in G.edges():
+            t = dist_root[x]
+            if dist_root[w] == t - 1 and t + dist_v.get(x, np.inf) == dist_root[v]:
+                keys.append((v, w, x))
+    F = len(keys)
+
+    rows, cols, vals = [], [], []
+    # flow conservation at every node but the root: in - out is 1 at v and 0 on the way
+    balance = {}
+    for i, (v, w, x) in enumerate(keys):
+        for node, sign in ((x, 1.), (w, -1.)):
+            if node != root:
+                rows.append(balance.setdefault((v, node), len(balance)))
+                cols.append(i)
+                vals.append(sign)
+    A_eq = sp.csr_matrix((vals, (rows, cols)), shape=(len(balance), F + diameter))
+    b_eq = np.array([1. if v == node else 0. for v, node in balance])
+
+    # link loads: the shards on w -> x at step dist(root, x) fit U_t times its capacity
+    links = {}
+    rows, cols, vals = [], [], []
+    for i, (v, w, x) in enumerate(keys):
+        rows.append(links.setdefault((w, x), len(links)))
+        cols.append(i)
+        vals.append(1.)
+    for (w, x), j in links.items():
+        rows.append(j)
+        cols.append(F + dist_root[x] - 1)
+        vals.append(-utils.link_capacity(G, w, x))
+    A_ub = sp.csr_matrix((vals, (rows, cols)), shape=(len(links), F + diameter))
+
+    c = np.zeros(F + diameter)
+    c[F:] = 1.
+    result = linprog(c, A_ub=A_ub, b_ub=np.zeros(len(links)), A_eq=A_eq, b_eq=b_eq,
+                     bounds=(0, None), method='highs')
+    assert result.status == 0, result.message
+
+    A: Schedule = {}
+    for (v, w, x), fraction in zip(keys, result.x[:F]):
+        if fraction > 1e-9:
+            entry = A.setdefault(TimeStep(dist_root[x]), {}).setdefault(x, ScheduleEntry(load_U=0.0, transfers={}))
+            entry['transfers'][TransferKey(v, w)] = Fraction(fraction.item())
+    A = {t: A[t] for t in sorted(A)}
+    return utils.update_load_U(A, G)
+
+
+def all_roots(G: nx.DiGraph, build: Callable[[nx.DiGraph, Node], Schedule], action=None,
+              roots: List[Node] | None = None) -> Dict[Node, Schedule]:
+    '''
+    the schedule of every root, e.g. build = `broadcast_schedule` or `scatter_schedule`
+    action: automorphisms of G as in `symmetric`, build only runs for one root per orbit and
+        root g(r) gets the schedule of r relabelled by g; a single solve for vertex-transitive graphs
+    '''
+    from collective import relabel_schedule
+
+    roots = list(G.nodes()) if roots is None else roots
+    if action is None:
+        return {root: build(G, root) for root in roots}
+
+    solved: Dict[Node, Schedule] = {}
+    schedules: Dict[Node, Schedule] = {}
+    for root in roots:
+        r, g = action.locate(root)
+        if r not in solved:
+            solved[r] = build(G, r)
+        schedules[root] = relabel_schedule(solved[r], lambda x, g=g: action(g, x))
+    return schedules
+
+
+def validate_broadcast(G: nx.DiGraph, A: Schedule, root: Node, tol: float = 1e-6) -> List[str]:
+    return utils.validate_schedule(G, A, tol, initial={root: [root]}, required={u: [root] for u in G.nodes()})
+
+
+def validate_scatter(G: nx.DiGraph, A: Schedule, root: Node, tol: float = 1e-6) -> List[str]:
+    return utils.validate_schedule(G, A, tol, initial={root: list(G.nodes())}, required={u: [u] for u in G.nodes()})
+
+
+def _main1():
+    import time
+    import graph
+    from pipeline import pipeline_schedule
+    from symmetric import torus_action
+
+    G = graph.torus([4, 4])
+    N = G.number_of_nodes()
+    A = broadcast_schedule(G, (0, 0))
+    print(f'broadcast: {utils.get_schedule_TL_TB(G, A)}, shard time U = {utils.schedule_U(A):.4f}, '
+          f'pipelined in 8 chunks: {utils.schedule_U(pipeline_schedule(A, 8, G)):.4f}, '
+          f'{len(validate_broadcast(G, A, (0, 0)))} errors')
+
+    A = scatter_schedule(G, (0, 0))
+    out_capacity = sum(utils.link_capacity(G, (0, 0), x) for x in G.successors((0, 0)))
+    print(f'scatter: {utils.get_schedule_TL_TB(G, A)}, U = {utils.schedule_U(A):.4f} '
+          f'(root out links need {(N - 1) / out_capacity:.4f}), {len(validate_scatter(G, A, (0, 0)))} errors')
+
+    for build in (broadcast_schedule, scatter_schedule):
+        begin = time.perf_counter()
+        every = all_roots(G, build)
+        middle = time.perf_counter()
+        reused = all_roots(G, build, torus_action([4, 4]))
+        end = time.perf_counter()
+        validate = validate_broadcast if build is broadcast_schedule else validate_scatter
+        errors = sum(len(validate(G, reused[root], root)) for root in G.nodes())
+        same = all(abs(utils.schedule_U(every[root]) - utils.schedule_U(reused[root])) < 1e-6 for root in G.nodes())
+        print(f'{build.__name__} of all roots: {middle - begin:.2f} s solved, {end - middle:.2f} s reused, '
+              f'{errors} errors, same U: {same}')
+
+
+if __name__ == '__main__':
+    _main1()
@@ -0,0 +1,147 @@
+from typing import Iterable, List, Tuple
+import sqlite3
+
+from topology_finder import TopologyEntry, TopologyFinder
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS topology (
+    id INTEGER PRIMARY KEY,
+    N INTEGER NOT NULL,
+    d INTEGER NOT NULL,
+    topology TEXT NOT NULL,
+    TL INTEGER NOT NULL,
+    TB REAL NOT NULL,
+    BW_optimal INTEGER NOT NULL,
+    nest_level INTEGER NOT NULL,
+    UNIQUE (N, d, topology)
+);
+CREATE INDEX IF NOT EXISTS topology_N_d_TL_TB ON topology (N, d, TL, TB);
+CREATE INDEX IF NOT EXISTS topology_d_TL ON topology (d, TL);
+'''
+
+_COLUMNS = 'N, d, topology, TL, TB, BW_optimal, nest_level'
+
+
+class Catalog:
+    '''
+    topology entries persisted in SQLite, indexed on (N, d, TL, TB),
+    the rows of one (N, d) are the Pareto frontier of that cell as written by `write_finder`
+    '''
+
+    def __init__(self, path: str = 'topologies.db') -> None:
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> 'Catalog':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _insert(self, tps: Iterable[TopologyEntry], batch_size: int) -> int:
+        count = 0
+        sql = f'INSERT OR REPLACE INTO topology ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)'
+        batch = []
+        for tp in tps:
+            batch.append((tp.N, tp.d, tp.topology, tp.TL,
+                         tp.TB, int(tp.BW_optimal), tp.nest_level))
+            if len(batch) >= batch_size:
+                self.conn.executemany(sql, batch)
+                count += len(batch)
+                batch.clear()
+        self.conn.executemany(sql, batch)
+        count += len(batch)
+        return count
+
+    def write(self, tps: Iterable[TopologyEntry], batch_size: int = 10000,
+              replace_up_to: Tuple[int, int] | None = None) -> int:
+        '''
+        bulk insert in one transaction, an entry already stored for its (N, d, topology) is replaced
+        replace_up_to: (max_N, max_d), delete the entries of these cells first, in the same transaction
+        return: number of written entries
+        '''
+        self.conn.execute('PRAGMA synchronous=OFF')
+        try:
+            with self.conn:
+                if replace_up_to is not None:
+                    self.conn.execute('DELETE FROM topology WHERE N <= ? AND d <= ?', replace_up_to)
+                return self._insert(tps, batch_size)
+        finally:
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+
+    def write_finder(self, tf: TopologyFinder) -> int:
+        '''
+        replace the cells covered by tf with its table, call after `tf.search()`,
+        readers see either the old or the new cells
+        '''
+        return self.write((tp for cells in tf.topology_table.values() for tps in cells.values() for tp in tps),
+                          replace_up_to=(tf.max_N, tf.max_d))
+
+    def query(self, N_min: int = 1, N_max: int | None = None, d_min: int = 1, d_max: int | None = None,
+              TL_max: int | None = None, TB_max: float | None = None, limit: int | None = None) -> List[TopologyEntry]:
+        '''
+        entries with N in [N_min, N_max], d in [d_min, d_max], TL <= TL_max and TB <= TB_max,
+        None for no limit, sorted by (N, d, TL, TB)
+        '''
+        conditions = ['N >= ?', 'd >= ?']
+        params: list = [N_min, d_min]
+        for column, op, value in (('N', '<=', N_max), ('d', '<=', d_max), ('TL', '<=', TL_max), ('TB', '<=', TB_max)):
+            if value is not None:
+                conditions.append(f'{column} {op} ?')
+                params.append(value)
+
+        sql = f'SELECT {_COLUMNS} FROM topology WHERE {" AND ".join(conditions)} ORDER BY N, d, TL, TB'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        return [TopologyEntry(N, d, topology, TL, TB, bool(bw), nest)
+                for N, d, topology, TL, TB, bw, nest in self.conn.execute(sql, params)]
+
+    def frontier(self, N: int, d: int) -> List[TopologyEntry]:
+        return self.query(N, N, d, d)
+
+    def best(self, N: int, d: int) -> TopologyEntry | None:
+        '''
+        return: entry of (N, d) with the lowest (TL, TB)
+        '''
+        tps = self.query(N, N, d, d, limit=1)
+        return tps[0] if tps else None
+
+    def count(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM topology').fetchone()[0]
+
+
+def _main1():
+    import os
+    import tempfile
+    import time
+
+    path = os.path.join(tempfile.mkdtemp(), 'topologies.db')
+
+    tf = TopologyFinder(1024, 4)
+    tf.search()
+    with Catalog(path) as catalog:
+        begin = time.perf_counter()
+        written = catalog.write_finder(tf)
+        print(f'wrote {written} entries in {(time.perf_counter() - begin) * 1e3:.1f} ms')
+
+    # a fresh process only opens the file
+    with Catalog(path) as catalog:
+        begin = time.perf_counter()
+        tps = catalog.query(N_min=100, N_max=500, d_max=4, TL_max=6)
+        print(f'{len(tps)} entries with N in [100, 500], d <= 4, TL <= 6 in {(time.perf_counter() - begin) * 1e3:.2f} ms')
+        for tp in tps[:5]:
+            tp.print()
+        print('best (256, 4):')
+        catalog.best(256, 4).print()
+
+
+if __name__ == '__main__':
+    _main1()
@@ -0,0 +1,254 @@
+'''
+command line entry point, heavy modules (cvxpy, matplotlib, scipy) are imported only by the commands using them
+'''
+from typing import Any, Dict, List
+import argparse
+import json
+import sys
+import time
+
+
+def cmd_find(args: argparse.Namespace) -> int:
+    if args.catalog:
+        from catalog import Catalog
+        with Catalog(args.catalog) as catalog:
+            tps = catalog.frontier(args.N, args.d)
+        if tps:
+            for tp in tps if args.frontier else tps[:1]:
+                tp.print()
+            return 0
+
+    from planner import Planner
+    planner = Planner()
+    if args.frontier:
+        tps = planner.frontier(args.N, args.d)
+    else:
+        best = planner.best(args.N, args.d)
+        tps = [best] if best is not None else []
+
+    if not tps:
+        print(f'no construction for N = {args.N}, d = {args.d}')
+        return 1
+    for tp in tps:
+        tp.print()
+    return 0
+
+
+def cmd_table(args: argparse.Namespace) -> int:
+    from topology_finder import TopologyFinder
+    tf = TopologyFinder(args.max_N, args.max_d)
+    tf.search(print_tqdm=not args.quiet)
+    if args.catalog:
+        from catalog import Catalog
+        with Catalog(args.catalog) as catalog:
+            print(f'{catalog.write_finder(tf)} entries written to {args.catalog}')
+    else:
+        tf.print_topologies()
+    return 0
+
+
+def _apply_expansions(G, A, ops: List[str]):
+    import expansion
+    from pipeline import pipeline_schedule
+    for op in ops:
+        name, _, arg = op.partition(':')
+        if name == 'line':
+            G, A = expansion.line_graph_expansion(G, A)
+        elif name == 'degree':
+            G, A = expansion.degree_expansion(G, A, int(arg or 2))
+        elif name == 'pipeline':
+            A = pipeline_schedule(A, int(arg), G)
+        else:
+            raise ValueError(f"unknown expansion '{op}', expected line, degree:n or pipeline:k")
+    return G, A
+
+
+def run_job(job: Dict[str, Any], profiler=None) -> Dict[str, Any]:
+    '''
+    one job: {"graph": spec, "expand": [ops], "sparsify": bool, "output": schedule path, "validate": bool},
+    see `graph.from_spec` for specs and `_apply_expansions` for ops
+    profiler: `profiling.Profiler` recording the BFB of the job
+    '''
+    import graph
+    import utils
+    from bfb_schedule import BFB
+
+    begin = time.perf_counter()
+    G = graph.from_spec(job['graph'])
+    A = BFB(G, False, sparsify=job.get('sparsify', False), profiler=profiler)
+    G, A = _apply_expansions(G, A, job.get('expand', []))
+
+    TL, TB = utils.get_schedule_TL_TB(G, A)
+    result = {'graph': job['graph'], 'expand': job.get('expand', []),
+              'N': G.number_of_nodes(), 'TL': TL, 'TB': TB}
+    if job.get('validate', False):
+        result['errors'] = utils.validate_schedule(G, A)
+    if job.get('output'):
+        utils.save_schedule(A, job['output'])
+        result['output'] = job['output']
+    result['seconds'] = time.perf_counter() - begin
+    return result
+
+
+def _print_result(r: Dict[str, Any]) -> None:
+    name = r['graph'] + ''.join(f' -> {op}' for op in r['expand'])
+    line = f"{name}: N = {r['N']}, TL = {r['TL']}, TB = {r['TB']:.4f}, {r['seconds']:.2f} s"
+    if 'errors' in r:
+        line += f", {len(r['errors'])} errors"
+    print(line)
+
+
+def cmd_schedule(args: argparse.Namespace) -> int:
+    job = {'graph': args.graph, 'expand': args.expand, 'sparsify': args.sparsify,
+           'output': args.output, 'validate': args.validate}
+
+    profiler = None
+    if args.profile:
+        from profiling import Profiler, ChromeTraceSink, SummarySink
+        profiler = Profiler([ChromeTraceSink(args.profile), SummarySink()])
+
+    result = run_job(job, profiler)
+    if profiler is not None:
+        profiler.close()
+    _print_result(result)
+    for error in result.get('errors', []):
+        print(f'    {error}')
+    return 1 if result.get('errors') else 0
+
+
+def _schedule_graph(spec: str, ops: List[str]):
+    '''
+    graph of a saved schedule: the base graph with the graph-changing expansions applied
+    '''
+    import graph
+    G, _ = _apply_expansions(graph.from_spec(spec), None,
+                             [op for op in ops if op.startswith(('line', 'degree'))])
+    return G
+
+
+def cmd_expand(args: argparse.Namespace) -> int:
+    import utils
+    G = _schedule_graph(args.graph, args.expand)
+    A = utils.load_schedule(args.schedule)
+    G, A = _apply_expansions(G, A, args.ops)
+    utils.save_schedule(A, args.output)
+    print(f'N = {G.number_of_nodes()}, TL/TB = {utils.get_schedule_TL_TB(G, A)}, written to {args.output}')
+    return 0
+
+
+def cmd_validate(args: argparse.Namespace) -> int:
+    import utils
+    G = _schedule_graph(args.graph, args.expand)
+    A = utils.load_schedule(args.schedule)
+    errors = utils.validate_schedule(G, A, args.tol)
+    for error in errors[:args.max_errors]:
+        print(error)
+    print(f'{len(errors)} errors' if errors else 'valid')
+    return 1 if errors else 0
+
+
+def read_jobs(path: str) -> List[Dict[str, Any]]:
+    '''
+    a JSON list of jobs, or one JSON job per line
+    '''
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def cmd_batch(args: argparse.Namespace) -> int:
+    import concurrent.futures
+    jobs = read_jobs(args.jobs)
+    results = []
+    # one pool for the whole batch, every worker imports cvxpy once
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(run_job, job): i for i, job in enumerate(jobs)}
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                r = future.result()
+            except Exception as e:
+                r = {'graph': jobs[i].get('graph'), 'error': repr(e)}
+                print(f"{r['graph']}: {r['error']}")
+            else:
+                _print_result(r)
+            results.append((i, r))
+
+    results = [r for _, r in sorted(results, key=lambda item: item[0])]
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if any('error' in r or r.get('errors') for r in results) else 0
+
+
+def cmd_bench(args: argparse.Namespace) -> int:
+    import benchmark
+    benchmark.main(args.rest)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='efficient-direct', description=__doc__)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('find', help='best topology for N nodes of degree d')
+    p.add_argument('N', type=int)
+    p.add_argument('d', type=int)
+    p.add_argument('--frontier', action='store_true', help='print the whole (TL, TB) Pareto frontier')
+    p.add_argument('--catalog', help='answer from this SQLite catalog if it has the cell')
+    p.set_defaults(func=cmd_find)
+
+    p = sub.add_parser('table', help='fill the topology table up to (max_N, max_d)')
+    p.add_argument('max_N', type=int)
+    p.add_argument('max_d', type=int)
+    p.add_argument('--catalog', help='write to this SQLite catalog instead of printing')
+    p.add_argument('-q', '--quiet', action='store_true')
+    p.set_defaults(func=cmd_table)
+
+    p = sub.add_parser('schedule', help='BFB schedule of a graph, optionally expanded')
+    p.add_argument('graph', help='e.g. torus:4,4, circulant:16,2,3, kautz:2,12')
+    p.add_argument('-e', '--expand', action='append', default=[], help='line, degree:n or pipeline:k, repeatable')
+    p.add_argument('-o', '--output', help='schedule JSON path')
+    p.add_argument('--sparsify', action='store_true')
+    p.add_argument('--validate', action='store_true')
+    p.add_argument('--profile', help='write a Chrome trace of BFB to this path')
+    p.set_defaults(func=cmd_schedule)
+
+    p = sub.add_parser('expand', help='expand a saved schedule')
+    p.add_argument('graph', help='base graph spec')
+    p.add_argument('schedule')
+    p.add_argument('ops', nargs='+', help='line, degree:n or pipeline:k')
+    p.add_argument('-e', '--expand', action='append', default=[], help='expansions that produced the saved schedule')
+    p.add_argument('-o', '--output', required=True)
+    p.set_defaults(func=cmd_expand)
+
+    p = sub.add_parser('validate', help='check a saved schedule')
+    p.add_argument('graph', help='base graph spec')
+    p.add_argument('schedule')
+    p.add_argument('-e', '--expand', action='append', default=[], help='expansions applied to the base graph')
+    p.add_argument('--tol', type=float, default=1e-6)
+    p.add_argument('--max-errors', type=int, default=20)
+    p.set_defaults(func=cmd_validate)
+
+    p = sub.add_parser('batch', help='run a job file over one worker pool')
+    p.add_argument('jobs', help='JSON list or JSON lines of schedule jobs')
+    p.add_argument('-w', '--workers', type=int, default=None)
+    p.add_argument('-o', '--output', help='results JSON path')
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser('bench', help='benchmark suite, arguments are passed to benchmark.py', add_help=False)
+    p.add_argument('rest', nargs=argparse.REMAINDER)
+    p.set_defaults(func=cmd_bench)
+
+    return parser
+
+
+def main(argv: List[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
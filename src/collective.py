@@ -0,0 +1,156 @@
+from typing import Callable, Dict, Tuple
+import networkx as nx
+
+from schedule_type import *
+import utils
+
+
+def relabel_schedule(A: Schedule, mapping: Dict[Node, Node] | Callable[[Node], Node]) -> Schedule:
+    '''
+    rename every node of A, mapping is a dict or a function
+    '''
+    f = mapping.__getitem__ if isinstance(mapping, dict) else mapping
+
+    A_prime: Schedule = {}
+    for t, step_schedule in A.items():
+        A_prime[t] = {}
+        for u, entry in step_schedule.items():
+            A_prime[t][f(u)] = {
+                'load_U': entry['load_U'],
+                'transfers': {TransferKey(f(v), f(w)): fraction
+                              for (v, w), fraction in entry['transfers'].items()}
+            }
+    return A_prime
+
+
+def reverse_schedule(A: Schedule, G: nx.DiGraph | None = None) -> Schedule:
+    '''
+    time-reverse and edge-transpose an allgather schedule of G^T into a reduce-scatter schedule of G
+    ((v, C), (w, u), t) of the allgather becomes ((v, C), (u, w), T + 1 - t):
+    u sends its partial reduction of chunk C of shard v to w, which finally reaches v
+    return type: `schedule[time_step][dest_node]`, the from_node of a transfer is the shard being reduced
+    G: graph the reduce-scatter runs on, for link capacities
+    '''
+    T = max(A.keys(), default=0)
+
+    A_prime: Schedule = {}
+    for t in sorted(A.keys(), reverse=True):
+        t_prime = TimeStep(T + 1 - t)
+        A_prime[t_prime] = {}
+
+        for u, entry in A[t].items():
+            for (v, w), fraction in entry['transfers'].items():
+                if w not in A_prime[t_prime]:
+                    A_prime[t_prime][w] = {'load_U': 0.0, 'transfers': {}}
+                transfers = A_prime[t_prime][w]['transfers']
+                key = TransferKey(v, u)
+                transfers[key] = transfers.get(key, Fraction(0)) + fraction
+
+    return utils.update_load_U(A_prime, G)
+
+
+def concat_schedules(A1: Schedule, A2: Schedule) -> Schedule:
+    '''
+    run A2 after the last time step of A1
+    '''
+    T1 = max(A1.keys(), default=0)
+
+    A_prime: Schedule = {}
+    for t, step_schedule in A1.items():
+        A_prime[t] = step_schedule
+    for t, step_schedule in A2.items():
+        A_prime[TimeStep(T1 + t)] = step_schedule
+    return A_prime
+
+
+def allreduce_schedule(A_rs: Schedule, A_ag: Schedule) -> Schedule:
+    '''
+    reduce-scatter followed by allgather,
+    time steps 1..T_rs reduce and T_rs+1..T_rs+T_ag gather
+    '''
+    return concat_schedules(A_rs, A_ag)
+
+
+def _transposed_BFB(G: nx.DiGraph, A_ag: Schedule, print_detail: bool) -> Schedule:
+    '''
+    BFB allgather of G^T, A_ag itself if G is symmetric
+    '''
+    from bfb_schedule import BFB
+
+    if all(G.has_edge(v, u) and utils.link_capacity(G, v, u) == utils.link_capacity(G, u, v) for u, v in G.edges()):
+        return A_ag
+    return BFB(G.reverse(copy=False), print_detail)
+
+
+def allreduce_BFB(G: nx.DiGraph, print_detail: bool = True) -> Tuple[Schedule, Schedule]:
+    '''
+    return: reduce-scatter schedule and allgather schedule of G
+    '''
+    from bfb_schedule import BFB
+
+    A_ag = BFB(G, print_detail)
+    return reverse_schedule(_transposed_BFB(G, A_ag, print_detail), G), A_ag
+
+
+def allreduce_line_graph(G: nx.DiGraph, print_detail: bool = True) -> Tuple[nx.DiGraph, Schedule, Schedule]:
+    '''
+    allreduce on L(G) from the BFB schedules of G and G^T:
+    L(G^T) is L(G)^T with every node (u, v) renamed to (v, u), so the expansion of the allgather of G^T
+    reversed is a reduce-scatter of L(G)
+    return: L(G), reduce-scatter schedule and allgather schedule
+    '''
+    import expansion
+    from bfb_schedule import BFB
+
+    A_ag = BFB(G, print_detail)
+    G_L, A_L = expansion.line_graph_expansion(G, A_ag)
+    _, A_L_T = expansion.line_graph_expansion(G.reverse(copy=False), _transposed_BFB(G, A_ag, print_detail))
+    A_rs = reverse_schedule(relabel_schedule(A_L_T, lambda e: (e[1], e[0])), G_L)
+    return G_L, A_rs, A_L
+
+
+def allreduce_degree_expansion(G: nx.DiGraph, n: int, print_detail: bool = True) -> Tuple[nx.DiGraph, Schedule, Schedule]:
+    '''
+    allreduce on G * n from the BFB schedules of G and G^T, G^T * n is (G * n)^T
+    return: G * n, reduce-scatter schedule and allgather schedule
+    '''
+    import expansion
+    from bfb_schedule import BFB
+
+    A_ag = BFB(G, print_detail)
+    G_D, A_D = expansion.degree_expansion(G, A_ag, n)
+    _, A_D_T = expansion.degree_expansion(G.reverse(copy=False), _transposed_BFB(G, A_ag, print_detail), n)
+    return G_D, reverse_schedule(A_D_T, G_D), A_D
+
+
+def get_allreduce_TL_TB(G: nx.DiGraph, A_rs: Schedule, A_ag: Schedule):
+    '''
+    TL, TB of reduce-scatter followed by allgather on G
+    '''
+    return utils.get_schedule_TL_TB(G, allreduce_schedule(A_rs, A_ag))
+
+
+def _main1():
+    G = graph.torus([3, 3])
+    A_rs, A_ag = allreduce_BFB(G, False)
+    print(f'allgather: {utils.get_TL_TB(G, A_ag)}')
+    print(f'reduce-scatter: {utils.get_schedule_TL_TB(G, A_rs)}')
+    print(f'allreduce: {get_allreduce_TL_TB(G, A_rs, A_ag)}')
+
+
+def _main2():
+    '''
+    allreduce on expanded graphs
+    '''
+    G = graph.generalized_kautz_graph(2, 6)
+    G_L, A_rs, A_ag = allreduce_line_graph(G, False)
+    print(f'line graph allreduce: {get_allreduce_TL_TB(G_L, A_rs, A_ag)}')
+    G_D, A_rs, A_ag = allreduce_degree_expansion(G, 2, False)
+    print(f'degree allreduce: {get_allreduce_TL_TB(G_D, A_rs, A_ag)}')
+
+
+if __name__ == '__main__':
+    from bfb_schedule import BFB
+    import graph
+    _main1()
+    _main2()
@@ -0,0 +1,321 @@
+from typing import Dict, List, Tuple, NamedTuple, TypedDict
+import json
+import math
+import struct
+import networkx as nx
+
+from schedule_type import *
+
+
+class Segment(NamedTuple):
+    source: int     # rank owning the shard
+    offset: int     # first chunk of the shard
+    count: int      # number of chunks
+
+
+class Op(NamedTuple):
+    step: int
+    kind: str       # 'send' or 'recv'
+    peer: int
+    segments: Tuple[Segment, ...]
+
+
+class Program(TypedDict):
+    num_chunks: int         # every shard is split into this many equal chunks
+    nodes: List[str]        # node label of every rank
+    ops: List[List[Op]]     # ordered op list of every rank
+
+
+def quantize_schedule(schedule: Schedule, num_chunks: int) -> Dict[Tuple[TimeStep, Node, Node, Node], int]:
+    '''
+    round every fraction to a multiple of 1 / num_chunks:
+    the chunks of each (dest, source) up to step t are its received fraction up to t rounded, so a shard received
+    in full over several steps still sums to num_chunks, and the largest remainder method splits the chunks
+    of each (t, dest, source) over the via nodes with at least 1 chunk for every nonzero transfer
+    return: dict (t, dest, source, via) -> chunk count
+    '''
+    groups: Dict[Tuple[Node, Node], Dict[TimeStep, List[Tuple[Node, float]]]] = {}
+    for t in sorted(schedule.keys()):
+        for u, entry in schedule[t].items():
+            for (v, w), fraction in entry['transfers'].items():
+                if fraction > 0:
+                    groups.setdefault((u, v), {}).setdefault(t, []).append((w, fraction))
+
+    counts = {}
+    for (u, v), steps in groups.items():
+        received, rounded = 0., 0
+        for t, vias in steps.items():
+            vias.sort(key=lambda item: repr(item[0]))
+            received += sum(f for _, f in vias)
+            target = round(received * num_chunks) - rounded
+            rounded += target
+
+            exact = [f * num_chunks for _, f in vias]
+            floor = [max(1, math.floor(x)) for x in exact]
+            rest = target - sum(floor)
+            order = sorted(range(len(vias)), key=lambda i: floor[i] - exact[i])
+            for i in order[:max(rest, 0)]:
+                floor[i] += 1
+
+            for (w, _), c in zip(vias, floor):
+                counts[(t, u, v, w)] = c
+
+    return counts
+
+
+def _runs(chunks: List[int]) -> List[Tuple[int, int]]:
+    '''
+    (offset, count) of the contiguous runs of sorted chunks
+    '''
+    runs: List[Tuple[int, int]] = []
+    for c in chunks:
+        if runs and runs[-1][0] + runs[-1][1] == c:
+            runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+        else:
+            runs.append((c, 1))
+    return runs
+
+
+def assign_chunks(counts: Dict[Tuple[TimeStep, Node, Node, Node], int], num_chunks: int,
+                  nodes: List[Node]) -> Dict[Tuple[TimeStep, Node, Node], List[Segment]]:
+    '''
+    pick the chunks of every quantized transfer among those its via node holds at the end of the previous step,
+    chunks the dest does not hold yet first, so each source's chunks are tracked node by node across steps
+    raise ValueError if a via node holds fewer chunks than it must forward,
+    or a dest receiving a whole shard ends without one of its chunks
+    return: dict (t, via, dest) -> segments of the coalesced message
+    '''
+    rank = {node: r for r, node in enumerate(nodes)}
+    held: Dict[Tuple[Node, Node], set] = {(v, v): set(range(num_chunks)) for v in nodes}
+
+    groups: Dict[TimeStep, Dict[Tuple[Node, Node], List[Tuple[Node, int]]]] = {}
+    received: Dict[Tuple[Node, Node], int] = {}
+    for (t, u, v, w), c in counts.items():
+        groups.setdefault(t, {}).setdefault((u, v), []).append((w, c))
+        received[(u, v)] = received.get((u, v), 0) + c
+
+    messages: Dict[Tuple[TimeStep, Node, Node], List[Segment]] = {}
+    for t in sorted(groups.keys()):
+        step_received: Dict[Tuple[Node, Node], set] = {}
+        for (u, v) in sorted(groups[t].keys(), key=lambda k: (rank[k[0]], rank[k[1]])):
+            vias = groups[t][(u, v)]
+            has = held.get((u, v), set())
+            available = {w: held.get((w, v), set()) for w, _ in vias}
+            taken: set = set()
+            # the via nodes with the fewest new chunks choose first
+            for w, c in sorted(vias, key=lambda item: (len(available[item[0]] - has), rank[item[0]])):
+                if len(available[w]) < c:
+                    raise ValueError(f"t = {t}: {w} forwards {c} chunks of shard {v} to {u} "
+                                     f"but holds {len(available[w])}")
+                # new chunks first, those the fewest other via nodes could send before the others
+                sharing = {x: sum(x in available[o] for o, _ in vias if o != w) for x in available[w]}
+                chosen = sorted(available[w], key=lambda x: (x in has or x in taken, sharing[x], x))[:c]
+                taken.update(chosen)
+                for offset, count in _runs(sorted(chosen)):
+                    messages.setdefault((t, w, u), []).append(Segment(rank[v], offset, count))
+            step_received.setdefault((u, v), set()).update(taken)
+
+        for key, chunks in step_received.items():
+            held.setdefault(key, set()).update(chunks)
+
+    for (u, v), c in received.items():
+        if c >= num_chunks and len(held[(u, v)]) < num_chunks:
+            raise ValueError(f"{u} ends with {len(held[(u, v)])} of the {num_chunks} chunks of shard {v}")
+
+    return messages
+
+
+def _quantized_cost(counts: Dict[Tuple[TimeStep, Node, Node, Node], int], num_chunks: int) -> Tuple[float, int]:
+    '''
+    return: sum of the per-step max link loads, number of coalesced messages
+    '''
+    link_loads: Dict[Tuple[TimeStep, Node, Node], int] = {}
+    for (t, u, v, w), c in counts.items():
+        link_loads[(t, w, u)] = link_loads.get((t, w, u), 0) + c
+
+    step_max: Dict[TimeStep, int] = {}
+    for (t, w, u), c in link_loads.items():
+        step_max[t] = max(step_max.get(t, 0), c)
+
+    return sum(step_max.values()) / num_chunks, len(link_loads)
+
+
+def choose_num_chunks(schedule: Schedule, max_chunks: int = 16, tol: float = 0.05,
+                      nodes: List[Node] | None = None) -> int:
+    '''
+    smallest-message chunk granularity in [1, max_chunks]
+    whose quantized bandwidth cost is within (1 + tol) of the fractional schedule,
+    granularities `assign_chunks` cannot map are skipped
+    nodes: rank order of the nodes, the nodes of the schedule if None
+    raise ValueError if no granularity can be mapped
+    '''
+    if nodes is None:
+        nodes = list(dict.fromkeys(x for step_schedule in schedule.values() for u, entry in step_schedule.items()
+                                   for x in (u, *(y for key in entry['transfers'] for y in key))))
+
+    exact_cost = 0.
+    for t, step_schedule in schedule.items():
+        link_loads: Dict[Tuple[Node, Node], float] = {}
+        for u, entry in step_schedule.items():
+            for (v, w), fraction in entry['transfers'].items():
+                link_loads[(w, u)] = link_loads.get((w, u), 0.) + fraction
+        exact_cost += max(link_loads.values(), default=0.)
+
+    best_k, best_key = None, None
+    for k in range(1, max_chunks + 1):
+        counts = quantize_schedule(schedule, k)
+        try:
+            assign_chunks(counts, k, nodes)
+        except ValueError:
+            continue
+        cost, messages = _quantized_cost(counts, k)
+        feasible = cost <= exact_cost * (1 + tol) + 1e-9
+        key = (not feasible, messages if feasible else cost, k)
+        if best_key is None or key < best_key:
+            best_k, best_key = k, key
+
+    if best_k is None:
+        raise ValueError(f"no chunk granularity up to {max_chunks} maps the schedule")
+    return best_k
+
+
+def compile_schedule(G: nx.DiGraph, schedule: Schedule, num_chunks: int | None = None,
+                     max_chunks: int = 16, tol: float = 0.05) -> Program:
+    '''
+    compile schedule to per-rank ordered send/recv programs,
+    transfers sharing the link (via -> dest) at the same time step are coalesced into one message
+    num_chunks: chunk granularity, chosen by `choose_num_chunks` if None
+    raise ValueError if the chunks cannot be mapped, see `assign_chunks`
+    '''
+    nodes = list(G.nodes())
+    rank = {node: r for r, node in enumerate(nodes)}
+
+    if num_chunks is None:
+        num_chunks = choose_num_chunks(schedule, max_chunks, tol, nodes)
+
+    messages = assign_chunks(quantize_schedule(schedule, num_chunks), num_chunks, nodes)
+
+    ops: List[List[Op]] = [[] for _ in nodes]
+    for (t, w, u), segments in messages.items():
+        ops[rank[w]].append(Op(int(t), 'send', rank[u], tuple(segments)))
+        ops[rank[u]].append(Op(int(t), 'recv', rank[w], tuple(segments)))
+
+    # within a step post every send before the receives
+    for rank_ops in ops:
+        rank_ops.sort(key=lambda op: (op.step, op.kind != 'send', op.peer))
+
+    return Program(num_chunks=num_chunks, nodes=[str(n) for n in nodes], ops=ops)
+
+
+def program_stats(program: Program) -> Dict[int, int]:
+    '''
+    return: dict time step -> number of messages
+    '''
+    stats: Dict[int, int] = {}
+    for rank_ops in program['ops']:
+        for op in rank_ops:
+            if op.kind == 'send':
+                stats[op.step] = stats.get(op.step, 0) + 1
+    return dict(sorted(stats.items()))
+
+
+_MAGIC = b'EDP1'
+_KINDS = ('send', 'recv')
+
+
+def program_to_bytes(program: Program) -> bytes:
+    '''
+    little-endian int32 layout:
+    magic, num_ranks, num_chunks, per rank: label length + utf-8 label, num_ops,
+    per op: step, kind (0 send / 1 recv), peer, num_segments, (source, offset, count) * num_segments
+    '''
+    ints: List[int] = [len(program['nodes']), program['num_chunks']]
+    labels = b''
+    for label in program['nodes']:
+        encoded = label.encode()
+        labels += struct.pack('<i', len(encoded)) + encoded
+
+    for rank_ops in program['ops']:
+        ints.append(len(rank_ops))
+        for op in rank_ops:
+            ints.extend((op.step, _KINDS.index(op.kind),
+                        op.peer, len(op.segments)))
+            for seg in op.segments:
+                ints.extend(seg)
+
+    header = struct.pack('<ii', ints[0], ints[1])
+    body = struct.pack(f'<{len(ints) - 2}i', *ints[2:])
+    return _MAGIC + header + labels + body
+
+
+def program_from_bytes(data: bytes) -> Program:
+    assert data[:4] == _MAGIC, "not a compiled program"
+    num_ranks, num_chunks = struct.unpack_from('<ii', data, 4)
+
+    pos = 12
+    nodes = []
+    for _ in range(num_ranks):
+        (length,) = struct.unpack_from('<i', data, pos)
+        nodes.append(data[pos + 4:pos + 4 + length].decode())
+        pos += 4 + length
+
+    body = struct.unpack(f'<{(len(data) - pos) // 4}i', data[pos:])
+    i = 0
+    ops: List[List[Op]] = []
+    for _ in range(num_ranks):
+        num_ops = body[i]
+        i += 1
+        rank_ops = []
+        for _ in range(num_ops):
+            step, kind, peer, num_segments = body[i:i + 4]
+            i += 4
+            segments = tuple(Segment(*body[i + 3 * k:i + 3 * k + 3])
+                             for k in range(num_segments))
+            i += 3 * num_segments
+            rank_ops.append(Op(step, _KINDS[kind], peer, segments))
+        ops.append(rank_ops)
+
+    return Program(num_chunks=num_chunks, nodes=nodes, ops=ops)
+
+
+def save_program(program: Program, path: str) -> None:
+    '''
+    `.json` paths are written as JSON, anything else in the binary format
+    '''
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump({'num_chunks': program['num_chunks'],
+                       'nodes': program['nodes'],
+                       'ops': [[[op.step, op.kind, op.peer, [list(s) for s in op.segments]]
+                                for op in rank_ops] for rank_ops in program['ops']]}, f)
+    else:
+        with open(path, 'wb') as f:
+            f.write(program_to_bytes(program))
+
+
+def load_program(path: str) -> Program:
+    if path.endswith('.json'):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        ops = [[Op(step, kind, peer, tuple(Segment(*s) for s in segments))
+                for step, kind, peer, segments in rank_ops] for rank_ops in data['ops']]
+        return Program(num_chunks=data['num_chunks'], nodes=data['nodes'], ops=ops)
+
+    with open(path, 'rb') as f:
+        return program_from_bytes(f.read())
+
+
+def _main1():
+    G = graph.torus([3, 4])
+    A = BFB(G, False)
+    program = compile_schedule(G, A)
+    print(f"num chunks: {program['num_chunks']}")
+    print(f"messages per step: {program_stats(program)}")
+    for op in program['ops'][0]:
+        print(op)
+
+
+if __name__ == '__main__':
+    from bfb_schedule import BFB
+    import graph
+    _main1()
@@ -0,0 +1,165 @@
+from typing import Dict, List, NamedTuple, Tuple
+import numpy as np
+import networkx as nx
+
+from schedule_type import *
+import utils
+
+
+class Job(NamedTuple):
+    name: str
+    G: nx.DiGraph                       # logical topology of the schedule
+    A: Schedule
+    mapping: Dict[Node, Node] | None    # logical node -> physical node, identity if None
+    offset: int = 0                     # physical step of the job's step 1 is offset + 1
+    shard_size: float = 1.0             # data of one shard, relative to the other jobs
+
+
+class JobReport(NamedTuple):
+    name: str
+    isolated: float         # time of the job alone, sum of its per-step max link times
+    contended: float        # time with every other job running in the same steps
+    slowdown: float         # contended / isolated
+
+
+class ContentionReport(NamedTuple):
+    jobs: List[JobReport]
+    # (physical link, physical step, total time, number of jobs on it), most loaded first
+    hot_links: List[Tuple[Tuple[Node, Node], int, float, int]]
+
+
+def _job_loads(physical: nx.DiGraph, job: Job, edge_index: Dict[Tuple[Node, Node], int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    return: physical edge index, physical step and load in shards of every link used by the job in a step,
+    one element per (link, step)
+    '''
+    mapping = job.mapping
+    edges, steps, loads = [], [], []
+    for t, step in job.A.items():
+        for u, entry in step.items():
+            link_loads: Dict[Node, float] = {}
+            for (_, w), fraction in entry['transfers'].items():
+                link_loads[w] = link_loads.get(w, 0.0) + fraction
+            pu = u if mapping is None else mapping[u]
+            for w, load in link_loads.items():
+                link = (w if mapping is None else mapping[w], pu)
+                if link not in edge_index:
+                    raise ValueError(f"job '{job.name}': link {w} -> {u} maps to {link}, not a link of the physical graph")
+                edges.append(edge_index[link])
+                steps.append(job.offset + t)
+                loads.append(load * job.shard_size)
+    return np.array(edges, dtype=np.int64), np.array(steps, dtype=np.int64), np.array(loads, dtype=np.float64)
+
+
+def analyze(physical: nx.DiGraph, jobs: List[Job], top: int = 10) -> ContentionReport:
+    '''
+    jobs run at the same time on physical and share a link in proportion to their loads,
+    so in a step every job waits for the most loaded physical link it uses:
+        time of link e at step s = sum over jobs of their load on e at s / c_e
+        contended time of a job = sum over its steps s of max over its links e at s of the time of e at s
+    loads are accumulated only for the (link, step) pairs used by some job
+    '''
+    physical_edges = list(physical.edges())
+    edge_index = {e: i for i, e in enumerate(physical_edges)}
+    cap = np.array([utils.link_capacity(physical, w, u) for w, u in physical_edges])
+    E = len(physical_edges)
+
+    per_job = [_job_loads(physical, job, edge_index) for job in jobs]
+    keys = [steps * E + edges for edges, steps, _ in per_job]
+    all_keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    totals = np.bincount(inverse, weights=np.concatenate([loads for _, _, loads in per_job]))
+    num_jobs = np.bincount(inverse)
+    link_time = totals / cap[all_keys % E]
+
+    reports = []
+    begin = 0
+    for job, (edges, steps, loads) in zip(jobs, per_job):
+        positions = inverse[begin:begin + len(edges)]
+        begin += len(edges)
+        if len(edges) == 0:
+            reports.append(JobReport(job.name, 0., 0., 1.))
+            continue
+        own = loads / cap[edges]
+        # per step max: order by step, reduce each run of equal steps
+        order = np.argsort(steps, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(steps[order]) != 0])
+        isolated = np.maximum.reduceat(own[order], starts).sum()
+        contended = np.maximum.reduceat(link_time[positions][order], starts).sum()
+        reports.append(JobReport(job.name, float(isolated), float(contended), float(contended / isolated)))
+
+    hot = np.argsort(-link_time)[:top]
+    hot_links = [(physical_edges[all_keys[i] % E], int(all_keys[i] // E), float(link_time[i]), int(num_jobs[i]))
+                 for i in hot]
+    return ContentionReport(reports, hot_links)
+
+
+def background_of(physical: nx.DiGraph, jobs: List[Job], i: int) -> Dict[Tuple[TimeStep, Node, Node], float]:
+    '''
+    load of every job but jobs[i] on the logical links of jobs[i], in its shards and steps, for `BFB(background=...)`
+    '''
+    job = jobs[i]
+    physical_edges = list(physical.edges())
+    edge_index = {e: k for k, e in enumerate(physical_edges)}
+    inverse = None if job.mapping is None else {p: x for x, p in job.mapping.items()}
+
+    background: Dict[Tuple[TimeStep, Node, Node], float] = {}
+    for j, other in enumerate(jobs):
+        if j == i:
+            continue
+        edges, steps, loads = _job_loads(physical, other, edge_index)
+        for e, s, load in zip(edges.tolist(), steps.tolist(), loads.tolist()):
+            pw, pu = physical_edges[e]
+            if inverse is not None and (pw not in inverse or pu not in inverse):
+                continue
+            w, u = (pw, pu) if inverse is None else (inverse[pw], inverse[pu])
+            t = TimeStep(s - job.offset)
+            if t >= 1 and job.G.has_edge(w, u):
+                key = (t, w, u)
+                background[key] = background.get(key, 0.0) + load / job.shard_size
+    return background
+
+
+def rebalance(physical: nx.DiGraph, jobs: List[Job], rounds: int = 1, print_detail: bool = False) -> List[Job]:
+    '''
+    re-solve the BFB schedule of every job in turn with the load of the others as fixed background,
+    the link capacities of the job are taken from its own graph
+    '''
+    from bfb_schedule import BFB
+
+    jobs = list(jobs)
+    for r in range(rounds):
+        for i, job in enumerate(jobs):
+            A = BFB(job.G, False, background=background_of(physical, jobs, i))
+            jobs[i] = job._replace(A=A)
+            if print_detail:
+                print(f'round {r + 1}, {job.name}: {[j.contended for j in analyze(physical, jobs).jobs]}')
+    return jobs
+
+
+def print_report(report: ContentionReport) -> None:
+    for r in report.jobs:
+        print(f'{r.name:<16} isolated {r.isolated:8.4f}  contended {r.contended:8.4f}  slowdown {r.slowdown:.3f}')
+    for (w, u), s, time, n in report.hot_links:
+        print(f'    link {w} -> {u} at step {s}: {time:.4f} ({n} jobs)')
+
+
+def _main1():
+    import graph
+    from bfb_schedule import BFB
+
+    physical = graph.torus([4, 4])
+    ring = graph.ring(4, False)
+    jobs = [
+        Job('torus', physical, BFB(physical, False), None),
+        Job('row 0', ring, BFB(ring, False), {i: (0, i) for i in range(4)}),
+        Job('column 0', ring, BFB(ring, False), {i: (i, 0) for i in range(4)}, offset=1),
+    ]
+    report = analyze(physical, jobs, top=3)
+    print_report(report)
+
+    print('\nafter re-solving every job around the others:')
+    print_report(analyze(physical, rebalance(physical, jobs), top=3))
+
+
+if __name__ == '__main__':
+    _main1()
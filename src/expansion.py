@@ -1,7 +1,10 @@
+from typing import Dict, Tuple
 import networkx as nx
+import numpy as np
 import warnings
 
 from schedule_type import *
+import utils
 
 
 def line_graph_expansion(G: nx.DiGraph, A: None | Schedule) -> tuple[nx.DiGraph, Schedule]:
@@ -11,9 +14,13 @@ def line_graph_expansion(G: nx.DiGraph, A: None | Schedule) -> tuple[nx.DiGraph,
     new_nodes = list(G.edges())
     G_prime.add_nodes_from(new_nodes)
 
-    for u, v in G.edges():
+    # edge (u, v) -> (v, w) carries the traffic of link u -> v and inherits its capacity
+    for u, v, data in G.edges(data=True):
         for _, w in G.out_edges(v):
-            G_prime.add_edge((u, v), (v, w))
+            if 'capacity' in data:
+                G_prime.add_edge((u, v), (v, w), capacity=data['capacity'])
+            else:
+                G_prime.add_edge((u, v), (v, w))
 
     A_prime: Schedule = {}
     if A is not None:
@@ -60,22 +67,8 @@ def line_graph_expansion(G: nx.DiGraph, A: None | Schedule) -> tuple[nx.DiGraph,
                                     (v_prime, v), (u, w))
                                 A_prime[t_prime][dest]['transfers'][transfer_key] = fraction
 
-        # Recalculate the maximum load U for t > 1
-        for t in A_prime.keys():
-            if t == 1:
-                continue
-
-            for w in A_prime[t].keys():
-                transfers = A_prime[t][w]['transfers']
-
-                link_loads = {}
-                for (v_L, v), fraction in transfers.items():
-                    if v not in link_loads:
-                        link_loads[v] = 0.0
-                    link_loads[v] += fraction
-
-                max_load_U = max(link_loads.values()) if link_loads else 0.0
-                A_prime[t][w]['load_U'] = max_load_U
+        # Recalculate the maximum load U with the link capacities
+        utils.update_load_U(A_prime, G_prime)
 
     return G_prime, A_prime
 
@@ -94,10 +87,13 @@ def degree_expansion(G: nx.DiGraph, A: None | Schedule, n: int) -> tuple[nx.DiGr
     for j in range(n):
         G_prime.add_nodes_from([(node, j) for node in nodes])
 
-    for w, v in G.edges():
+    for w, v, data in G.edges(data=True):
         for j in range(n):
             for i in range(n):
-                G_prime.add_edge((w, j), (v, i))
+                if 'capacity' in data:
+                    G_prime.add_edge((w, j), (v, i), capacity=data['capacity'])
+                else:
+                    G_prime.add_edge((w, j), (v, i))
 
     A_prime: Schedule = {}
     if A is not None:
@@ -125,25 +121,28 @@ def degree_expansion(G: nx.DiGraph, A: None | Schedule, n: int) -> tuple[nx.DiGr
                     }
 
         # Divide shard S into equal-sized chunks C1, . . . ,C_{nd}. Given u_i, u_j ∈ V_{G∗n} with i != j , add ((ui,C_α), (v_α, u_j), tmax + 1) to A_{G∗n} for each (v1, u_j), ... , (v_{nd} , u_j) ∈ E_{G∗n}, where tmax is the max comm step in A_G.
+        # With heterogeneous links the chunk of v_α is proportional to the capacity of (v_α, u_j).
         t_final = TimeStep(t_max + 1)
         A_prime[t_final] = {}
 
-        fraction_per_ring_link = Fraction(1.0 / (n * d))
-
         for u in nodes:
             for j in range(n):
                 u_j = (u, j)
-                vs = G_prime.predecessors(u_j)
+                vs = list(G_prime.predecessors(u_j))
+                capacities = [utils.link_capacity(
+                    G_prime, v_alpha, u_j) for v_alpha in vs]
+                total_capacity = sum(capacities)
 
-                A_prime[t_final][u_j] = {
-                    'load_U': fraction_per_ring_link, 'transfers': {}}
+                A_prime[t_final][u_j] = {'load_U': 0.0, 'transfers': {}}
 
                 for i in range(n):
                     if i != j:
                         u_i = (u, i)
-                        for v_alpha in vs:
+                        for v_alpha, c in zip(vs, capacities):
                             A_prime[t_final][u_j]['transfers'][TransferKey(
-                                u_i, v_alpha)] = fraction_per_ring_link
+                                u_i, v_alpha)] = Fraction(c / total_capacity)
+
+        utils.update_load_U(A_prime, G_prime)
 
     return G_prime, A_prime
 
@@ -169,6 +168,165 @@ def cartesian_product_expansion(G1: nx.DiGraph, G2: nx.DiGraph) -> nx.DiGraph:
     return G_product
 
 
+def hierarchical_U(weights: np.ndarray, loads: np.ndarray, steps: np.ndarray) -> float:
+    """
+    time cost of `hierarchical_expansion` for the given split of every shard over its paths,
+    the link loads are linear in the weights
+    loads: array (number of paths, number of (step, link) pairs), load in time units of every (step, link)
+        when the whole of every shard takes one path
+    steps: 0-based time step of every (step, link)
+    """
+    step_max = np.zeros(int(steps.max(initial=-1)) + 1)
+    np.maximum.at(step_max, steps, weights @ loads)
+    return float(step_max.sum())
+
+
+def hierarchical_split(loads: np.ndarray, steps: np.ndarray) -> np.ndarray:
+    """
+    weights of the paths minimizing `hierarchical_U`, an LP in the weights and the per-step max loads
+    """
+    import scipy.sparse as sp
+    from scipy.optimize import linprog
+
+    P, L = loads.shape
+    T = int(steps.max(initial=-1)) + 1
+    # sum_p weight_p * load_p(t, e) <= U_t
+    A_ub = sp.hstack([sp.csr_matrix(loads.T), sp.csr_matrix((-np.ones(L), (np.arange(L), steps)), shape=(L, T))])
+    A_eq = np.concatenate([np.ones(P), np.zeros(T)])[None, :]
+    c = np.concatenate([np.zeros(P), np.ones(T)])
+    result = linprog(c, A_ub=A_ub, b_ub=np.zeros(L), A_eq=A_eq, b_eq=[1.], bounds=(0, None), method='highs')
+    assert result.status == 0, result.message
+    weights = np.clip(result.x[:P], 0., None)
+    weights[weights < 1e-9] = 0.
+    return weights / weights.sum()
+
+
+def _link_loads(A: Schedule, G: nx.DiGraph, links: Dict[Tuple[TimeStep, Node, Node], int]) -> Dict[int, float]:
+    '''
+    (t, w, u) -> load in time units of link w -> u at step t, keyed by the index in links, new keys are added
+    '''
+    loads: Dict[int, float] = {}
+    for t, step_schedule in A.items():
+        for u, entry in step_schedule.items():
+            for (_, w), fraction in entry['transfers'].items():
+                i = links.setdefault((t, w, u), len(links))
+                loads[i] = loads.get(i, 0.0) + fraction / utils.link_capacity(G, w, u)
+    return loads
+
+
+def hierarchical_expansion(G_intra: nx.DiGraph, A_intra: None | Schedule,
+                           G_inter: nx.DiGraph, A_inter: None | Schedule, sliced: bool = True) -> tuple[nx.DiGraph, Schedule]:
+    """
+    boxes of G_intra connected by G_inter: node (b, i) is node i of box b,
+    (b, i) -> (b, j) for every intra edge i -> j and (b, i) -> (c, i) for every inter edge b -> c,
+    both keep the capacity of the component edge, so the levels may have different link speeds
+
+    schedule: every shard is split over three paths, the weights minimizing the schedule's time (see `hierarchical_split`):
+    - inter first: the own shard crosses boxes along its rail (steps 1..T_inter),
+      then the rail's shards are spread inside the box (steps T_inter+1..T_inter+T_intra)
+    - intra first: the own shard is spread inside its box (steps 1..T_intra),
+      then every rail carries the whole box's data to the other boxes (steps T_intra+1..T_intra+T_inter)
+    - sliced: spread inside the box as above, then rail i carries only slice i, 1 / N_intra of every shard
+      of the box (steps T_intra+1..T_intra+T_inter), and a second intra allgather of the slices completes
+      the other boxes (steps T_intra+T_inter+1..2 T_intra+T_inter)
+    the inter first and sliced paths put N_inter times an allgather on the intra level and one on the inter level,
+    the intra first path one on the intra level and N_intra times one on the inter level,
+    mixing them keeps both levels busy at once
+    sliced: allow the sliced path, it takes T_intra more steps, so without it the schedule keeps
+        the T_intra + T_inter steps of `topology_finder.hierarchical_exp`
+    """
+    intra_nodes = list(G_intra.nodes())
+    inter_nodes = list(G_inter.nodes())
+    N_intra = len(intra_nodes)
+
+    G_prime = nx.DiGraph()
+    G_prime.add_nodes_from([(b, i) for b in inter_nodes for i in intra_nodes])
+
+    for i, j, data in G_intra.edges(data=True):
+        for b in inter_nodes:
+            G_prime.add_edge((b, i), (b, j), **data)
+
+    for b, c, data in G_inter.edges(data=True):
+        for i in intra_nodes:
+            G_prime.add_edge((b, i), (c, i), **data)
+
+    A_prime: Schedule = {}
+    if A_intra is not None and A_inter is not None:
+        T_intra = max(A_intra.keys(), default=0)
+        T_inter = max(A_inter.keys(), default=0)
+
+        def add(A: Schedule, t: TimeStep, dest: Node, key: TransferKey, fraction: float):
+            if fraction <= 0:
+                return
+            step_schedule = A.setdefault(t, {})
+            if dest not in step_schedule:
+                step_schedule[dest] = {'load_U': 0.0, 'transfers': {}}
+            transfers = step_schedule[dest]['transfers']
+            transfers[key] = Fraction(transfers.get(key, 0.0) + fraction)
+
+        # inter first: the own shard crosses boxes, then the rail's shards are spread in the box
+        A_inter_first: Schedule = {}
+        for t, step_schedule in A_inter.items():
+            for c, entry in step_schedule.items():
+                for (b, x), fraction in entry['transfers'].items():
+                    for i in intra_nodes:
+                        add(A_inter_first, TimeStep(t), (c, i), TransferKey((b, i), (x, i)), fraction)
+        for t, step_schedule in A_intra.items():
+            for j, entry in step_schedule.items():
+                for (i, y), fraction in entry['transfers'].items():
+                    for b in inter_nodes:
+                        for c in inter_nodes:
+                            add(A_inter_first, TimeStep(T_inter + t), (b, j), TransferKey((c, i), (b, y)), fraction)
+
+        # intra first: the own shard is spread in the box, then every rail carries the whole box
+        A_intra_first: Schedule = {}
+        for t, step_schedule in A_intra.items():
+            for j, entry in step_schedule.items():
+                for (i, y), fraction in entry['transfers'].items():
+                    for b in inter_nodes:
+                        add(A_intra_first, TimeStep(t), (b, j), TransferKey((b, i), (b, y)), fraction)
+        # sliced: the same intra phase, rail i carries slice i of the box, then the slices are spread in the box
+        A_sliced = {t: {u: {'load_U': 0.0, 'transfers': dict(entry['transfers'])} for u, entry in step_schedule.items()}
+                    for t, step_schedule in A_intra_first.items()}
+        for t, step_schedule in A_inter.items():
+            for c, entry in step_schedule.items():
+                for (b, x), fraction in entry['transfers'].items():
+                    for i in intra_nodes:
+                        for j in intra_nodes:
+                            add(A_intra_first, TimeStep(T_intra + t), (c, i), TransferKey((b, j), (x, i)), fraction)
+                            add(A_sliced, TimeStep(T_intra + t), (c, i), TransferKey((b, j), (x, i)), fraction / N_intra)
+        for t, step_schedule in A_intra.items():
+            for k, entry in step_schedule.items():
+                for (i, y), fraction in entry['transfers'].items():
+                    for c in inter_nodes:
+                        for b in inter_nodes:
+                            if b == c:
+                                continue
+                            for j in intra_nodes:
+                                add(A_sliced, TimeStep(T_intra + T_inter + t), (c, k),
+                                    TransferKey((b, j), (c, y)), fraction / N_intra)
+
+        paths = [A_inter_first, A_intra_first] + ([A_sliced] if sliced else [])
+        links: Dict[Tuple[TimeStep, Node, Node], int] = {}
+        path_loads = [_link_loads(A, G_prime, links) for A in paths]
+        loads = np.zeros((len(paths), len(links)))
+        for p, link_loads in enumerate(path_loads):
+            loads[p, list(link_loads.keys())] = list(link_loads.values())
+        steps = np.array([t - 1 for t, _, _ in links], dtype=np.int64)
+        weights = hierarchical_split(loads, steps)
+
+        for A, weight in zip(paths, weights):
+            for t, step_schedule in A.items():
+                for u, entry in step_schedule.items():
+                    for key, fraction in entry['transfers'].items():
+                        add(A_prime, t, u, key, weight * fraction)
+
+        A_prime = dict(sorted(A_prime.items()))
+        utils.update_load_U(A_prime, G_prime)
+
+    return G_prime, A_prime
+
+
 def _main1():
     G = nx.DiGraph()
     nodes = ['a', 'b', 'c', 'd']
@@ -360,6 +518,20 @@ def _main9():
             f'G^{i}: tl = {tl}, tb = {tb}, expect_tb = {expect_tb}, bound = {(n - 1) / n}')
 
 
+def _main10():
+    import graph
+    # boxes of K(4) with 4x faster links, connected by a bidirectional ring of 6 boxes
+    G_intra = graph.complete_graph(4)
+    nx.set_edge_attributes(G_intra, 4.0, 'capacity')
+    G_inter = graph.ring(6, False)
+
+    A_intra = BFB(G_intra, False)
+    A_inter = BFB(G_inter, False)
+    G, A = hierarchical_expansion(G_intra, A_intra, G_inter, A_inter)
+    print(f'hierarchical: {utils.get_schedule_TL_TB(G, A)}')
+    print(f'flat BFB: {utils.get_TL_TB(G, BFB(G, False))}')
+
+
 if __name__ == '__main__':
     from bfb_schedule import BFB
     import visualize
@@ -373,3 +545,4 @@ if __name__ == '__main__':
     # _main7()    # recursive line_graph_expansion
     # _main8()    # cartessian product
     _main9()    # cartessian power
+    # _main10()   # hierarchical composition
@@ -1,4 +1,5 @@
 import networkx as nx
+import numpy as np
 from typing import List, Tuple
 
 
@@ -51,6 +52,27 @@ def circulant_graph(n: int, generators: List[int], directed: bool = False) -> nx
     return G
 
 
+def circulant_diameter(n: int, generators: List[int]) -> int:
+    '''
+    diameter of `circulant_graph(n, generators)` without building it:
+    the graph is vertex-transitive, so a BFS from node 0 over the residues mod n is enough
+    '''
+    steps = np.array([s for a in generators if a % n != 0 for s in (a, -a)], dtype=np.int64)
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    frontier = np.array([0], dtype=np.int64)
+    D = 0
+    while True:
+        reached = np.unique((frontier[:, None] + steps[None, :]) % n)
+        frontier = reached[~visited[reached]]
+        if len(frontier) == 0:
+            break
+        visited[frontier] = True
+        D += 1
+    assert visited.all(), "not connected graph"
+    return D
+
+
 def complete_graph(n: int) -> nx.DiGraph:
     return nx.complete_graph(n, create_using=nx.DiGraph())
 
@@ -80,6 +102,172 @@ def generalized_kautz_graph(d: int, m: int) -> nx.DiGraph:
     return G
 
 
+def successor_table(G: nx.DiGraph) -> Tuple[List, np.ndarray]:
+    '''
+    nodes of an out-regular G and the (N, d) array of the out neighbors of each, by node index
+    '''
+    nodes = list(G.nodes())
+    index = {u: i for i, u in enumerate(nodes)}
+    S = np.array([[index[v] for v in G.successors(u)] for u in nodes], dtype=np.int64)
+    assert S.ndim == 2, "not out-regular"
+    return nodes, S
+
+
+def from_successor_table(S: np.ndarray) -> nx.DiGraph:
+    n, d = S.shape
+    G = nx.DiGraph()
+    G.add_nodes_from(range(n))
+    G.add_edges_from(zip(np.repeat(np.arange(n), d).tolist(), S.ravel().tolist()))
+    return G
+
+
+def _random_regular_successors(n: int, d: int, rng: np.random.Generator, max_tries: int = 100) -> np.ndarray | None:
+    '''
+    union of d random permutations without fixed points or repeated edges, each column of the result is one of them
+    '''
+    S = np.empty((n, d), dtype=np.int64)
+    nodes = np.arange(n)
+    for j in range(d):
+        for _ in range(max_tries):
+            p = rng.permutation(n)
+            if not (p == nodes).any() and not (S[:, :j] == p[:, None]).any():
+                S[:, j] = p
+                break
+        else:
+            return None
+    return S
+
+
+def _lift_successors(S: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    '''
+    random k-lift: node x of the base becomes x * k + i, edge j of x maps copy i to copy perm[x, j][i] of its target
+    '''
+    n, d = S.shape
+    perms = rng.permuted(np.broadcast_to(np.arange(k), (n, d, k)), axis=2)
+    return (S[:, :, None] * k + perms).transpose(0, 2, 1).reshape(n * k, d)
+
+
+def random_regular_digraph(n: int, d: int, seed: int) -> nx.DiGraph:
+    '''
+    d-regular digraph from d random permutations, the same seed gives the same graph
+    '''
+    S = _random_regular_successors(n, d, np.random.default_rng(seed))
+    assert S is not None, f"no simple union of {d} permutations of {n} nodes found"
+    return from_successor_table(S)
+
+
+def random_lift(G: nx.DiGraph, k: int, seed: int) -> nx.DiGraph:
+    '''
+    random k-lift of an out-regular G on nodes 0..kN-1, node x * k + i is copy i of the x-th node of G
+    '''
+    _, S = successor_table(G)
+    return from_successor_table(_lift_successors(S, k, np.random.default_rng(seed)))
+
+
+def _de_bruijn_successors(d: int, k: int) -> np.ndarray:
+    n = d ** k
+    return (np.arange(n)[:, None] * d + np.arange(d)[None, :]) % n
+
+
+def de_bruijn_graph(d: int, k: int) -> nx.DiGraph:
+    '''
+    words of length k over d letters, node x = x_1 ... x_k in base d, edges x -> x_2 ... x_k a,
+    the d constant words have self-loops
+    '''
+    return from_successor_table(_de_bruijn_successors(d, k))
+
+
+def modified_de_bruijn_graph(d: int, k: int) -> nx.DiGraph:
+    '''
+    DBJMod(d, k): de Bruijn graph with the self-loop of the constant word a...a replaced by an edge to (a + 1)...(a + 1),
+    d-regular without self-loops, TL k + 1 and optimal TB with the schedule of `symmetric.symmetric_optimal_schedule`
+    '''
+    assert d >= 2 and k >= 1
+    S = _de_bruijn_successors(d, k)
+    constant = np.arange(d) * ((d ** k - 1) // (d - 1))
+    S[constant, np.arange(d)] = np.roll(constant, -1)
+    return from_successor_table(S)
+
+
+def diamond_graph(d: int) -> nx.DiGraph:
+    '''
+    line graph of the bidirected complete bipartite graph K(d, d), 2 d^2 nodes of degree d and diameter 3,
+    node (s * d + a) * d + b is the link from node a of side s to node b of side 1 - s,
+    optimal TB in 3 steps with the schedule of `symmetric.symmetric_optimal_schedule`, not with BFB
+    '''
+    x = np.arange(2 * d * d)
+    s, a, b = x // (d * d), x // d % d, x % d
+    S = (((1 - s) * d + b) * d)[:, None] + np.arange(d)[None, :]
+    return from_successor_table(S)
+
+
+_distreg_store: dict = {}
+
+
+def distreg_graph(name: str, store_path: str = 'DistReg/graph.npz') -> nx.DiGraph:
+    '''
+    load a distance regular graph from the store written by `DistReg/process_csv.py`,
+    every undirected edge becomes two directed edges
+    '''
+    if store_path not in _distreg_store:
+        with np.load(store_path) as store:
+            names = store['names'].tolist()
+            _distreg_store[store_path] = (
+                {n: i for i, n in enumerate(names)},
+                store['nodes'], store['offsets'], store['adjacency'])
+
+    index, nodes, offsets, adjacency = _distreg_store[store_path]
+    i = index[name]
+    n = int(nodes[i])
+
+    bits = np.unpackbits(adjacency[offsets[i]:offsets[i + 1]], count=n * n)
+    src, dst = np.nonzero(bits.reshape(n, n))
+
+    G = nx.DiGraph()
+    G.add_nodes_from(range(n))
+    G.add_edges_from(zip(src.tolist(), dst.tolist()))
+    return G
+
+
+def from_spec(spec: str) -> nx.DiGraph:
+    '''
+    graph from a short spec: family:arg,arg,..., e.g.
+    ring:16 (unidirectional), biring:16, torus:4,4, circulant:16,2,3, complete:4, bipartite:4, kautz:2,12, distreg:name,
+    random:n,d,seed, lift:k,seed,base spec, debruijn:d,k, dbjmod:d,k, diamond:d
+    '''
+    family, _, rest = spec.partition(':')
+    if family == 'distreg':
+        return distreg_graph(rest)
+    if family == 'lift':
+        k, seed, base = rest.split(',', 2)
+        return random_lift(from_spec(base), int(k), int(seed))
+    args = [int(a) for a in rest.split(',') if a]
+
+    if family == 'ring':
+        return ring(args[0])
+    if family == 'biring':
+        return ring(args[0], False)
+    if family == 'torus':
+        return torus(args)
+    if family == 'circulant':
+        return circulant_graph(args[0], args[1:])
+    if family == 'complete':
+        return complete_graph(args[0])
+    if family == 'bipartite':
+        return nx.DiGraph(nx.complete_bipartite_graph(args[0], args[0]))
+    if family == 'kautz':
+        return generalized_kautz_graph(args[0], args[1])
+    if family == 'random':
+        return random_regular_digraph(args[0], args[1], args[2])
+    if family == 'debruijn':
+        return de_bruijn_graph(args[0], args[1])
+    if family == 'dbjmod':
+        return modified_de_bruijn_graph(args[0], args[1])
+    if family == 'diamond':
+        return diamond_graph(args[0])
+    raise ValueError(f"unknown graph family '{family}' in '{spec}'")
+
+
 def _main1():
     G = circulant_graph(32, [2, 5, 7, 3, 11])
     A = BFB(G)
@@ -0,0 +1,169 @@
+from typing import List, NamedTuple, Tuple
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import linprog
+import networkx as nx
+
+from schedule_type import *
+import utils
+
+
+class OptimalResult(NamedTuple):
+    T: int                  # number of time steps
+    U: float                # min sum of per-step times
+    TB: float               # U normalized like `utils.get_TL_TB`
+    step_U: List[float]     # time of every step
+    status: str
+
+
+def optimal_allgather(G: nx.DiGraph, T: int | None = None) -> OptimalResult:
+    '''
+    minimum-bandwidth allgather in T time steps as one LP over the time-expanded network:
+        f[s, e, t]: amount of shard s sent over link e = (w, u) at step t
+        h[s, x, t]: amount of shard s held by x after step t, h[s, s, t] = 1, h[s, x, T] = 1
+        f[s, (w, u), t] <= h[s, w, t - 1]               (only forward what you hold)
+        h[s, u, t] <= h[s, u, t - 1] + sum_w f[s, (w, u), t]
+        sum_s f[s, e, t] <= c_e U_t                     (link capacity)
+        minimize sum_t U_t
+    pieces of a shard are not told apart, so the optimum is a lower bound of every T-step schedule,
+    e.g. of BFB with T = diameter
+    T: diameter if None
+    '''
+    nodes = list(G.nodes())
+    index = {v: i for i, v in enumerate(nodes)}
+    N = len(nodes)
+    edges = list(G.edges())
+    E = len(edges)
+    src = np.array([index[w] for w, _ in edges], dtype=np.int64)
+    dst = np.array([index[u] for _, u in edges], dtype=np.int64)
+    cap = np.array([utils.link_capacity(G, w, u)
+                   for w, u in edges], dtype=np.float64)
+
+    if T is None:
+        T = nx.diameter(G)
+
+    F = T * N * E
+    H = T * N * N
+    num_vars = F + H + T
+
+    def f_idx(t, s, e):
+        return (t * N + s) * E + e
+
+    def h_idx(t, s, x):
+        return F + (t * N + s) * N + x
+
+    t_ = np.arange(T)[:, None, None]
+    s_ = np.arange(N)[None, :, None]
+    e_ = np.arange(E)[None, None, :]
+    x_ = np.arange(N)[None, None, :]
+
+    rows, cols, vals = [], [], []
+    num_rows = 0
+
+    # (a) f[s, (w, u), t] - h[s, w, t - 1] <= 0 for t >= 1, step 0 is handled by the bounds
+    if T > 1:
+        shape = (T - 1, N, E)
+        r = num_rows + np.arange(np.prod(shape)).reshape(shape)
+        tt, ss, ee = np.broadcast_arrays(t_[1:], s_, e_)
+        rows += [r.ravel(), r.ravel()]
+        cols += [f_idx(tt, ss, ee).ravel(),
+                 h_idx(tt - 1, ss, src[ee]).ravel()]
+        vals += [np.ones(r.size), -np.ones(r.size)]
+        num_rows += r.size
+
+    # (b) h[s, u, t] - h[s, u, t - 1] - sum_{(w, u)} f[s, (w, u), t] <= [t == 0][u == s]
+    shape = (T, N, N)
+    r = num_rows + np.arange(np.prod(shape)).reshape(shape)
+    tt, ss, xx = np.broadcast_arrays(t_, s_, x_)
+    rows.append(r.ravel())
+    cols.append(h_idx(tt, ss, xx).ravel())
+    vals.append(np.ones(r.size))
+    rows.append(r[1:].ravel())
+    cols.append(h_idx(tt[1:] - 1, ss[1:], xx[1:]).ravel())
+    vals.append(-np.ones(r[1:].size))
+    tt, ss, ee = np.broadcast_arrays(t_, s_, e_)
+    rows.append(r[tt, ss, dst[ee]].ravel())
+    cols.append(f_idx(tt, ss, ee).ravel())
+    vals.append(-np.ones(tt.size))
+    b_flow = r[0, np.arange(N), np.arange(N)]
+    num_rows += r.size
+
+    # (c) sum_s f[s, e, t] - c_e U_t <= 0
+    shape = (T, E)
+    r = num_rows + np.arange(np.prod(shape)).reshape(shape)
+    tt, ss, ee = np.broadcast_arrays(t_, s_, e_)
+    rows.append(r[tt, ee].ravel())
+    cols.append(f_idx(tt, ss, ee).ravel())
+    vals.append(np.ones(tt.size))
+    tt, ee = np.broadcast_arrays(np.arange(T)[:, None], np.arange(E)[None, :])
+    rows.append(r.ravel())
+    cols.append((F + H + tt).ravel())
+    vals.append(-cap[ee].ravel())
+    num_rows += r.size
+
+    A_ub = sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                         shape=(num_rows, num_vars))
+    b_ub = np.zeros(num_rows)
+    b_ub[b_flow] = 1.
+
+    lb = np.zeros(num_vars)
+    ub = np.full(num_vars, np.inf)
+    ub[:F] = 1.
+    ub[F:F + H] = 1.
+    # step 0 can only forward the own shard
+    ub[:N * E] = (src[None, :] == np.arange(N)[:, None]).ravel()
+    # a node always holds its own shard, every node holds every shard at the end
+    h = lb[F:F + H].reshape(T, N, N)
+    h[:, np.arange(N), np.arange(N)] = 1.
+    h[T - 1] = 1.
+
+    c = np.zeros(num_vars)
+    c[F + H:] = 1.
+
+    result = linprog(c, A_ub=A_ub, b_ub=b_ub, bounds=np.stack(
+        [lb, ub], axis=1), method='highs')
+
+    if result.status != 0:
+        return OptimalResult(T, float('inf'), float('inf'), [], result.message)
+
+    step_U = result.x[F + H:].tolist()
+    U = float(sum(step_U))
+    TB = U * utils.min_in_capacity(G) / N
+    return OptimalResult(T, U, TB, step_U, 'optimal')
+
+
+def optimality_gap(G: nx.DiGraph, A: Schedule) -> Tuple[float, float, float]:
+    '''
+    compare schedule A with the time-expanded LP bound for the same number of steps
+    return: TB of A, TB bound, relative gap TB_A / TB_bound - 1
+    '''
+    T = max(A.keys(), default=0)
+    TB = utils.schedule_U(A) * utils.min_in_capacity(G) / G.number_of_nodes()
+    bound = optimal_allgather(G, T).TB
+    return TB, bound, TB / bound - 1
+
+
+def _main1():
+    import expansion
+    G = graph.generalized_kautz_graph(2, 12)
+    A = BFB(G, False)
+    print(f'BFB g_kautz(2, 12): TB, bound, gap = {optimality_gap(G, A)}')
+    T = max(A.keys())
+    print(f'g_kautz(2, 12) with {T + 1} steps: TB bound = {optimal_allgather(G, T + 1).TB}')
+
+    G = graph.circulant_graph(16, [2, 3])
+    A = BFB(G, False)
+    print(f'BFB C(16, [2, 3]): TB, bound, gap = {optimality_gap(G, A)}')
+
+    G = graph.complete_graph(3)
+    A = BFB(G, False)
+    G_L, A_L = expansion.line_graph_expansion(G, A)
+    print(f'Line(K(3)): TB, bound, gap = {optimality_gap(G_L, A_L)}')
+    G_D, A_D = expansion.degree_expansion(G, A, 2)
+    print(f'Deg(2, K(3)): TB, bound, gap = {optimality_gap(G_D, A_D)}')
+
+
+if __name__ == '__main__':
+    from bfb_schedule import BFB
+    import graph
+    _main1()
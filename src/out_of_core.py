@@ -0,0 +1,206 @@
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+import ast
+import json
+import os
+import tempfile
+import time
+import networkx as nx
+import numpy as np
+
+from schedule_type import *
+import utils
+from profiling import Profiler, span
+
+
+# measured size of a built cvxpy LP per transfer variable, with headroom for the solve
+_BYTES_PER_VAR = 8192
+
+
+class OutOfCoreResult(NamedTuple):
+    path: str               # JSON lines of schedule entries, see `iter_entries`
+    TL: int
+    U: float                # sum of the per-step max loads, as `utils.schedule_U`
+    entries: int
+
+
+def distance_matrix(G: nx.DiGraph, path: str, nodes: List[Node] | None = None,
+                    memory_budget_mb: float = 256.) -> Tuple[np.memmap, int]:
+    '''
+    int16 memmap of shape (N, N) at path, row u holds the hop distances from every node to u, -1 if unreachable,
+    computed in chunks of rows that fit the memory budget
+    return: the matrix and the diameter
+    '''
+    from scipy.sparse.csgraph import shortest_path
+
+    nodes = list(G.nodes()) if nodes is None else nodes
+    N = len(nodes)
+    assert N < 2 ** 15, "int16 distances"
+    # transposed adjacency: a search from u follows the links into u
+    A_rev = nx.to_scipy_sparse_array(G, nodelist=nodes, weight=None, format='csr').T.tocsr()
+
+    D = np.lib.format.open_memmap(path, mode='w+', dtype=np.int16, shape=(N, N))
+    chunk = max(1, int(memory_budget_mb * 2 ** 20 // (8 * N)))
+    diameter, connected = 0, True
+    for begin in range(0, N, chunk):
+        rows = shortest_path(A_rev, method='D', unweighted=True, indices=np.arange(begin, min(begin + chunk, N)))
+        unreachable = np.isinf(rows)
+        rows[unreachable] = -1
+        D[begin:begin + len(rows)] = rows.astype(np.int16)
+        connected = connected and not unreachable.any()
+        diameter = max(diameter, int(rows.max()))
+    D.flush()
+    assert connected, "not connected graph"
+    return D, diameter
+
+
+def _tasks_of(G: nx.DiGraph, D: np.ndarray, nodes: List[Node], index: Dict[Node, int], u: Node):
+    '''
+    the LPs of destination u for every time step, from row u and the rows of its in neighbors
+    '''
+    from bfb_schedule import _problem_task_from_pairs
+
+    row_u = np.asarray(D[index[u]])
+    neighbors_w = list(G.predecessors(u))
+    rows_w = np.asarray(D[[index[w] for w in neighbors_w]]) if neighbors_w else np.empty((0, len(nodes)), np.int16)
+
+    for t in range(1, int(row_u.max()) + 1):
+        sources = np.flatnonzero(row_u == t)
+        if len(sources) == 0:
+            continue
+        valid = rows_w[:, sources] == t - 1
+        valid_pairs = [(nodes[sources[k]], neighbors_w[j]) for k, j in zip(*np.nonzero(valid.T))]
+        task = _problem_task_from_pairs(G, TimeStep(t), u, [nodes[v] for v in sources], neighbors_w, valid_pairs)
+        if task is not None:
+            yield task
+
+
+def _write_entry(f, t: TimeStep, u: Node, entry: ScheduleEntry) -> None:
+    f.write(json.dumps({'t': t, 'u': repr(u), 'load_U': entry['load_U'],
+                        'transfers': [[repr(v), repr(w), fraction] for (v, w), fraction in entry['transfers'].items()]}))
+    f.write('\n')
+
+
+def BFB_out_of_core(G: nx.DiGraph, path: str, memory_budget_mb: float = 256., distance_path: str | None = None,
+                    print_detail: bool = False, sparsify: bool = False, profiler: Profiler | None = None) -> OutOfCoreResult:
+    '''
+    `BFB` with peak memory set by memory_budget_mb instead of N^2:
+    hop distances live in an on-disk int16 matrix (see `distance_matrix`), the LPs are built destination by destination
+    and solved in batches whose estimated size fits the budget, and every solved entry is appended to path as one JSON line.
+    the memmap pages are cached by the OS and are not counted in the budget
+    distance_path: where to keep the distance matrix, a temporary file removed at the end if None
+    '''
+    from bfb_schedule import _solve_problem_buffer
+
+    time_begin = time.time()
+    nodes = list(G.nodes())
+    index = {u: i for i, u in enumerate(nodes)}
+    budget = memory_budget_mb * 2 ** 20
+
+    remove_distances = distance_path is None
+    if distance_path is None:
+        fd, distance_path = tempfile.mkstemp(suffix='.npy')
+        os.close(fd)
+
+    try:
+        with span(profiler, 'distances'):
+            D, diameter = distance_matrix(G, distance_path, nodes, memory_budget_mb / 2)
+        if print_detail:
+            print(f'Diameter: {diameter}')
+
+        step_U: Dict[TimeStep, float] = {}
+        entries = 0
+        num_batches = 0
+
+        with open(path, 'w') as f:
+            def solve(batch):
+                nonlocal entries
+                with span(profiler, 'solve', num_problems=len(batch)):
+                    results = _solve_problem_buffer(batch, '', False, sparsify, profiler)
+                with span(profiler, 'flush'):
+                    for t, u, entry, _ in results:
+                        if entry is not None:
+                            _write_entry(f, t, u, entry)
+                            step_U[t] = max(step_U.get(t, 0.), entry['load_U'])
+                            entries += 1
+                    f.flush()
+
+            batch, batch_bytes = [], 0
+            for u in nodes:
+                with span(profiler, 'build', u=u):
+                    tasks = list(_tasks_of(G, D, nodes, index, u))
+                batch += tasks
+                batch_bytes += sum(len(task.x_vars) for task in tasks) * _BYTES_PER_VAR
+                if batch_bytes >= budget / 2:
+                    solve(batch)
+                    batch, batch_bytes = [], 0
+                    num_batches += 1
+                    if print_detail:
+                        print(f'batch {num_batches}: {entries} entries written, up to node {index[u] + 1}/{len(nodes)}')
+            if batch:
+                solve(batch)
+                num_batches += 1
+        del D
+    finally:
+        if remove_distances:
+            os.remove(distance_path)
+
+    if print_detail:
+        print(f'\nout-of-core BFB: {entries} entries in {num_batches} batches, time cost: {(time.time() - time_begin):.3f}')
+
+    return OutOfCoreResult(path, max(step_U, default=0), sum(step_U.values()), entries)
+
+
+def iter_entries(path: str) -> Iterator[Tuple[TimeStep, Node, ScheduleEntry]]:
+    '''
+    the (t, u, entry) written by `BFB_out_of_core`, one at a time
+    '''
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            yield (TimeStep(record['t']), ast.literal_eval(record['u']), ScheduleEntry(
+                load_U=record['load_U'],
+                transfers={TransferKey(ast.literal_eval(v), ast.literal_eval(w)): Fraction(fraction)
+                           for v, w, fraction in record['transfers']}))
+
+
+def load_entries(path: str) -> Schedule:
+    '''
+    the whole schedule in memory, for graphs where that fits
+    '''
+    A: Schedule = {}
+    for t, u, entry in iter_entries(path):
+        A.setdefault(t, {})[u] = entry
+    return {t: A[t] for t in sorted(A)}
+
+
+def _run_measured(G: nx.DiGraph, path: str, memory_budget_mb: float, queue) -> None:
+    import resource
+    result = BFB_out_of_core(G, path, memory_budget_mb, print_detail=True)
+    # kilobytes on Linux
+    queue.put((result, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def _main1():
+    import multiprocessing as mp
+    import graph
+    from bfb_schedule import BFB
+
+    G = graph.torus([8, 8])
+    path = os.path.join(tempfile.mkdtemp(), 'schedule.jsonl')
+    # a process of its own, so that the peak RSS is of the out-of-core BFB alone
+    queue = mp.get_context().Queue()
+    process = mp.get_context().Process(target=_run_measured, args=(G, path, 4, queue))
+    process.start()
+    result, peak_rss_mb = queue.get()
+    process.join()
+
+    A = load_entries(path)
+    N = G.number_of_nodes()
+    print(f'peak RSS of the out-of-core BFB: {peak_rss_mb:.1f} MB')
+    print(f'TL = {result.TL}, TB = {result.U * utils.min_in_capacity(G) / N:.4f}, '
+          f'in memory BFB: {utils.get_TL_TB(G, BFB(G, False))}, '
+          f'{len(utils.validate_schedule(G, A))} errors')
+
+
+if __name__ == '__main__':
+    _main1()
@@ -0,0 +1,127 @@
+from typing import Dict, Tuple
+import numpy as np
+import networkx as nx
+
+from schedule_type import *
+import utils
+
+
+def pipeline_schedule(A: Schedule, k: int, G: nx.DiGraph | None = None) -> Schedule:
+    '''
+    split every shard into k chunks and pipeline them:
+    chunk c (0 <= c < k) runs time step t of A at time step t + c with 1/k of every fraction,
+    so links idle at the early steps of A carry later chunks
+    G: graph of A, for link capacities
+    return: schedule with T + k - 1 time steps, transfers of the same (source, via, dest) at one step are summed
+    '''
+    assert k >= 1
+
+    A_prime: Schedule = {}
+    for t, step_schedule in A.items():
+        for c in range(k):
+            t_prime = TimeStep(t + c)
+            step_prime = A_prime.setdefault(t_prime, {})
+
+            for u, entry in step_schedule.items():
+                if u not in step_prime:
+                    step_prime[u] = {'load_U': 0.0, 'transfers': {}}
+                transfers = step_prime[u]['transfers']
+                for key, fraction in entry['transfers'].items():
+                    transfers[key] = Fraction(
+                        transfers.get(key, 0.0) + fraction / k)
+
+    A_prime = dict(sorted(A_prime.items()))
+    return utils.update_load_U(A_prime, G)
+
+
+def link_step_loads(A: Schedule, G: nx.DiGraph | None = None) -> np.ndarray:
+    '''
+    return: array (T, number of links), load in time units of every link at every time step of A
+    '''
+    T = max(A.keys(), default=0)
+    links: Dict[Tuple[Node, Node], int] = {}
+    rows, cols, values = [], [], []
+
+    for t, step_schedule in A.items():
+        for u, entry in step_schedule.items():
+            for (v, w), fraction in entry['transfers'].items():
+                link = links.setdefault((w, u), len(links))
+                capacity = utils.link_capacity(
+                    G, w, u) if G is not None else 1.0
+                rows.append(t - 1)
+                cols.append(link)
+                values.append(fraction / capacity)
+
+    loads = np.zeros((T, len(links)))
+    np.add.at(loads, (np.array(rows, dtype=np.int64),
+              np.array(cols, dtype=np.int64)), values)
+    return loads
+
+
+def _pipelined_step_U(loads: np.ndarray, k: int) -> np.ndarray:
+    '''
+    per-step max load of the k-chunk pipeline from the per-link loads of the original schedule:
+    step s carries 1/k of the original steps s - k + 1 .. s, a sliding window over cumulative sums
+    '''
+    T, E = loads.shape
+    cumulative = np.zeros((T + k, E))
+    cumulative[1:T + 1] = np.cumsum(loads, axis=0)
+    cumulative[T + 1:] = cumulative[T]
+
+    s = np.arange(1, T + k)
+    window = cumulative[s] - cumulative[np.maximum(s - k, 0)]
+    return window.max(axis=1) / k if E else np.zeros(len(s))
+
+
+def pipeline_cost(A: Schedule, k: int, shard_bytes: float, alpha: float, beta: float,
+                  G: nx.DiGraph | None = None, loads: np.ndarray | None = None) -> float:
+    '''
+    α-β cost of the k-chunk pipeline of A: every step pays α plus β per byte on its most loaded link
+    shard_bytes: size of the shard of every node
+    alpha: seconds per time step (message latency)
+    beta: seconds per byte on a unit capacity link
+    '''
+    if loads is None:
+        loads = link_step_loads(A, G)
+    step_U = _pipelined_step_U(loads, k)
+    return len(step_U) * alpha + beta * shard_bytes * float(step_U.sum())
+
+
+def best_pipeline_depth(A: Schedule, shard_bytes: float, alpha: float, beta: float,
+                        max_k: int = 64, G: nx.DiGraph | None = None) -> Tuple[int, float]:
+    '''
+    return: number of chunks in [1, max_k] with the lowest α-β cost, its cost in seconds
+    '''
+    loads = link_step_loads(A, G)
+    costs = [(pipeline_cost(A, k, shard_bytes, alpha, beta, loads=loads), k)
+             for k in range(1, max_k + 1)]
+    cost, k = min(costs)
+    return k, cost
+
+
+def _main1():
+    '''
+    pipelining pays off when the bottleneck link moves between steps,
+    e.g. the two levels of a hierarchical schedule
+    '''
+    import expansion
+    G_intra = graph.complete_graph(4)
+    nx.set_edge_attributes(G_intra, 4.0, 'capacity')
+    G_inter = graph.ring(6, False)
+    G, A = expansion.hierarchical_expansion(
+        G_intra, BFB(G_intra, False), G_inter, BFB(G_inter, False))
+
+    for k in [1, 2, 4, 8]:
+        P = pipeline_schedule(A, k, G)
+        print(f'k = {k}: {utils.get_schedule_TL_TB(G, P)}')
+
+    for shard_bytes in [1 << 10, 1 << 20, 1 << 30]:
+        k, cost = best_pipeline_depth(
+            A, shard_bytes, alpha=10e-6, beta=1 / 25e9, G=G)
+        print(f'shard {shard_bytes} B: best k = {k}, cost = {cost * 1e3:.4f} ms, unpipelined = {pipeline_cost(A, 1, shard_bytes, 10e-6, 1 / 25e9, G) * 1e3:.4f} ms')
+
+
+if __name__ == '__main__':
+    from bfb_schedule import BFB
+    import graph
+    _main1()
@@ -0,0 +1,214 @@
+from typing import Callable, Dict, List, Tuple
+import heapq
+import math
+import os
+
+import bounds
+import utils
+from topology_finder import (TopologyEntry, TopologyFinder, DIST_REG_PATH, read_DistReg_topologies,
+                             line_graph_exp, degree_exp, cartesian_power, cartessian_prod, hierarchical_exp)
+
+
+Cell = Tuple[int, int]
+
+# a move builds (N, d) from smaller cells: (operator name, parameter, sub cells)
+Move = Tuple[str, int, Tuple[Cell, ...]]
+
+
+def divisors(n: int) -> List[int]:
+    small, large = [], []
+    for i in range(1, math.isqrt(n) + 1):
+        if n % i == 0:
+            small.append(i)
+            if i != n // i:
+                large.append(n // i)
+    return small + large[::-1]
+
+
+def integer_root(n: int, k: int) -> int | None:
+    '''
+    return: b with b ** k == n, None if there is none
+    '''
+    b = round(n ** (1 / k))
+    for c in (b - 1, b, b + 1):
+        if c >= 2 and c ** k == n:
+            return c
+    return None
+
+
+def _complete(m: int) -> TopologyEntry:
+    return TopologyEntry(m, m - 1, f"K({m})", 1, (m - 1) / m, True, 0)
+
+
+class Planner:
+    '''
+    goal-directed counterpart of `TopologyFinder.search`:
+    the Pareto frontier of one (N, d) cell is built backwards from the moves producing it,
+    sub cells are solved recursively and memoized, so only cells (N', d') with N' | N and d' <= d are visited
+    '''
+
+    def __init__(self, dist_reg_path: str | None = DIST_REG_PATH) -> None:
+        self.special: Dict[Cell, List[TopologyEntry]] = {}
+        tps: List[TopologyEntry] = []
+        if dist_reg_path is not None and os.path.exists(dist_reg_path):
+            tps += read_DistReg_topologies(dist_reg_path)
+        for tp in tps:
+            self.special.setdefault((tp.N, tp.d), []).append(tp)
+
+        self.memo: Dict[Cell, List[TopologyEntry]] = {}
+        self.expanded_moves = 0
+        self.pruned_moves = 0
+
+    def moves(self, N: int, d: int) -> List[Tuple[int, Move]]:
+        '''
+        every move producing (N, d), with a lower bound of its TL:
+        the operators are monotone in TL, so applying them to the Moore diameters of the sub cells is admissible
+        '''
+        moves: List[Tuple[int, Move]] = []
+        moore = bounds.moore_diameter
+        divs = divisors(N)
+
+        # line graph expansion: (N / d, d)
+        if d > 1 and N % d == 0 and N // d >= 2:
+            moves.append((moore(N // d, d) + 1, ('line', 0, ((N // d, d),))))
+
+        # degree expansion: (N / n, d / n)
+        for n in range(2, d + 1):
+            if d % n == 0 and N % n == 0 and N // n >= 2:
+                moves.append((moore(N // n, d // n) + 1,
+                             ('degree', n, ((N // n, d // n),))))
+
+        # cartesian power: (N ^ (1 / n), d / n)
+        for n in range(2, d + 1):
+            b = integer_root(N, n) if d % n == 0 else None
+            if b is not None:
+                moves.append((moore(b, d // n) * n,
+                             ('power', n, ((b, d // n),))))
+
+        # cartesian product: (n1, d1) x (n2, d2)
+        for n1 in divs:
+            n2 = N // n1
+            if n1 < 2 or n2 < 2 or n1 < n2:
+                continue
+            for d1 in range(1, d):
+                d2 = d - d1
+                moves.append((moore(n1, d1) + moore(n2, d2),
+                             ('product', 0, ((n1, d1), (n2, d2)))))
+
+        # hierarchical composition: K(m) boxes of (N / m, d - m + 1)
+        for m in divs:
+            if 2 <= m <= d and N // m >= 2:
+                moves.append((1 + moore(N // m, d - m + 1),
+                             ('hierarchical', m, ((N // m, d - m + 1),))))
+
+        moves.sort(key=lambda item: item[0])
+        return moves
+
+    def _apply(self, move: Move) -> List[TopologyEntry]:
+        name, n, cells = move
+        subs = [self.frontier(*cell) for cell in cells]
+
+        if name == 'line':
+            return [line_graph_exp(tp) for tp in subs[0]]
+        if name == 'degree':
+            return [degree_exp(tp, n) for tp in subs[0]]
+        if name == 'power':
+            return [cartesian_power(tp, n) for tp in subs[0]]
+        if name == 'product':
+            return [cartessian_prod(tp1, tp2) for tp1 in subs[0] if tp1.BW_optimal
+                    for tp2 in subs[1] if tp2.BW_optimal]
+        if name == 'hierarchical':
+            return [hierarchical_exp(_complete(n), tp) for tp in subs[0]]
+        raise ValueError(f"unknown move {name}")
+
+    def frontier(self, N: int, d: int) -> List[TopologyEntry]:
+        '''
+        Pareto frontier (TL, TB) of the (N, d) cell,
+        moves are tried in the order of their TL lower bound and skipped once an entry
+        with optimal TB reaches it, nothing they build could be on the frontier
+        '''
+        if (N, d) in self.memo:
+            return self.memo[(N, d)]
+        if N < 2 or d < 1:
+            self.memo[(N, d)] = []
+            return []
+
+        optimal_B = bounds.optimal_TB(N)
+        tps = self.special.get((N, d), []) + \
+            TopologyFinder.basic_graph_set1(N, d) + \
+            TopologyFinder.basic_graph_set2(N, d)
+
+        for lb, move in self.moves(N, d):
+            best_TL = min((tp.TL for tp in tps if tp.TB <= optimal_B + 1e-4), default=math.inf)
+            if lb >= best_TL:
+                self.pruned_moves += 1
+                continue
+            self.expanded_moves += 1
+            tps += [tp for tp in self._apply(move) if tp.N == N and tp.d == d]
+
+        result = utils.pareto_frontier(
+            tps, key1=lambda x: x.TL, key2=lambda x: x.TB, eps2=1e-4, key3=lambda x: x.nest_level)
+        self.memo[(N, d)] = result
+        return result
+
+    def best(self, N: int, d: int,
+             cost: Callable[[TopologyEntry], float] = lambda tp: (tp.TL, tp.TB)) -> TopologyEntry | None:
+        '''
+        best-first search for the entry of (N, d) with the lowest cost, cost must be monotone in TL and TB:
+        moves are expanded in the order of the cost of their lower bound, (TL bound, optimal TB),
+        and the search stops when no remaining move can beat the incumbent
+        '''
+        optimal_B = bounds.optimal_TB(N)
+
+        def bound(lb: int) -> TopologyEntry:
+            return TopologyEntry(N, d, '', lb, optimal_B, True, 0)
+
+        candidates = self.special.get((N, d), []) + \
+            TopologyFinder.basic_graph_set1(N, d) + \
+            TopologyFinder.basic_graph_set2(N, d)
+        incumbent = min(candidates, key=cost, default=None)
+
+        heap = [(cost(bound(lb)), i, move)
+                for i, (lb, move) in enumerate(self.moves(N, d))]
+        heapq.heapify(heap)
+        while heap:
+            lower, _, move = heapq.heappop(heap)
+            if incumbent is not None and lower >= cost(incumbent):
+                self.pruned_moves += 1 + len(heap)
+                break
+            self.expanded_moves += 1
+            for tp in self._apply(move):
+                if tp.N == N and tp.d == d and (incumbent is None or cost(tp) < cost(incumbent)):
+                    incumbent = tp
+
+        return incumbent
+
+
+def _main1():
+    import time
+
+    # same frontier as the bottom-up table
+    tf = TopologyFinder(256, 4)
+    tf.search()
+    planner = Planner()
+    mismatches = 0
+    for n in range(2, 257):
+        for d in range(1, 5):
+            got = planner.frontier(n, d)
+            if any(not any(g.TL <= e.TL and g.TB <= e.TB + 1e-4 for g in got) for e in tf.topology_table[n][d]):
+                mismatches += 1
+    print(f'cells where the planner misses a TopologyFinder entry: {mismatches}')
+
+    for N, d in [(4096, 4), (65536, 4), (200000, 4), (262144, 8)]:
+        planner = Planner()
+        begin = time.perf_counter()
+        tp = planner.best(N, d)
+        seconds = time.perf_counter() - begin
+        print(f'N = {N}, d = {d}: {seconds * 1e3:.1f} ms, {len(planner.memo)} cells, '
+              f'{planner.expanded_moves} moves expanded, {planner.pruned_moves} pruned')
+        if tp is not None:
+            tp.print()
+
+
+if __name__ == '__main__':
+    _main1()
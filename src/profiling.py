@@ -0,0 +1,140 @@
+from typing import Any, Dict, List, NamedTuple, Protocol
+import contextlib
+import json
+import threading
+import time
+
+
+class Event(NamedTuple):
+    name: str
+    cat: str                # 'phase', 'lp', ...
+    start: float            # perf_counter seconds
+    duration: float         # seconds
+    tid: int                # small thread index, 0 for the first thread seen
+    args: Dict[str, Any]
+
+
+class Sink(Protocol):
+    def emit(self, event: Event) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class Profiler:
+    '''
+    collects timed events and forwards them to the sinks,
+    code takes `profiler: Profiler | None` and skips all bookkeeping when it is None
+    '''
+
+    def __init__(self, sinks: List[Sink]) -> None:
+        self.sinks = sinks
+        self._tids: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def _tid(self) -> int:
+        ident = threading.get_ident()
+        tid = self._tids.get(ident)
+        if tid is None:
+            with self._lock:
+                tid = self._tids.setdefault(ident, len(self._tids))
+        return tid
+
+    def record(self, name: str, cat: str, start: float, duration: float, **args) -> None:
+        event = Event(name, cat, start, duration, self._tid(), args)
+        with self._lock:
+            for sink in self.sinks:
+                sink.emit(event)
+
+    @contextlib.contextmanager
+    def span(self, name: str, cat: str = 'phase', **args):
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.record(name, cat, start, time.perf_counter() - start, **args)
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+def span(profiler: Profiler | None, name: str, cat: str = 'phase', **args):
+    '''
+    `profiler.span` or a no-op context when profiling is disabled
+    '''
+    if profiler is None:
+        return contextlib.nullcontext(args)
+    return profiler.span(name, cat, **args)
+
+
+class ChromeTraceSink:
+    '''
+    trace-event JSON for chrome://tracing or Perfetto, written on close
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.events: List[Event] = []
+
+    def emit(self, event: Event) -> None:
+        self.events.append(event)
+
+    def close(self) -> None:
+        origin = min((e.start for e in self.events), default=0.)
+        trace = [{'name': e.name, 'cat': e.cat, 'ph': 'X', 'pid': 0, 'tid': e.tid,
+                  'ts': (e.start - origin) * 1e6, 'dur': e.duration * 1e6,
+                  'args': {k: v if isinstance(v, (int, float, str, bool)) else str(v) for k, v in e.args.items()}}
+                 for e in self.events]
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+class SummarySink:
+    '''
+    per event name: count, total, mean and max duration,
+    numeric args (e.g. LP sizes, queue waits) are summed and reported as means, except the ignored ones,
+    node labels (arg u) are ignored by default
+    '''
+
+    def __init__(self, print_on_close: bool = True, ignore_args: tuple = ('t', 'u')) -> None:
+        self.print_on_close = print_on_close
+        self.ignore_args = ignore_args
+        self.stats: Dict[str, Dict[str, Any]] = {}
+
+    def emit(self, event: Event) -> None:
+        s = self.stats.setdefault(
+            event.name, {'cat': event.cat, 'count': 0, 'total': 0., 'max': 0., 'args': {}})
+        s['count'] += 1
+        s['total'] += event.duration
+        s['max'] = max(s['max'], event.duration)
+        for k, v in event.args.items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool) and k not in self.ignore_args:
+                s['args'][k] = s['args'].get(k, 0.) + v
+
+    def print_summary(self) -> None:
+        print(f"{'name':<28}{'count':>8}{'total ms':>12}{'mean ms':>10}{'max ms':>10}  mean args")
+        for name, s in sorted(self.stats.items(), key=lambda item: -item[1]['total']):
+            args = ', '.join(f'{k}: {v / s["count"]:.4g}' for k, v in s['args'].items())
+            print(f"{name:<28}{s['count']:>8}{s['total'] * 1e3:>12.2f}"
+                  f"{s['total'] / s['count'] * 1e3:>10.3f}{s['max'] * 1e3:>10.3f}  {args}")
+
+    def close(self) -> None:
+        if self.print_on_close:
+            self.print_summary()
+
+
+def _main1():
+    import os
+    import tempfile
+    import graph
+    from bfb_schedule import BFB
+
+    path = os.path.join(tempfile.mkdtemp(), 'bfb_trace.json')
+    profiler = Profiler([ChromeTraceSink(path), SummarySink()])
+    BFB(graph.torus([4, 4]), False, profiler=profiler)
+    profiler.close()
+    print(f'trace written to {path}')
+
+
+if __name__ == '__main__':
+    _main1()
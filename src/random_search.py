@@ -0,0 +1,209 @@
+from typing import Callable, Iterable, List, NamedTuple, Tuple
+import concurrent.futures
+import numpy as np
+
+import graph
+import utils
+from topology_finder import TopologyEntry, TopologyFinder
+
+
+class Candidate(NamedTuple):
+    spec: str               # `graph.from_spec` spec, rebuilds the same graph
+    TL: int                 # diameter
+    total_distance: int     # sum of all pair distances, ties of TL prefer the smaller one
+
+
+def _predecessor_table(S: np.ndarray) -> np.ndarray | None:
+    '''
+    (N, d) in neighbors from the (N, d) out neighbors, None if G is not in-regular
+    '''
+    n, d = S.shape
+    order = np.argsort(S.ravel(), kind='stable')
+    if not (np.bincount(S.ravel(), minlength=n) == d).all():
+        return None
+    return (order // d).reshape(n, d)
+
+
+def bitset_diameter(P: np.ndarray, limit: int | None = None) -> Tuple[int, int] | None:
+    '''
+    diameter and sum of the pair distances of the graph with in neighbor table P,
+    row v of the bitset holds the sources reaching v so far, one step ORs in the rows of the in neighbors
+    limit: give up once the diameter is known to exceed it
+    return: None if G is not strongly connected or the diameter exceeds limit
+    '''
+    n = len(P)
+    words = (n + 63) // 64
+    R = np.zeros((n, words), dtype=np.uint64)
+    R[np.arange(n), np.arange(n) // 64] = np.left_shift(np.uint64(1), (np.arange(n) % 64).astype(np.uint64))
+    full = np.full(words, np.uint64(2 ** 64 - 1))
+    if n % 64:
+        full[-1] = np.uint64((1 << (n % 64)) - 1)
+
+    reached = n
+    total = 0
+    D = 0
+    while reached < n * n:
+        total += n * n - reached
+        D += 1
+        if limit is not None and D > limit:
+            return None
+        new = R.copy()
+        for j in range(P.shape[1]):
+            new |= R[P[:, j]]
+        new_reached = int(np.bitwise_count(new).sum())
+        if new_reached == reached:
+            return None
+        R, reached = new, new_reached
+    assert (R == full).all()
+    return D, total
+
+
+def default_bases(N: int, d: int) -> List[str]:
+    '''
+    small d-regular graphs with few hops whose lifts reach N nodes
+    '''
+    bases = []
+    if N % (d + 1) == 0 and N > d + 1:
+        bases.append(f'complete:{d + 1}')
+    if d % 2 == 0 and N % (2 * d) == 0 and N > 2 * d:
+        bases.append(f'bipartite:{d}')
+    if d == 4:
+        for m in range(5, N // 2 + 1):
+            if N % m == 0:
+                a = int(np.floor(np.sqrt((m - 2) / 2)))
+                if a >= 1 and 2 * (a + 1) < m:
+                    bases.append(f'circulant:{m},{a},{a + 1}')
+    return bases
+
+
+def _seed(seed: int, N: int, d: int, i: int) -> int:
+    return int(np.random.SeedSequence([seed, N, d, i]).generate_state(1)[0])
+
+
+def sample_cell(N: int, d: int, samples: int = 256, keep: int = 4, seed: int = 0,
+                bases: List[str] | None = None) -> List[Candidate]:
+    '''
+    screen random d-regular digraphs and random lifts of the bases by diameter,
+    the samples are split evenly between the random graphs and every base
+    return: the keep best candidates by (TL, total distance)
+    '''
+    bases = default_bases(N, d) if bases is None else bases
+    per_family = max(1, samples // (1 + len(bases)))
+
+    def generate():
+        for i in range(per_family):
+            s = _seed(seed, N, d, i)
+            S = graph._random_regular_successors(N, d, np.random.default_rng(s))
+            if S is not None:
+                yield f'random:{N},{d},{s}', S
+        for b, base in enumerate(bases):
+            _, S_base = graph.successor_table(graph.from_spec(base))
+            k = N // len(S_base)
+            for i in range(per_family):
+                s = _seed(seed, N, d, (b + 1) * per_family + i)
+                yield f'lift:{k},{s},{base}', graph._lift_successors(S_base, k, np.random.default_rng(s))
+
+    candidates: List[Candidate] = []
+    for spec, S in generate():
+        P = _predecessor_table(S)
+        if P is None:
+            continue
+        # once keep candidates are found, a worse diameter can stop early
+        limit = candidates[-1].TL if len(candidates) >= keep else None
+        screened = bitset_diameter(P, limit)
+        if screened is None:
+            continue
+        candidates.append(Candidate(spec, *screened))
+        candidates.sort(key=lambda c: (c.TL, c.total_distance))
+        del candidates[keep:]
+    return candidates
+
+
+def evaluate(spec: str) -> Tuple[str, int, float]:
+    '''
+    BFB of one candidate, runs in a worker process
+    '''
+    from bfb_schedule import BFB
+    G = graph.from_spec(spec)
+    TL, TB = utils.get_TL_TB(G, BFB(G, False))
+    return spec, TL, TB
+
+
+def topology_name(spec: str) -> str:
+    '''
+    `TopologyEntry` name of a candidate, with the seed that rebuilds it, e.g. Lift(4, complete:5, 123)
+    '''
+    family, _, rest = spec.partition(':')
+    if family == 'random':
+        N, d, seed = rest.split(',')
+        return f'Rand({N},{d},{seed})'
+    k, seed, base = rest.split(',', 2)
+    return f'Lift({k}, {base}, {seed})'
+
+
+def random_search(cells: Iterable[Tuple[int, int]], samples: int = 256, keep: int = 4, seed: int = 0,
+                  workers: int | None = None,
+                  dominated: Callable[[int, int, int, float], bool] | None = None) -> List[TopologyEntry]:
+    '''
+    sample every (N, d) cell and run BFB on the keep best candidates of each in a process pool
+    dominated: (N, d, TL, TB) -> True to skip BFB of a candidate whose TL with the optimal TB is already beaten
+    return: one entry per evaluated candidate, reproducible from the seed in its name
+    '''
+    specs = {c.spec: (N, d) for N, d in cells for c in sample_cell(N, d, samples, keep, seed)
+             if dominated is None or not dominated(N, d, c.TL, (N - 1) / N)}
+
+    tps = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for spec, TL, TB in executor.map(evaluate, specs):
+            N, d = specs[spec]
+            tps.append(TopologyEntry(N, d, topology_name(spec), TL, TB, TB <= (N - 1) / N + 1e-4, 0))
+    return tps
+
+
+def improve_finder(tf: TopologyFinder, cells: Iterable[Tuple[int, int]], samples: int = 256, keep: int = 4,
+                   seed: int = 0, workers: int | None = None) -> int:
+    '''
+    insert the random search results of the cells that are not closed into tf
+    return: number of cells whose frontier changed
+    '''
+    cells = [(N, d) for N, d in cells if not tf.is_closed(N, d)]
+    changed = set()
+    for tp in random_search(cells, samples, keep, seed, workers, tf.is_dominated):
+        if not tf.is_dominated(tp.N, tp.d, tp.TL, tp.TB):
+            tf.try_insert(tp)
+            tf.topology_table[tp.N][tp.d] = utils.pareto_frontier(
+                tf.topology_table[tp.N][tp.d], key1=lambda x: x.TL, key2=lambda x: x.TB, eps2=1e-4, key3=lambda x: x.nest_level)
+            changed.add((tp.N, tp.d))
+    return len(changed)
+
+
+def _main1():
+    import time
+    import networkx as nx
+
+    # screening agrees with networkx
+    for spec in ['random:50,3,7', 'lift:8,3,complete:4', 'circulant:16,2,3']:
+        G = graph.from_spec(spec)
+        _, S = graph.successor_table(G)
+        D, total = bitset_diameter(_predecessor_table(S))
+        assert D == nx.diameter(G) and total == sum(sum(r.values()) for _, r in nx.all_pairs_shortest_path_length(G))
+
+    tf = TopologyFinder(128, 4)
+    tf.search()
+    cells = [(60, 3), (100, 3), (96, 4)]
+    for N, d in cells:
+        print(f'({N}, {d}) before:')
+        for tp in tf.topology_table[N][d]:
+            tp.print()
+
+    begin = time.perf_counter()
+    changed = improve_finder(tf, cells, samples=128, keep=2)
+    print(f'\n{changed} cells improved in {time.perf_counter() - begin:.1f} s')
+    for N, d in cells:
+        print(f'({N}, {d}) after:')
+        for tp in tf.topology_table[N][d]:
+            tp.print()
+
+
+if __name__ == '__main__':
+    _main1()
@@ -0,0 +1,311 @@
+from typing import Dict, List, Tuple
+import os
+import numpy as np
+import networkx as nx
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+
+from schedule_type import *
+import utils
+
+
+_layout_cache: Dict[Tuple, np.ndarray] = {}
+
+
+def _flatten(node) -> Tuple:
+    if isinstance(node, tuple):
+        return tuple(x for part in node for x in _flatten(part))
+    return (node,)
+
+
+def _structured_layout(G: nx.DiGraph) -> np.ndarray | None:
+    '''
+    grid layout for products of rings (tuple nodes of ints), circle for integer labelled rings and circulants
+    '''
+    nodes = list(G.nodes())
+    coords = [_flatten(v) for v in nodes]
+
+    if all(isinstance(v, tuple) for v in nodes) and len({len(c) for c in coords}) == 1 \
+            and all(isinstance(x, (int, np.integer)) for c in coords for x in c):
+        C = np.array(coords, dtype=np.float64)
+        index = {v: i for i, v in enumerate(nodes)}
+        src = np.array([index[u] for u, _ in G.edges()], dtype=np.int64)
+        dst = np.array([index[v] for _, v in G.edges()], dtype=np.int64)
+        # a product of rings: every edge moves along exactly one coordinate
+        if not np.all(np.count_nonzero(C[src] != C[dst], axis=1) == 1):
+            return None
+        # dimensions alternate between the axes, later ones as blocks of the earlier ones
+        x, y = np.zeros(len(C)), np.zeros(len(C))
+        scale_x = scale_y = 1.
+        for i in range(C.shape[1]):
+            span = C[:, i].max() + 2
+            if i % 2 == 0:
+                x += C[:, i] * scale_x
+                scale_x *= span
+            else:
+                y += C[:, i] * scale_y
+                scale_y *= span
+        return np.stack([x, y], axis=1)
+
+    n = len(nodes)
+    if set(nodes) == set(range(n)) and n > 2:
+        # circulant: the label differences of the out edges are the same at every node
+        offsets = {(v - u) % n for u, v in G.out_edges(0)}
+        if all((v - u) % n in offsets for u, v in G.edges()):
+            angle = 2 * np.pi * np.array(nodes, dtype=np.float64) / n
+            return np.stack([np.cos(angle), np.sin(angle)], axis=1)
+
+    return None
+
+
+def _pivot_mds(G: nx.DiGraph, num_pivots: int = 50, seed: int = 42) -> np.ndarray:
+    '''
+    pivot MDS (Brandes and Pich): hop distances from a few max-min pivots, double centered,
+    the two leading singular vectors are the coordinates; O(num_pivots * E)
+    '''
+    from scipy.sparse.csgraph import shortest_path
+    adjacency = nx.to_scipy_sparse_array(G, weight=None, format='csr')
+    N = adjacency.shape[0]
+    k = min(num_pivots, N)
+
+    rng = np.random.default_rng(seed)
+    pivots = [int(rng.integers(N))]
+    D = np.empty((k, N))
+    nearest = np.full(N, np.inf)
+    for i in range(k):
+        D[i] = shortest_path(adjacency, unweighted=True, directed=False, indices=pivots[i])
+        nearest = np.minimum(nearest, D[i])
+        if i + 1 < k:
+            pivots.append(int(np.argmax(np.where(np.isfinite(nearest), nearest, -1))))
+
+    finite = np.isfinite(D)
+    D[~finite] = D[finite].max() + 1 if finite.any() else 1.
+    C = D.T ** 2
+    C = -0.5 * (C - C.mean(axis=0) - C.mean(axis=1, keepdims=True) + C.mean())
+    U, S, _ = np.linalg.svd(C, full_matrices=False)
+    return U[:, :2] * S[:2]
+
+
+def layout(G: nx.DiGraph, kind: str = 'auto', seed: int = 42) -> np.ndarray:
+    '''
+    node positions (N, 2) in the order of G.nodes(), cached per graph structure
+    kind: 'auto' (structured if recognized, spring up to 500 nodes, pivot MDS beyond),
+    'spring', 'pivot_mds', 'spectral', 'circular'
+    '''
+    key = (kind, seed, G.number_of_nodes(), hash(tuple(G.nodes())), hash(tuple(G.edges())))
+    if key in _layout_cache:
+        return _layout_cache[key]
+
+    pos = None
+    if kind == 'auto':
+        pos = _structured_layout(G)
+        if pos is None:
+            kind = 'spring' if G.number_of_nodes() <= 500 else 'pivot_mds'
+
+    if pos is None and kind == 'pivot_mds':
+        pos = _pivot_mds(G, seed=seed)
+    elif pos is None:
+        if kind == 'spring':
+            p = nx.spring_layout(G, seed=seed)
+        elif kind == 'spectral':
+            p = nx.spectral_layout(G.to_undirected(as_view=True))
+        elif kind == 'circular':
+            p = nx.circular_layout(G)
+        else:
+            raise ValueError(f"unknown layout {kind}")
+        pos = np.array([p[v] for v in G.nodes()], dtype=np.float64)
+
+    _layout_cache[key] = pos
+    return pos
+
+
+def step_link_loads(G: nx.DiGraph, A: Schedule, source: Node | None = None) -> Tuple[List[TimeStep], np.ndarray]:
+    '''
+    return: time steps, array (T, E) of the load in time units of every edge of G (in G.edges() order),
+    only the shards of source if given
+    '''
+    edge_index = {e: i for i, e in enumerate(G.edges())}
+    capacity = np.array([utils.link_capacity(G, w, u) for w, u in G.edges()], dtype=np.float64)
+    steps = sorted(A.keys())
+    rows, cols, values = [], [], []
+
+    for i, t in enumerate(steps):
+        for u, entry in A[t].items():
+            # sum per via node first, schedules of large graphs hold millions of transfers
+            via_loads: Dict[Node, float] = {}
+            for (v, w), fraction in entry['transfers'].items():
+                if source is None or v == source:
+                    via_loads[w] = via_loads.get(w, 0.) + fraction
+            for w, load in via_loads.items():
+                rows.append(i)
+                cols.append(edge_index[(w, u)])
+                values.append(load)
+
+    loads = np.zeros((len(steps), len(edge_index)))
+    np.add.at(loads, (np.array(rows, dtype=np.int64),
+              np.array(cols, dtype=np.int64)), values)
+    loads /= capacity
+    return steps, loads
+
+
+def _edge_segments(G: nx.DiGraph, pos: np.ndarray) -> np.ndarray:
+    '''
+    (E, 3, 2) polylines, shifted to the right of their direction so that u -> v and v -> u do not overlap,
+    edges much longer than the median (e.g. torus wraparounds) bow away from the center instead of crossing other edges
+    '''
+    index = {v: i for i, v in enumerate(G.nodes())}
+    src = np.array([index[u] for u, _ in G.edges()], dtype=np.int64)
+    dst = np.array([index[v] for _, v in G.edges()], dtype=np.int64)
+    a, b = pos[src], pos[dst]
+    direction = b - a
+    length = np.linalg.norm(direction, axis=1, keepdims=True)
+    length[length == 0] = 1.
+    normal = np.stack([direction[:, 1], -direction[:, 0]], axis=1) / length
+    extent = np.ptp(pos, axis=0).max() if len(pos) > 1 else 1.
+    shift = normal * extent * 0.004
+    middle = (a + b) / 2
+    long = length[:, 0] > 1.5 * np.median(length) if len(length) else np.zeros(0, dtype=bool)
+    outward = np.sign(np.sum(normal * (middle - pos.mean(axis=0)), axis=1, keepdims=True))
+    outward[outward == 0] = 1.
+    bow = normal * outward * length * 0.2 * long[:, None]
+    return np.stack([a + shift, middle + shift + bow, b + shift], axis=1)
+
+
+class ScheduleRenderer:
+    '''
+    one figure for all time steps of a schedule: edges are two LineCollections (idle, active),
+    a step only updates their colors and widths
+    '''
+
+    def __init__(self, G: nx.DiGraph, A: Schedule, source: Node | None = None,
+                 layout_kind: str = 'auto', figsize: Tuple[float, float] = (8, 8), cmap: str = 'plasma') -> None:
+        self.G = G
+        self.source = source
+        self.steps, self.loads = step_link_loads(G, A, source)
+        self.max_load = float(self.loads.max()) if self.loads.size else 1.
+
+        pos = layout(G, layout_kind)
+        segments = _edge_segments(G, pos)
+        N = G.number_of_nodes()
+        small = N <= 50
+
+        self.fig = Figure(figsize=figsize)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self.ax.set_axis_off()
+
+        self.idle = LineCollection(segments, colors='lightgray', linewidths=0.5 if not small else 1.,
+                                   linestyles='dashed' if small else 'solid', zorder=1)
+        self.active = LineCollection(segments, cmap=cmap, zorder=2)
+        self.active.set_clim(0, self.max_load or 1.)
+        self.ax.add_collection(self.idle)
+        self.ax.add_collection(self.active)
+
+        colors = ['#FFAAAA' if v == source else '#888888' for v in G.nodes()]
+        self.ax.scatter(pos[:, 0], pos[:, 1], s=300 if small else max(1., 2000 / N),
+                        c=colors, zorder=3, linewidths=0)
+        if small:
+            for v, (x, y) in zip(G.nodes(), pos):
+                self.ax.annotate(str(v), (x, y), ha='center', va='center', fontsize=8, zorder=4)
+
+        self.fig.colorbar(self.active, ax=self.ax, shrink=0.6, label='link load (time units)')
+        self.ax.autoscale_view()
+        self.title = self.ax.set_title('')
+
+    def draw_step(self, i: int) -> None:
+        load = self.loads[i]
+        on = load > 1e-9
+        width_scale = 3. / (self.max_load or 1.)
+        self.active.set_array(np.where(on, load, np.nan))
+        self.active.set_linewidths(np.where(on, 0.5 + load * width_scale, 0.))
+        label = str(self.source)
+        label = label if len(label) <= 40 else label[:37] + '...'
+        source = f' (source: {label})' if self.source is not None else ''
+        self.title.set_text(f'time step t = {self.steps[i]}{source}')
+
+    def save_steps(self, out_dir: str, fmt: str = 'png', dpi: int = 100) -> List[str]:
+        os.makedirs(out_dir, exist_ok=True)
+        paths = []
+        for i, t in enumerate(self.steps):
+            self.draw_step(i)
+            path = os.path.join(out_dir, f'step_{t:03d}.{fmt}')
+            self.fig.savefig(path, dpi=dpi)
+            paths.append(path)
+        return paths
+
+    def save_animation(self, path: str, fps: float = 1., dpi: int = 100) -> str:
+        '''
+        .gif with Pillow, any other extension with ffmpeg
+        '''
+        from matplotlib.animation import FuncAnimation, PillowWriter, FFMpegWriter
+        animation = FuncAnimation(self.fig, self.draw_step, frames=len(self.steps))
+        writer = PillowWriter(fps=fps) if path.endswith('.gif') else FFMpegWriter(fps=fps)
+        animation.save(path, writer=writer, dpi=dpi)
+        return path
+
+
+def render_heatmap(G: nx.DiGraph, A: Schedule, path: str, layout_kind: str = 'auto',
+                   cmap: str = 'viridis', dpi: int = 100) -> str:
+    '''
+    load of every link summed over all sources and time steps drawn on the graph,
+    next to the (time step, link) load matrix with links sorted by total load
+    '''
+    steps, loads = step_link_loads(G, A)
+    total = loads.sum(axis=0)
+
+    fig = Figure(figsize=(14, 7))
+    FigureCanvasAgg(fig)
+    ax_graph, ax_matrix = fig.subplots(1, 2, width_ratios=[1, 1])
+
+    pos = layout(G, layout_kind)
+    lines = LineCollection(_edge_segments(G, pos), cmap=cmap,
+                           linewidths=0.5 + 2.5 * total / (total.max() or 1.))
+    lines.set_array(total)
+    ax_graph.add_collection(lines)
+    ax_graph.scatter(pos[:, 0], pos[:, 1], s=max(1., 2000 / G.number_of_nodes()), c='#888888', zorder=3)
+    ax_graph.autoscale_view()
+    ax_graph.set_axis_off()
+    ax_graph.set_title('total link load')
+    fig.colorbar(lines, ax=ax_graph, shrink=0.6)
+
+    order = np.argsort(-total, kind='stable')
+    image = ax_matrix.imshow(loads[:, order], aspect='auto', interpolation='nearest', cmap=cmap)
+    ax_matrix.set_yticks(range(len(steps)), [str(t) for t in steps])
+    ax_matrix.set_ylabel('time step')
+    ax_matrix.set_xlabel('link (sorted by total load)')
+    ax_matrix.set_title('link load per time step')
+    fig.colorbar(image, ax=ax_matrix, shrink=0.6)
+
+    fig.savefig(path, dpi=dpi)
+    return path
+
+
+def _main1():
+    import tempfile
+    import time
+    import expansion
+
+    out_dir = tempfile.mkdtemp()
+
+    G = graph.torus([4, 4])
+    A = BFB(G, False)
+    renderer = ScheduleRenderer(G, A, source=(0, 0))
+    print(renderer.save_steps(os.path.join(out_dir, 'torus')))
+    print(renderer.save_animation(os.path.join(out_dir, 'torus.gif')))
+
+    # thousands of nodes, schedule from expansions
+    G = graph.complete_graph(4)
+    A = BFB(G, False)
+    for _ in range(4):
+        G, A = expansion.line_graph_expansion(G, A)
+    begin = time.perf_counter()
+    ScheduleRenderer(G, A, source=next(iter(G.nodes()))).save_steps(os.path.join(out_dir, 'line'))
+    render_heatmap(G, A, os.path.join(out_dir, 'line_heatmap.png'))
+    print(f'{G.number_of_nodes()} nodes, {G.number_of_edges()} edges: {time.perf_counter() - begin:.2f} s, written to {out_dir}')
+
+
+if __name__ == '__main__':
+    from bfb_schedule import BFB
+    import graph
+    _main1()
@@ -0,0 +1,158 @@
+from typing import Dict, List, Tuple, NamedTuple
+import concurrent.futures
+import math
+import networkx as nx
+from networkx.algorithms.isomorphism import DiGraphMatcher
+
+from schedule_type import *
+from bfb_schedule import BFB, BFB_update
+import utils
+
+
+Failure = Tuple[Tuple[Node, Node], ...]
+
+
+class FailureResult(NamedTuple):
+    failure: Failure    # removed edges, a representative of its automorphism orbit
+    orbit_size: int     # number of equivalent failures
+    TL: float           # inf if the failure disconnects the graph
+    TB: float           # normalized with the capacity of the healthy graph, comparable to its TB
+
+    def print(self, base_TL: int, base_TB: float):
+        edges = ', '.join(f'{a}->{b}' for a, b in self.failure)
+        print(f"{edges:<40} x{self.orbit_size:<4} TL: {self.TL} ({self.TL - base_TL:+}), TB: {self.TB:.4f} ({self.TB - base_TB:+.4f})")
+
+
+def link_failures(G: nx.DiGraph, bidirectional: bool = True) -> List[Failure]:
+    '''
+    every single-link failure,
+    with bidirectional a link with both directions present fails as a whole
+    '''
+    failures = []
+    seen = set()
+    for u, v in G.edges():
+        if (u, v) in seen:
+            continue
+        if bidirectional and G.has_edge(v, u) and u != v:
+            failures.append(((u, v), (v, u)))
+            seen.add((v, u))
+        else:
+            failures.append(((u, v),))
+        seen.add((u, v))
+    return failures
+
+
+def failure_orbits(G: nx.DiGraph, failures: List[Failure], max_automorphisms: int = 10000) -> List[Tuple[Failure, int]]:
+    '''
+    group failures that are equivalent under automorphisms of G,
+    at most max_automorphisms automorphisms are enumerated, so orbits may be split but never wrongly merged
+    return: list of (representative, orbit size)
+    '''
+    index = {frozenset(f): i for i, f in enumerate(failures)}
+    parent = list(range(len(failures)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    matcher = DiGraphMatcher(G, G)
+    for k, mapping in enumerate(matcher.isomorphisms_iter()):
+        if k >= max_automorphisms:
+            break
+        for i, f in enumerate(failures):
+            j = index.get(frozenset((mapping[a], mapping[b]) for a, b in f))
+            if j is not None:
+                ri, rj = find(i), find(j)
+                if ri != rj:
+                    parent[max(ri, rj)] = min(ri, rj)
+
+    sizes: Dict[int, int] = {}
+    for i in range(len(failures)):
+        r = find(i)
+        sizes[r] = sizes.get(r, 0) + 1
+
+    return [(failures[r], size) for r, size in sizes.items()]
+
+
+_shared: dict = {}
+
+
+def _init_worker(G: nx.DiGraph, A: Schedule, path_lengths: Dict[Node, Dict[Node, int]]) -> None:
+    _shared['G'], _shared['A'], _shared['path_lengths'] = G, A, path_lengths
+
+
+def _evaluate_failure(item: Tuple[Failure, int]) -> FailureResult:
+    failure, orbit_size = item
+    G, A, path_lengths = _shared['G'], _shared['A'], _shared['path_lengths']
+
+    G_new, A_new, new_path_lengths = BFB_update(
+        G, A, list(failure), path_lengths=path_lengths, print_detail=False)
+
+    if not nx.is_strongly_connected(G_new):
+        return FailureResult(failure, orbit_size, math.inf, math.inf)
+
+    TL = max(max(d.values()) for d in new_path_lengths.values())
+    TB = utils.schedule_U(A_new) * \
+        utils.min_in_capacity(G) / G.number_of_nodes()
+    return FailureResult(failure, orbit_size, TL, TB)
+
+
+def resilience_sweep(G: nx.DiGraph, A: Schedule | None = None, bidirectional: bool = True,
+                     max_workers: int | None = None, max_automorphisms: int = 10000) -> List[FailureResult]:
+    '''
+    TL / TB after every single-link failure of G,
+    failures equivalent under automorphisms are solved once, the distances of G are computed once
+    and updated per failure, the remaining incremental BFB solves run in a process pool
+    return: one result per orbit, sorted from worst to best
+    '''
+    if A is None:
+        A = BFB(G, False)
+    path_lengths = dict(nx.all_pairs_shortest_path_length(G))
+
+    orbits = failure_orbits(G, link_failures(
+        G, bidirectional), max_automorphisms)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                                initargs=(G, A, path_lengths)) as executor:
+        results = list(executor.map(_evaluate_failure, orbits))
+
+    results.sort(key=lambda r: (r.TL, r.TB), reverse=True)
+    return results
+
+
+def print_report(G: nx.DiGraph, A: Schedule, results: List[FailureResult]) -> Tuple[float, float, float, float]:
+    '''
+    return: worst TL, worst TB, average TL, average TB over all failures (inf if any failure disconnects)
+    '''
+    base_TL, base_TB = utils.get_TL_TB(G, A)
+    print(f"no failure: TL: {base_TL}, TB: {base_TB:.4f}")
+    print("=" * 60)
+    for r in results:
+        r.print(base_TL, base_TB)
+    print("=" * 60)
+
+    total = sum(r.orbit_size for r in results)
+    worst_TL = max((r.TL for r in results), default=base_TL)
+    worst_TB = max((r.TB for r in results), default=base_TB)
+    avg_TL = sum(r.TL * r.orbit_size for r in results) / total if total else base_TL
+    avg_TB = sum(r.TB * r.orbit_size for r in results) / total if total else base_TB
+    print(f"{total} failures in {len(results)} orbits")
+    print(f"worst TL: {worst_TL}, worst TB: {worst_TB:.4f}")
+    print(f"average TL: {avg_TL:.4f}, average TB: {avg_TB:.4f}")
+
+    return worst_TL, worst_TB, avg_TL, avg_TB
+
+
+def _main1():
+    for G in [graph.torus([4, 4]), graph.circulant_graph(16, [2, 3])]:
+        A = BFB(G, False)
+        results = resilience_sweep(G, A)
+        print()
+        print_report(G, A, results)
+
+
+if __name__ == '__main__':
+    import graph
+    _main1()
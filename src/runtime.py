@@ -0,0 +1,265 @@
+from typing import Dict, List, Tuple, NamedTuple
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import platform
+import time
+import warnings
+import numpy as np
+import networkx as nx
+
+from schedule_type import *
+from compiler import Program, Op, compile_schedule
+
+
+class RuntimeReport(NamedTuple):
+    step_times: Dict[int, float]    # seconds from the first rank entering to the last rank leaving a step
+    total_time: float               # seconds
+    shard_bytes: int
+    algbw: float                    # received bytes per rank per second, (N - 1) * shard_bytes / total_time
+    correct: bool                   # every rank ended with every shard
+
+    def print(self):
+        for t, seconds in self.step_times.items():
+            print(f"    t = {t}: {seconds * 1e3:.3f} ms")
+        print(f"total time: {self.total_time * 1e3:.3f} ms, algbw: {self.algbw / 1e9:.3f} GB/s, correct: {self.correct}")
+
+
+def _pattern(num_nodes: int, num_chunks: int, chunk_bytes: int) -> np.ndarray:
+    '''
+    reference content of every shard, shape (num_nodes, num_chunks, chunk_bytes)
+    '''
+    base = np.arange(num_nodes * num_chunks, dtype=np.uint32).reshape(num_nodes, num_chunks, 1)
+    return ((base * 131 + np.arange(chunk_bytes, dtype=np.uint32)) % 251).astype(np.uint8)
+
+
+def _worker(r: int, ops: List[Op], num_nodes: int, num_chunks: int, chunk_bytes: int,
+            data_name: str, chan_name: str, channel_bytes: int, links: Dict[Tuple[int, int], int],
+            steps: List[int], bandwidth: float | None, latency: float, barrier, times_name: str) -> None:
+    data_shm = shared_memory.SharedMemory(name=data_name)
+    chan_shm = shared_memory.SharedMemory(name=chan_name)
+    times_shm = shared_memory.SharedMemory(name=times_name)
+
+    try:
+        data = np.ndarray((num_nodes, num_nodes, num_chunks, chunk_bytes),
+                          dtype=np.uint8, buffer=data_shm.buf)
+        buf = data[r]
+        num_links = len(links)
+        # header: (write position, read position) of every channel, then the ring buffers.
+        # a channel has one writer and one reader, each moves its own counter after touching the ring,
+        # plain stores and loads suffice only because x86 keeps stores in order and loads in order, see `run_program`
+        heads = np.ndarray((num_links, 2), dtype=np.uint64, buffer=chan_shm.buf)
+        rings = np.ndarray((num_links, channel_bytes), dtype=np.uint8,
+                           buffer=chan_shm.buf, offset=num_links * 16)
+        times = np.ndarray((num_nodes, len(steps), 2), dtype=np.float64, buffer=times_shm.buf)
+
+        buf[r] = _pattern(num_nodes, num_chunks, chunk_bytes)[r]
+
+        ops_by_step: Dict[int, List[Op]] = {}
+        for op in ops:
+            ops_by_step.setdefault(op.step, []).append(op)
+
+        for step_index, t in enumerate(steps):
+            barrier.wait()
+            begin = time.perf_counter()
+
+            sends = []
+            recvs = []
+            for op in ops_by_step.get(t, []):
+                if op.kind == 'send':
+                    payload = np.concatenate(
+                        [buf[s.source, s.offset:s.offset + s.count].ravel() for s in op.segments])
+                    sends.append([links[(r, op.peer)], payload, 0])
+                else:
+                    total = sum(s.count for s in op.segments) * chunk_bytes
+                    recvs.append([links[(op.peer, r)], op, np.empty(total, dtype=np.uint8), 0])
+
+            while sends or recvs:
+                progressed = False
+                now = time.perf_counter()
+
+                for send in sends:
+                    link, payload, sent = send
+                    allowed = len(payload)
+                    if bandwidth is not None or latency > 0:
+                        elapsed = now - begin - latency
+                        allowed = 0 if elapsed < 0 else len(payload) if bandwidth is None else min(
+                            len(payload), int(elapsed * bandwidth))
+                    write_pos, read_pos = int(heads[link, 0]), int(heads[link, 1])
+                    n = min(allowed - sent, channel_bytes - (write_pos - read_pos))
+                    if n <= 0:
+                        continue
+                    start = write_pos % channel_bytes
+                    first = min(n, channel_bytes - start)
+                    rings[link, start:start + first] = payload[sent:sent + first]
+                    rings[link, :n - first] = payload[sent + first:sent + n]
+                    heads[link, 0] = write_pos + n
+                    send[2] = sent + n
+                    progressed = True
+
+                for recv in recvs:
+                    link, op, received, got = recv
+                    write_pos, read_pos = int(heads[link, 0]), int(heads[link, 1])
+                    n = min(len(received) - got, write_pos - read_pos)
+                    if n <= 0:
+                        continue
+                    start = read_pos % channel_bytes
+                    first = min(n, channel_bytes - start)
+                    received[got:got + first] = rings[link, start:start + first]
+                    received[got + first:got + n] = rings[link, :n - first]
+                    heads[link, 1] = read_pos + n
+                    recv[3] = got + n
+                    progressed = True
+
+                    if got + n == len(received):
+                        pos = 0
+                        for s in op.segments:
+                            size = s.count * chunk_bytes
+                            buf[s.source, s.offset:s.offset + s.count] = received[pos:pos + size].reshape(
+                                s.count, chunk_bytes)
+                            pos += size
+
+                sends = [s for s in sends if s[2] < len(s[1])]
+                recvs = [rv for rv in recvs if rv[3] < len(rv[2])]
+                if not progressed:
+                    time.sleep(0)
+
+            times[r, step_index] = (begin, time.perf_counter())
+
+        barrier.wait()
+
+    except BaseException:
+        # release the other ranks instead of leaving them blocked on the barrier
+        barrier.abort()
+        raise
+
+    finally:
+        data_shm.close()
+        chan_shm.close()
+        times_shm.close()
+
+
+def run_program(program: Program, shard_bytes: int = 1 << 16, bandwidth: float | None = None,
+                latency: float = 0., channel_bytes: int = 1 << 16) -> RuntimeReport:
+    '''
+    execute a compiled program with one process per rank,
+    every link of the program is a shared memory ring buffer of channel_bytes
+    shard_bytes: size of every rank's shard, rounded up to a multiple of num_chunks
+    bandwidth: per link bytes per second, unthrottled if None
+    latency: per message seconds before the first byte leaves the sender
+    the channels are lock free: the writer publishes bytes by storing its position after the data and the reader
+    frees space by storing its position after copying out, with no fence between them, so the data is only
+    guaranteed visible before the position on a total store order CPU (x86-64)
+    '''
+    if platform.machine().lower() not in ('x86_64', 'amd64', 'i386', 'i686'):
+        warnings.warn(f'runtime channels assume x86 store ordering, {platform.machine()} may reorder '
+                      'the ring buffer stores', RuntimeWarning)
+    num_nodes = len(program['nodes'])
+    num_chunks = program['num_chunks']
+    chunk_bytes = -(-shard_bytes // num_chunks)
+    shard_bytes = chunk_bytes * num_chunks
+
+    links: Dict[Tuple[int, int], int] = {}
+    for r, rank_ops in enumerate(program['ops']):
+        for op in rank_ops:
+            if op.kind == 'send':
+                links.setdefault((r, op.peer), len(links))
+    steps = sorted({op.step for rank_ops in program['ops'] for op in rank_ops})
+
+    ctx = mp.get_context()
+    data_shm = shared_memory.SharedMemory(
+        create=True, size=max(1, num_nodes * num_nodes * shard_bytes))
+    chan_shm = shared_memory.SharedMemory(
+        create=True, size=max(1, len(links) * (16 + channel_bytes)))
+    times_shm = shared_memory.SharedMemory(
+        create=True, size=max(1, num_nodes * len(steps) * 16))
+
+    try:
+        np.ndarray((len(links), 2), dtype=np.uint64, buffer=chan_shm.buf)[:] = 0
+        barrier = ctx.Barrier(num_nodes)
+
+        workers = [ctx.Process(target=_worker, args=(
+            r, program['ops'][r], num_nodes, num_chunks, chunk_bytes,
+            data_shm.name, chan_shm.name, channel_bytes, links,
+            steps, bandwidth, latency, barrier, times_shm.name)) for r in range(num_nodes)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        assert all(w.exitcode == 0 for w in workers), "runtime worker failed"
+
+        times = np.ndarray((num_nodes, len(steps), 2), dtype=np.float64, buffer=times_shm.buf)
+        step_times = {t: float(times[:, i, 1].max() - times[:, i, 0].min())
+                      for i, t in enumerate(steps)}
+        total_time = float(times[:, -1, 1].max() - times[:, 0, 0].min()) if steps else 0.
+
+        data = np.ndarray((num_nodes, num_nodes, num_chunks, chunk_bytes),
+                          dtype=np.uint8, buffer=data_shm.buf)
+        expected = _pattern(num_nodes, num_chunks, chunk_bytes)
+        correct = all(np.array_equal(data[r], expected) for r in range(num_nodes))
+
+        algbw = (num_nodes - 1) * shard_bytes / total_time if total_time > 0 else float('inf')
+        return RuntimeReport(step_times, total_time, shard_bytes, algbw, correct)
+
+    finally:
+        for shm in (data_shm, chan_shm, times_shm):
+            shm.close()
+            shm.unlink()
+
+
+def run_schedule(G: nx.DiGraph, schedule: Schedule, shard_bytes: int = 1 << 16,
+                 bandwidth: float | None = None, latency: float = 0., max_chunks: int = 16) -> RuntimeReport:
+    program = compile_schedule(G, schedule, max_chunks=max_chunks)
+    return run_program(program, shard_bytes, bandwidth, latency)
+
+
+def _recursive_doubling(dim: int) -> Tuple[nx.DiGraph, Schedule]:
+    '''
+    hypercube of 2^dim nodes, x -> x ^ 2^i, with the recursive doubling allgather:
+    at step i + 1 every node exchanges all it holds with its neighbor across dimension i
+    '''
+    G = nx.DiGraph()
+    G.add_edges_from((x, x ^ (1 << i)) for x in range(1 << dim) for i in range(dim))
+    A: Schedule = {}
+    for i in range(dim):
+        step: Dict[Node, ScheduleEntry] = {}
+        for x in G.nodes():
+            peer = x ^ (1 << i)
+            # the peer holds the shards agreeing with it on bits i and up
+            held = [v for v in G.nodes() if v >> i == peer >> i]
+            step[x] = ScheduleEntry(load_U=float(len(held)),
+                                    transfers={TransferKey(v, peer): Fraction(1) for v in held})
+        A[TimeStep(i + 1)] = step
+    return G, A
+
+
+def _main1():
+    '''
+    BFB on a 16 node torus against ring and hypercube baselines,
+    BFB on the hypercube next to recursive doubling
+    '''
+    hypercube, doubling = _recursive_doubling(4)
+
+    cases = {
+        'UniRing(16)': (graph.ring(16), None),
+        'BiRing(16)': (graph.ring(16, False), None),
+        'Hypercube(4), BFB': (hypercube, None),
+        'Hypercube(4), recursive doubling': (hypercube, doubling),
+        'Torus(4, 4)': (graph.torus([4, 4]), None),
+        'C(16, [2, 3])': (graph.circulant_graph(16, [2, 3]), None),
+    }
+
+    for name, (G, A) in cases.items():
+        if A is None:
+            A = BFB(G, False)
+        report = run_schedule(G, A, shard_bytes=1 << 20,
+                              bandwidth=1e9, latency=20e-6)
+        tl, tb = utils.get_TL_TB(G, A)
+        print(f'\n{name}: TL = {tl}, TB = {tb:.4f}')
+        report.print()
+
+
+if __name__ == '__main__':
+    from bfb_schedule import BFB
+    import graph
+    import utils
+    _main1()
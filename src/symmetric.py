@@ -0,0 +1,543 @@
+from typing import Dict, Iterator, List, Mapping, Tuple
+import math
+import time
+import networkx as nx
+import numpy as np
+
+from schedule_type import *
+import utils
+from profiling import Profiler, span
+
+
+class Translation:
+    '''
+    translations x -> x + g mod n of the nodes 0..n-1 by the multiples g of step,
+    the orbits are the residues mod step, with the representatives 0..step-1
+    '''
+
+    def __init__(self, n: int, step: int = 1) -> None:
+        assert n % step == 0
+        self.n = n
+        self.step = step
+
+    def __call__(self, g: int, x: int) -> int:
+        return (x + g) % self.n
+
+    def locate(self, x: int) -> Tuple[int, int]:
+        '''
+        return: representative r of the orbit of x and the element g with g(r) = x
+        '''
+        r = x % self.step
+        return r, x - r
+
+
+class ProductAction:
+    '''
+    componentwise action on tuple nodes, e.g. of cartesian products and degree expansions
+    '''
+
+    def __init__(self, *factors) -> None:
+        self.factors = factors
+
+    def __call__(self, g: tuple, x: tuple) -> tuple:
+        return tuple(f(gi, xi) for f, gi, xi in zip(self.factors, g, x))
+
+    def locate(self, x: tuple) -> Tuple[tuple, tuple]:
+        located = [f.locate(xi) for f, xi in zip(self.factors, x)]
+        return tuple(r for r, _ in located), tuple(g for _, g in located)
+
+
+def torus_action(dimensions: List[int]) -> Translation | ProductAction:
+    '''
+    translations of `graph.torus(dimensions)`, whose nodes are nested pairs ((x0, x1), x2) ...
+    '''
+    action = Translation(dimensions[0])
+    for n in dimensions[1:]:
+        action = ProductAction(action, Translation(n))
+    return action
+
+
+def kautz_action(d: int, m: int) -> Translation:
+    '''
+    x -> x + g maps the edge x -> -d x - a to an edge iff (d + 1) g = 0 mod m,
+    so `graph.generalized_kautz_graph(d, m)` has m / gcd(m, d + 1) orbits under these translations
+    '''
+    return Translation(m, m // math.gcd(m, d + 1))
+
+
+class DigitShift:
+    '''
+    adds g mod d to every base-d digit of the nodes 0..d^k-1, automorphisms of `graph.de_bruijn_graph(d, k)`
+    and `graph.modified_de_bruijn_graph(d, k)`, the representatives are the words starting with 0
+    '''
+
+    def __init__(self, d: int, k: int) -> None:
+        self.d = d
+        self.k = k
+
+    def __call__(self, g: int, x: int) -> int:
+        y, p = 0, 1
+        for _ in range(self.k):
+            y += (x % self.d + g) % self.d * p
+            x //= self.d
+            p *= self.d
+        return y
+
+    def locate(self, x: int) -> Tuple[int, int]:
+        g = x // self.d ** (self.k - 1)
+        return self(-g % self.d, x), g
+
+
+class DiamondAction:
+    '''
+    on `graph.diamond_graph(d)`: g = (s, i, j) shifts the nodes of side 0 by i and of side 1 by j
+    and then swaps the sides if s, one orbit with representative 0
+    '''
+
+    def __init__(self, d: int) -> None:
+        self.d = d
+
+    def __call__(self, g: Tuple[int, int, int], x: int) -> int:
+        d = self.d
+        s, a, b = x // (d * d), x // d % d, x % d
+        gs, i, j = g
+        a, b = ((a + i) % d, (b + j) % d) if s == 0 else ((a + j) % d, (b + i) % d)
+        return ((s ^ gs) * d + a) * d + b
+
+    def locate(self, x: int) -> Tuple[int, Tuple[int, int, int]]:
+        d = self.d
+        return 0, (x // (d * d), x // d % d, x % d)
+
+
+def check_action(G: nx.DiGraph, action) -> bool:
+    '''
+    every node is g(r) for its located (r, g), and every g maps the edges of G to edges of the same capacity
+    '''
+    elements = {}
+    for x in G.nodes():
+        r, g = action.locate(x)
+        if action(g, r) != x:
+            return False
+        elements[g] = None
+    for g in elements:
+        for w, u, c in G.edges(data='capacity', default=1.0):
+            gw, gu = action(g, w), action(g, u)
+            if not G.has_edge(gw, gu) or G.edges[gw, gu].get('capacity', 1.0) != c:
+                return False
+    return True
+
+
+class _Transfers(Mapping):
+    '''
+    transfers of a representative relabelled by g, read-only
+    '''
+
+    def __init__(self, transfers: TransferMap, action, g) -> None:
+        self._transfers = transfers
+        self._action = action
+        self._g = g
+
+    def __getitem__(self, key: TransferKey) -> Fraction:
+        # the action has no inverse, look the key up among the relabelled ones
+        for k, fraction in self._transfers.items():
+            if self._relabel(k) == key:
+                return fraction
+        raise KeyError(key)
+
+    def _relabel(self, key: TransferKey) -> TransferKey:
+        return TransferKey(self._action(self._g, key.from_node), self._action(self._g, key.via_node))
+
+    def __iter__(self) -> Iterator[TransferKey]:
+        return (self._relabel(k) for k in self._transfers)
+
+    def __len__(self) -> int:
+        return len(self._transfers)
+
+    def items(self):
+        return ((self._relabel(k), f) for k, f in self._transfers.items())
+
+    def values(self):
+        return self._transfers.values()
+
+
+class _Step(Mapping):
+    def __init__(self, schedule: 'SymmetricSchedule', t: TimeStep) -> None:
+        self._schedule = schedule
+        self._reps = schedule.steps[t]
+
+    def __getitem__(self, u: Node) -> ScheduleEntry:
+        r, g = self._schedule.action.locate(u)
+        entry = self._reps[r]
+        return ScheduleEntry(load_U=entry['load_U'],
+                             transfers=_Transfers(entry['transfers'], self._schedule.action, g))
+
+    def __contains__(self, u: object) -> bool:
+        return u in self._schedule.node_set and self._schedule.action.locate(u)[0] in self._reps
+
+    def __iter__(self) -> Iterator[Node]:
+        locate = self._schedule.action.locate
+        return (u for u in self._schedule.nodes if locate(u)[0] in self._reps)
+
+    def __len__(self) -> int:
+        return sum(self._schedule.orbit_sizes[r] for r in self._reps)
+
+
+class SymmetricSchedule(Mapping):
+    '''
+    schedule of a graph with a group action: only the entries of one representative per orbit are stored,
+    the entry of u = g(r) is the entry of r with every node x relabelled to g(x), built on access.
+    reads like a `Schedule`, A[t][u]['transfers'], A.items() etc., so utils metrics and expansions take it as is;
+    memory is O(orbits * N * d) instead of O(N^2 * d)
+    steps: steps[t][r] is the entry of representative r at time step t
+    action: callable action(g, x) with locate(x) -> (r, g), see `Translation` and `ProductAction`
+    '''
+
+    def __init__(self, steps: Dict[TimeStep, Dict[Node, ScheduleEntry]], nodes: List[Node], action) -> None:
+        self.steps = steps
+        self.nodes = nodes
+        self.node_set = set(nodes)
+        self.action = action
+        self.orbit_sizes: Dict[Node, int] = {}
+        for u in nodes:
+            r = action.locate(u)[0]
+            self.orbit_sizes[r] = self.orbit_sizes.get(r, 0) + 1
+
+    def __getitem__(self, t: TimeStep) -> Mapping[Node, ScheduleEntry]:
+        if t not in self.steps:
+            raise KeyError(t)
+        return _Step(self, t)
+
+    def __iter__(self) -> Iterator[TimeStep]:
+        return iter(self.steps)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def stored_transfers(self) -> int:
+        return sum(len(entry['transfers']) for step in self.steps.values() for entry in step.values())
+
+    def to_schedule(self) -> Schedule:
+        '''
+        the equivalent dense schedule
+        '''
+        return {t: {u: ScheduleEntry(load_U=entry['load_U'], transfers=dict(entry['transfers'].items()))
+                    for u, entry in step.items()}
+                for t, step in self.items()}
+
+
+def symmetric_BFB(G: nx.DiGraph, action, print_detail: bool = True, sparsify: bool = False,
+                  profiler: Profiler | None = None) -> SymmetricSchedule:
+    '''
+    BFB schedule of G for an automorphism group given by action, e.g. `Translation(n)` for circulants,
+    only the LPs of the orbit representatives are solved,
+    with path lengths from a reverse BFS of every representative and its predecessors instead of all pairs
+    '''
+    from bfb_schedule import _build_problem_task, _solve_problem_buffer
+
+    time_begin = time.time()
+    nodes = list(G.nodes())
+    reps = list(dict.fromkeys(action.locate(u)[0] for u in nodes))
+
+    with span(profiler, 'shortest paths'):
+        # distances to the representatives and to their predecessors are all the LPs read
+        targets = dict.fromkeys(reps)
+        for r in reps:
+            targets.update(dict.fromkeys(G.predecessors(r)))
+        R = G.reverse(copy=False)
+        path_lengths: Dict[Node, Dict[Node, int]] = {v: {} for v in nodes}
+        for x in targets:
+            for v, length in nx.single_source_shortest_path_length(R, x).items():
+                path_lengths[v][x] = length
+
+    assert all(r in path_lengths[v] for r in reps for v in nodes), "not connected graph"
+    diameter = max(path_lengths[v][r] for r in reps for v in nodes)
+
+    if print_detail:
+        print(f'Diameter: {diameter}, {len(reps)} orbits')
+
+    steps: Dict[TimeStep, Dict[Node, ScheduleEntry]] = {}
+    for t in range(1, diameter + 1):
+        current_t = TimeStep(t)
+        with span(profiler, 'build', t=t):
+            tasks = [task for r in reps
+                     if (task := _build_problem_task(G, path_lengths, nodes, current_t, r)) is not None]
+        if not tasks:
+            continue
+
+        with span(profiler, 'solve', t=t, num_problems=len(tasks)):
+            results = _solve_problem_buffer(
+                tasks, f'Solving t={current_t} problems', False, sparsify, profiler)
+
+        steps[current_t] = {r: entry for _, r, entry, _ in results if entry is not None}
+
+    if print_detail:
+        print(f'\nsymmetric BFB search time cost: {(time.time() - time_begin):.3f}')
+
+    return SymmetricSchedule(steps, nodes, action)
+
+
+def symmetric_optimal_schedule(G: nx.DiGraph, T: int, action) -> Tuple[SymmetricSchedule, float]:
+    '''
+    minimum-bandwidth T-step allgather among the schedules invariant under a free action,
+    one LP over the time-expanded network, node x at step t, with variables for the shards of the
+    orbit representatives only:
+        x[t, r, e]: amount of shard r sent over link e at step t
+        g[t, r, d, e], h[t, r, d, y]: a unit flow of shard r from r to every dest d,
+            over the links (g <= x) and held by y from step t to t + 1
+        the load of link e at step t sums x[t, r, e'] over the representatives r and the elements g with g(e') = e,
+        one load row per link into a representative is enough, the others are images of these
+    every dest gets a flow of its own, so a piece received twice is counted once, as in `utils.validate_schedule`;
+    x is then lowered to the largest flow over it, links carry no piece their sender does not hold.
+    the schedule may use non shortest paths
+    return: the schedule and its TB, inf if T steps are infeasible
+    '''
+    import scipy.sparse as sp
+    from scipy.optimize import linprog
+
+    nodes = list(G.nodes())
+    N = len(nodes)
+    index = {v: i for i, v in enumerate(nodes)}
+    located = {x: action.locate(x) for x in nodes}
+    reps = list(dict.fromkeys(r for r, _ in located.values()))
+    rep_index = {r: i for i, r in enumerate(reps)}
+    elements = list(dict.fromkeys(g for x, (r, g) in located.items() if r == reps[0]))
+    assert len(reps) * len(elements) == N, "action is not free"
+    R = len(reps)
+
+    edges = list(G.edges())
+    E = len(edges)
+    edge_index = {e: i for i, e in enumerate(edges)}
+    src = np.array([index[w] for w, _ in edges])
+    dst = np.array([index[u] for _, u in edges])
+    # load rows: the links into a representative
+    load_edges = [i for i, (_, u) in enumerate(edges) if u in rep_index]
+    load_row = {e: i for i, e in enumerate(load_edges)}
+    L = len(load_edges)
+    # (e', target load row) pairs over all elements
+    images = []
+    for i, (w, u) in enumerate(edges):
+        for g in elements:
+            gu = action(g, u)
+            if gu in rep_index:
+                images.append((i, load_row[edge_index[(action(g, w), gu)]]))
+    image_edge = np.array([i for i, _ in images])
+    image_row = np.array([j for _, j in images])
+
+    X = T * R * E
+    F = T * R * N * E
+    H = T * R * N * N
+    num_vars = X + F + H + T
+
+    def x_idx(t, s, e):
+        return (t * R + s) * E + e
+
+    def g_idx(t, s, d, e):
+        return X + ((t * R + s) * N + d) * E + e
+
+    def h_idx(t, s, d, y):
+        return X + F + ((t * R + s) * N + d) * N + y
+
+    t_ = np.arange(T)[:, None, None, None]
+    s_ = np.arange(R)[None, :, None, None]
+    d_ = np.arange(N)[None, None, :, None]
+    e_ = np.arange(E)[None, None, None, :]
+    y_ = np.arange(N)[None, None, None, :]
+    rep_nodes = np.array([index[r_] for r_ in reps])
+
+    # conservation at node y after step tau = 0..T of the flow of shard s to d:
+    # held into tau + received at tau - held out of tau - sent at tau + 1 = -1 at (r, 0), 1 at (d, T)
+    def c_row(tau, s, d, y):
+        return ((tau * R + s) * N + d) * N + y
+
+    num_eq = (T + 1) * R * N * N
+    rows, cols, vals = [], [], []
+    tt, ss, dd, yy = np.broadcast_arrays(t_, s_, d_, y_)
+    h = h_idx(tt, ss, dd, yy).ravel()
+    rows += [c_row(tt + 1, ss, dd, yy).ravel(), c_row(tt, ss, dd, yy).ravel()]
+    cols += [h, h]
+    vals += [np.ones(h.size), -np.ones(h.size)]
+    tt, ss, dd, ee = np.broadcast_arrays(t_, s_, d_, e_)
+    g = g_idx(tt, ss, dd, ee).ravel()
+    rows += [c_row(tt + 1, ss, dd, dst[ee]).ravel(), c_row(tt, ss, dd, src[ee]).ravel()]
+    cols += [g, g]
+    vals += [np.ones(g.size), -np.ones(g.size)]
+    A_eq = sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                         shape=(num_eq, num_vars))
+    b_eq = np.zeros(num_eq)
+    s_all, d_all = np.meshgrid(np.arange(R), np.arange(N), indexing='ij')
+    np.add.at(b_eq, c_row(0, s_all, d_all, rep_nodes[s_all]).ravel(), -1.)
+    np.add.at(b_eq, c_row(T, s_all, d_all, d_all).ravel(), 1.)
+
+    rows, cols, vals = [], [], []
+    # every flow fits the transfers
+    r = np.arange(F)
+    rows += [r, r]
+    cols += [g, x_idx(tt, ss, ee).ravel()]
+    vals += [np.ones(F), -np.ones(F)]
+    num_rows = F
+
+    # link loads
+    r = num_rows + np.arange(T * L).reshape(T, L)
+    tt, ss, ii = np.broadcast_arrays(np.arange(T)[:, None, None], np.arange(R)[None, :, None],
+                                     np.arange(len(images))[None, None, :])
+    rows.append(r[tt, image_row[ii]].ravel())
+    cols.append(x_idx(tt, ss, image_edge[ii]).ravel())
+    vals.append(np.ones(tt.size))
+    cap = np.array([utils.link_capacity(G, *edges[i]) for i in load_edges])
+    tt, ll = np.broadcast_arrays(np.arange(T)[:, None], np.arange(L)[None, :])
+    rows.append(r.ravel())
+    cols.append((X + F + H + tt).ravel())
+    vals.append(-cap[ll].ravel())
+    num_rows += r.size
+
+    A_ub = sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                         shape=(num_rows, num_vars))
+
+    ub = np.full(num_vars, np.inf)
+    ub[:X] = 1.
+    c = np.zeros(num_vars)
+    c[X + F + H:] = 1.
+    result = linprog(c, A_ub=A_ub, b_ub=np.zeros(num_rows), A_eq=A_eq, b_eq=b_eq,
+                     bounds=np.stack([np.zeros(num_vars), ub], axis=1), method='highs')
+    if result.status != 0:
+        return SymmetricSchedule({}, nodes, action), float('inf')
+
+    # entry of representative u: the flows of every shard g(r) over g(e') for the g with g(e') into u
+    f = result.x[X:X + F].reshape(T, R, N, E).max(axis=2)
+    steps: Dict[TimeStep, Dict[Node, ScheduleEntry]] = {}
+    for t in range(T):
+        step: Dict[Node, ScheduleEntry] = {}
+        for s, e in zip(*np.nonzero(f[t] > 1e-9)):
+            w, u = edges[e]
+            for g in elements:
+                gu = action(g, u)
+                if gu in rep_index:
+                    entry = step.setdefault(gu, ScheduleEntry(load_U=0.0, transfers={}))
+                    entry['transfers'][TransferKey(action(g, reps[s]), action(g, w))] = Fraction(f[t, s, e].item())
+        if step:
+            steps[TimeStep(t + 1)] = step
+    utils.update_load_U(steps, G)
+
+    A = SymmetricSchedule(steps, nodes, action)
+    return A, utils.schedule_U(A) * utils.min_in_capacity(G) / N
+
+
+def symmetric_degree_expansion(G: nx.DiGraph, A: SymmetricSchedule, n: int) -> tuple[nx.DiGraph, SymmetricSchedule]:
+    '''
+    `expansion.degree_expansion` of a symmetric schedule, the copies are one more translation factor,
+    so only the entries of (r, 0) are built instead of n^2 relabelled copies per entry
+    '''
+    import expansion
+    G_prime, _ = expansion.degree_expansion(G, None, n)
+    action = ProductAction(A.action, Translation(n))
+
+    steps: Dict[TimeStep, Dict[Node, ScheduleEntry]] = {}
+    for t, reps in A.steps.items():
+        steps[t] = {(r, 0): ScheduleEntry(load_U=0.0, transfers={
+            TransferKey((v, j), (u, j)): fraction
+            for (v, u), fraction in entry['transfers'].items() for j in range(n)})
+            for r, entry in reps.items()}
+
+    # last step: the shard of every other copy from all in neighbors, split by capacity
+    t_final = TimeStep(max(A.steps, default=0) + 1)
+    steps[t_final] = {}
+    for r in A.orbit_sizes:
+        r_0 = (r, 0)
+        vs = list(G_prime.predecessors(r_0))
+        capacities = [utils.link_capacity(G_prime, v, r_0) for v in vs]
+        total_capacity = sum(capacities)
+        steps[t_final][r_0] = ScheduleEntry(load_U=0.0, transfers={
+            TransferKey((r, i), v): Fraction(c / total_capacity)
+            for i in range(1, n) for v, c in zip(vs, capacities)})
+
+    # the load of an entry only depends on its own transfers, the representatives are enough
+    utils.update_load_U(steps, G_prime)
+    return G_prime, SymmetricSchedule(steps, list(G_prime.nodes()), action)
+
+
+def de_bruijn_schedule(d: int, k: int, print_detail: bool = False) -> Tuple[nx.DiGraph, SymmetricSchedule]:
+    import graph
+    G = graph.de_bruijn_graph(d, k)
+    return G, symmetric_BFB(G, DigitShift(d, k), print_detail)
+
+
+def dbjmod_schedule(d: int, k: int, T: int | None = None) -> Tuple[nx.DiGraph, SymmetricSchedule]:
+    '''
+    DBJMod(d, k) with its best T step schedule, k + 1 steps by default
+    '''
+    import graph
+    G = graph.modified_de_bruijn_graph(d, k)
+    return G, symmetric_optimal_schedule(G, k + 1 if T is None else T, DigitShift(d, k))[0]
+
+
+def diamond_schedule(d: int, T: int = 3) -> Tuple[nx.DiGraph, SymmetricSchedule]:
+    import graph
+    G = graph.diamond_graph(d)
+    return G, symmetric_optimal_schedule(G, T, DiamondAction(d))[0]
+
+
+def family_schedule(family: str, params: Tuple[int, ...], T: int) -> Tuple[nx.DiGraph, SymmetricSchedule]:
+    '''
+    the schedule of an entry of `topology_finder.SYMMETRIC_TOPOLOGIES`
+    '''
+    if family == 'DBJMod':
+        return dbjmod_schedule(*params, T)
+    assert family == 'diamond', f'unknown family {family}'
+    return diamond_schedule(*params, T)
+
+
+def _main1():
+    import graph
+    from bfb_schedule import BFB
+
+    for name, G, action in [('C(64, [5, 6])', graph.circulant_graph(64, [5, 6]), Translation(64)),
+                            ('torus(8, 8)', graph.torus([8, 8]), torus_action([8, 8])),
+                            ('Kautz(2, 12)', graph.generalized_kautz_graph(2, 12), kautz_action(2, 12))]:
+        assert check_action(G, action)
+        begin = time.perf_counter()
+        A = symmetric_BFB(G, action, False)
+        time_symmetric = time.perf_counter() - begin
+        begin = time.perf_counter()
+        B = BFB(G, False)
+        time_full = time.perf_counter() - begin
+
+        dense = A.to_schedule()
+        print(f'{name}: {len(A.orbit_sizes)} orbits, TL/TB {utils.get_TL_TB(G, A)} vs {utils.get_TL_TB(G, B)}, '
+              f'{time_symmetric:.2f} s vs {time_full:.2f} s, '
+              f'{A.stored_transfers()} stored transfers vs {sum(utils.message_stats(dense).values())}, '
+              f'{len(utils.validate_schedule(G, A))} errors')
+
+
+def _main2():
+    import graph
+    import expansion
+
+    G = graph.torus([4, 4])
+    A = symmetric_BFB(G, torus_action([4, 4]), False)
+    G_sym, A_sym = symmetric_degree_expansion(G, A, 3)
+    G_full, A_full = expansion.degree_expansion(G, A.to_schedule(), 3)
+    assert check_action(G_sym, A_sym.action)
+    print(f'degree expansion: {utils.get_TL_TB(G_sym, A_sym)} vs {utils.get_TL_TB(G_full, A_full)}, '
+          f'{A_sym.stored_transfers()} stored transfers vs {sum(utils.message_stats(A_full).values())}, '
+          f'same schedule: {A_sym.to_schedule() == A_full}')
+
+
+def _main3():
+    '''
+    re-solve the entries of `topology_finder.SYMMETRIC_TOPOLOGIES`, print them as table lines with the
+    validation errors of every schedule
+    '''
+    from topology_finder import SYMMETRIC_TOPOLOGIES
+
+    for family, params, T, TB in SYMMETRIC_TOPOLOGIES:
+        G, A = family_schedule(family, params, T)
+        N = G.number_of_nodes()
+        TL, TB_solved = utils.get_schedule_TL_TB(G, A)
+        print(f"    ('{family}', {params}, {TL}, {TB_solved:.6f}),  # table {TB:.6f}, optimal {(N - 1) / N:.6f}, "
+              f'{len(utils.validate_schedule(G, A))} errors')
+
+
+if __name__ == '__main__':
+    _main1()
+    _main2()
+    _main3()
@@ -1,11 +1,10 @@
 from typing import NamedTuple
 import graph
+import bounds
 import math
 import networkx as nx
-from bfb_schedule import BFB
 import utils
 import os
-from tqdm import tqdm
 
 
 class TopologyEntry(NamedTuple):
@@ -60,57 +59,101 @@ def cartessian_prod(T1: TopologyEntry, T2: TopologyEntry) -> TopologyEntry:
     return TopologyEntry(N, d, topology, TL, TB, True, T1.nest_level + T2.nest_level + 1)
 
 
+def hierarchical_exp(T_intra: TopologyEntry, T_inter: TopologyEntry) -> TopologyEntry:
+    '''
+    boxes of T_intra connected by T_inter, see `expansion.hierarchical_expansion(..., sliced=False)`,
+    TB is the cost of its inter first or intra first path alone, an upper bound of the mixed schedule
+    that holds whatever the per-step loads of the levels are:
+        inter first: U_inter + N_inter * U_intra, intra first: U_intra + N_intra * U_inter
+    '''
+    N = T_intra.N * T_inter.N
+    d = T_intra.d + T_inter.d
+    topology = f'Hier({T_intra.topology}, {T_inter.topology})'
+    TL = T_intra.TL + T_inter.TL
+    U_intra = T_intra.TB * T_intra.N / T_intra.d
+    U_inter = T_inter.TB * T_inter.N / T_inter.d
+    U = min(U_inter + T_inter.N * U_intra, U_intra + T_intra.N * U_inter)
+    TB = U * d / N
+    BW_optimal = T_intra.BW_optimal and T_inter.BW_optimal and TB <= (N - 1) / N + 1e-9
+    return TopologyEntry(N, d, topology, TL, TB, BW_optimal, T_intra.nest_level + T_inter.nest_level + 1)
+
+
+DIST_REG_PATH = 'DistReg/graph.csv'
+
+
+def read_DistReg_topologies(filepath: str) -> list[TopologyEntry]:
+    with open(filepath, 'r') as f:
+        lines = f.readlines()
+
+    tps = []
+    for line in lines[1:]:  # Skip header
+        parts = line.strip().split(',')
+        if len(parts) < 4 or parts[3] == 'Inf':
+            continue
+
+        name = parts[0]
+        node_num = int(parts[1])
+        degree = int(parts[2])
+        diameter = int(parts[3])
+
+        tps.append(TopologyEntry(
+            node_num, degree, f'DistReg({name})', diameter, 1 - 1 / node_num, True, 0))
+    return tps
+
+
+# (family, parameters, TL, TB) of the schedules of `symmetric.symmetric_optimal_schedule` that pass
+# `utils.validate_schedule`, re-solved by `symmetric._main3`:
+# DBJMod(d, k) has d^k nodes of degree d, diamond(d) 2 d^2 nodes of degree d
+SYMMETRIC_TOPOLOGIES: list[tuple[str, tuple[int, ...], int, float]] = [
+    ('DBJMod', (2, 2), 3, 3 / 4),
+    ('DBJMod', (2, 3), 4, 7 / 8),
+    ('DBJMod', (2, 4), 5, 79 / 80),
+    ('DBJMod', (2, 4), 6, 23 / 24),
+    ('DBJMod', (2, 5), 6, 355 / 336),
+    ('DBJMod', (3, 2), 3, 8 / 9),
+    ('DBJMod', (3, 3), 4, 26 / 27),
+    ('DBJMod', (4, 2), 3, 15 / 16),
+    ('DBJMod', (5, 2), 3, 24 / 25),
+    ('DBJMod', (6, 2), 3, 35 / 36),
+    ('DBJMod', (7, 2), 3, 48 / 49),
+    ('DBJMod', (8, 2), 3, 63 / 64),
+    ('diamond', (2,), 3, 11 / 12),
+    ('diamond', (2,), 4, 7 / 8),
+    ('diamond', (3,), 3, 17 / 18),
+    ('diamond', (4,), 3, 31 / 32),
+    ('diamond', (5,), 3, 49 / 50),
+    ('diamond', (6,), 3, 71 / 72),
+    ('diamond', (7,), 3, 97 / 98),
+    ('diamond', (8,), 3, 127 / 128),
+]
+
+
 class TopologyFinder:
     def __init__(self, max_N, max_d) -> None:
         self.max_N = max_N
         self.max_d = max_d
         self.topology_table = {n: {d: [] for d in range(
             1, max_d + 1)} for n in range(1, max_N + 1)}
+        # (N, d) -> nest level of an entry meeting the lower bounds, no later entry can improve the cell
+        self.closed: dict[tuple[int, int], int] = {}
 
         self.init_topology_table()
 
     def load_DistReg_topologies(self, filepath: str) -> None:
-        with open(filepath, 'r') as f:
-            lines = f.readlines()
-
-        for line in lines[1:]:  # Skip header
-            parts = line.strip().split(',')
-            if len(parts) < 6:
-                continue
-
-            name = int(parts[0])
-            node_num = int(parts[1])
-            degree = int(parts[2])
-            diameter = int(parts[3])
-
-            tp = TopologyEntry(
-                node_num, degree, f'DistReg({name})', diameter, 1 - 1 / node_num, True, 0)
+        for tp in read_DistReg_topologies(filepath):
             self.try_insert(tp)
 
     def init_topology_table(self) -> None:
         '''
         init topology table with topologies with perticular structures,
-        including: DBJMod, diamond, DistReg
+        including: DistReg
         '''
-        # DBJMod
-        self.topology_table[8][2].append(TopologyEntry(
-            8, 2, "DBJMod(2,3)", 4, 7 / 8, True, 0))
-        self.topology_table[16][2].append(TopologyEntry(
-            16, 2, "DBJMod(2,4)", 5, 15 / 16, True, 0))
-        self.topology_table[9][3].append(TopologyEntry(
-            9, 3, "DBJMod(3,2)", 3, 8 / 9, True, 0))
-        self.topology_table[16][4].append(TopologyEntry(
-            16, 4, "DBJMod(4,2)", 3, 15 / 16, True, 0))
-        # diamond
-        self.topology_table[8][2].append(TopologyEntry(
-            8, 2, "diamond", 3, 7 / 8, True, 0))
-
         # DistReg
-        dist_reg_path = 'DistReg/graph.csv'
-        if os.path.exists(dist_reg_path):
-            self.load_DistReg_topologies(dist_reg_path)
+        if os.path.exists(DIST_REG_PATH):
+            self.load_DistReg_topologies(DIST_REG_PATH)
 
-    def basic_graph_set1(self, n, d) -> list[TopologyEntry]:
+    @staticmethod
+    def basic_graph_set1(n, d) -> list[TopologyEntry]:
         '''
         uniring, biring
         '''
@@ -130,9 +173,11 @@ class TopologyFinder:
 
         return tps
 
-    def basic_graph_set2(self, n, d) -> list[TopologyEntry]:
+    @staticmethod
+    def basic_graph_set2(n, d) -> list[TopologyEntry]:
         '''
-        circulant, complete, complete bipartite, DBJ, generalized kautz(with BW optimality guarantee)
+        circulant, complete, complete bipartite, generalized kautz(with BW optimality guarantee),
+        DBJMod, diamond(with the TL and TB of their solved schedules)
         '''
         tps: list[TopologyEntry] = []
 
@@ -142,9 +187,8 @@ class TopologyFinder:
         if d == 4 and n >= 5:
             '''TODO: why?'''
             a = math.floor(math.sqrt((n - 2) / 2))
-            G = graph.circulant_graph(n, [a, a + 1])
             tps.append(TopologyEntry(
-                n, d, f"C({n}, [{a}, {a + 1}])", nx.diameter(G), optimal_B, True, 0))
+                n, d, f"C({n}, [{a}, {a + 1}])", graph.circulant_diameter(n, [a, a + 1]), optimal_B, True, 0))
 
         # complete
         if d == n - 1:
@@ -156,8 +200,15 @@ class TopologyFinder:
             tps.append(TopologyEntry(
                 n, d, f"K({d}, {d})", 2, optimal_B, True, 0))
 
-        # DBJ
-        '''TODO'''
+        # DBJMod (the de Bruijn graph without its self-loops) and diamond (line graph of K(d, d)),
+        # only the solved and validated schedules, optimal when they reach the bound
+        for family, params, TL, TB in SYMMETRIC_TOPOLOGIES:
+            degree = params[0]
+            size = degree ** params[1] if family == 'DBJMod' else 2 * degree * degree
+            if (size, degree) == (n, d):
+                name = f"{family}({','.join(map(str, params))})"
+                tps.append(TopologyEntry(
+                    n, d, name, TL, TB, TB <= optimal_B + 1e-6, 0))
 
         # generalized kautz with BW optimality guarantee
         if n == d + 1:
@@ -172,9 +223,12 @@ class TopologyFinder:
         '''
         tps: list[TopologyEntry] = []
 
-        if n > d + 1:
+        if n > d + 1 and not self.is_closed(n, d):
             G = graph.generalized_kautz_graph(d, n)
-            if nx.is_strongly_connected(G):
+            # skip BFB if even the bounds of G are dominated by the frontier
+            if nx.is_strongly_connected(G) and not self.is_dominated(n, d, nx.diameter(G), bounds.sweep_TB_bound(G)[0]):
+                # cvxpy takes about a second to import, only this path needs it
+                from bfb_schedule import BFB
                 A = BFB(G, False)
                 tl, tb = utils.get_TL_TB(G, A)
                 tps.append(TopologyEntry(
@@ -182,13 +236,36 @@ class TopologyFinder:
 
         return tps
 
+    def is_closed(self, n: int, d: int) -> bool:
+        return (n, d) in self.closed
+
+    def is_dominated(self, n: int, d: int, TL: float, TB: float) -> bool:
+        '''
+        if True an entry of the (n, d) cell is at least as good as (TL, TB)
+        '''
+        return any(tp.TL <= TL and tp.TB <= TB + 1e-4 for tp in self.topology_table[n][d])
+
     def try_insert(self, tp: TopologyEntry) -> bool:
-        if tp.N <= self.max_N and tp.d <= self.max_d:
-            self.topology_table[tp.N][tp.d].append(tp)
+        '''
+        return: False if tp is out of the table, expansion loops stop on it;
+        entries of closed cells are dropped but still return True
+        '''
+        if tp.N > self.max_N or tp.d > self.max_d:
+            return False
+
+        key = (tp.N, tp.d)
+        optimal = bounds.meets_bounds(tp.N, tp.d, tp.TL, tp.TB)
+        if key in self.closed and not (optimal and tp.nest_level < self.closed[key]):
             return True
-        return False
+
+        self.topology_table[tp.N][tp.d].append(tp)
+        if optimal:
+            self.closed[key] = tp.nest_level
+        return True
 
     def search(self, print_tqdm: bool = False) -> None:
+        if print_tqdm:
+            from tqdm import tqdm
         # add graphs from basic graph set 1
         # try cartesian product expansion and cartesian power expansion
         n_range1 = range(2, self.max_N + 1)
@@ -196,27 +273,27 @@ class TopologyFinder:
             n_range1 = tqdm(n_range1, desc="Pass1")
         for n in n_range1:
             for d in range(1, self.max_d + 1):
-                tps = self.basic_graph_set1(n, d)
-                self.topology_table[n][d].extend(tps)
+                for tp in self.basic_graph_set1(n, d):
+                    self.try_insert(tp)
                 self.topology_table[n][d] = utils.pareto_frontier(
                     self.topology_table[n][d], key1=lambda x: x.TL, key2=lambda x: x.TB, eps2=1e-4, key3=lambda x: x.nest_level)
 
                 for n2 in range(2, n + 1):
                     for d2 in range(1, d + 1):
-                        if n * n2 <= self.max_N and d + d2 <= self.max_d:
+                        if n * n2 <= self.max_N and d + d2 <= self.max_d and not self.is_closed(n * n2, d + d2):
                             for tp1 in self.topology_table[n][d]:
                                 for tp2 in self.topology_table[n2][d2]:
                                     self.try_insert(cartessian_prod(tp1, tp2))
 
         # add graphs from basic graph set 2
-        # try line graph, degree, cartesian power expansion
+        # try line graph, degree, cartesian power expansion, hierarchical composition
         n_range2 = range(2, self.max_N + 1)
         if print_tqdm:
             n_range2 = tqdm(n_range2, desc="Pass2")
         for n in n_range2:
             for d in range(1, self.max_d + 1):
-                tps = self.basic_graph_set2(n, d)
-                self.topology_table[n][d].extend(tps)
+                for tp in self.basic_graph_set2(n, d):
+                    self.try_insert(tp)
                 self.topology_table[n][d] = utils.pareto_frontier(
                     self.topology_table[n][d], key1=lambda x: x.TL, key2=lambda x: x.TB, eps2=1e-4, key3=lambda x: x.nest_level)
 
@@ -235,14 +312,22 @@ class TopologyFinder:
                     while self.try_insert(cartesian_power(tp, i)):
                         i += 1
 
+                    # hierarchical composition, boxes of complete graphs
+                    m = 2
+                    while m * tp.N <= self.max_N and m - 1 + tp.d <= self.max_d:
+                        if not self.is_closed(m * tp.N, m - 1 + tp.d):
+                            self.try_insert(hierarchical_exp(TopologyEntry(
+                                m, m - 1, f"K({m})", 1, (m - 1) / m, True, 0), tp))
+                        m += 1
+
         # add graphs from basic graph set 3
         # n_range3 = range(2, self.max_N + 1)
         # if print_tqdm:
         #     n_range3 = tqdm(n_range3, desc="Pass3")
         # for n in n_range3:
         #     for d in range(1, self.max_d + 1):
-        #         tps = self.basic_graph_set3(n, d)
-        #         self.topology_table[n][d].extend(tps)
+        #         for tp in self.basic_graph_set3(n, d):
+        #             self.try_insert(tp)
         #         self.topology_table[n][d] = utils.pareto_frontier(
         #             self.topology_table[n][d], key1=lambda x: x.TL, key2=lambda x: x.TB, eps2=1e-4)
 
@@ -39,15 +39,25 @@ def pareto_frontier(candidates: List[_T],
     return pareto_frontier
 
 
-def print_schedule_bound(G: nx.DiGraph):
-    in_degrees = [d for n, d in G.in_degree()]
-    is_in_regular = all(d == in_degrees[0] for d in in_degrees)
+def link_capacity(G: nx.DiGraph, w: Node, u: Node) -> float:
+    """
+    bandwidth of link w -> u, the `capacity` edge attribute, 1 by default
+    """
+    return G.edges[w, u].get('capacity', 1.0)
+
+
+def min_in_capacity(G: nx.DiGraph) -> float:
+    """
+    min over nodes of the total capacity of the in links, d for a regular graph of unit links
+    """
+    return min(sum(c for _, _, c in G.in_edges(u, data='capacity', default=1.0)) for u in G.nodes())
+
 
-    assert is_in_regular, "not regular graph"
+def print_schedule_bound(G: nx.DiGraph):
     assert nx.is_strongly_connected(G), "not connected graph"
 
     num_nodes = G.number_of_nodes()
-    d = in_degrees[0]
+    d = min_in_capacity(G)
 
     diameter = nx.diameter(G)
 
@@ -122,27 +132,180 @@ def print_schedule(schedule: 'Schedule', full_details: bool = True) -> Tuple[int
 
 
 def get_TL_TB(G: nx.DiGraph, A: Schedule):
-    in_degrees = [d for n, d in G.in_degree()]
-    is_in_regular = all(d == in_degrees[0] for d in in_degrees)
-
+    """
+    TL: diameter
+    TB: time-weighted bandwidth cost, the sum of the per-step max loads (in time, i.e. divided by link capacity)
+        times the min total in-capacity of a node over N, (N - 1) / N is optimal;
+        U * d / N for a d-regular graph of unit links
+    """
     n = G.number_of_nodes()
-    d = in_degrees[0]
+    d = min_in_capacity(G)
 
-    assert is_in_regular, f"not regular graph, N={n}"
     assert nx.is_strongly_connected(G), f"not connected graph, N={n}, d={d}"
 
-    U = 0
-    time_steps = sorted(A.keys())
-    for t in time_steps:
-        u_t = 0
-        step_schedule = A[t]
-        dest_nodes = sorted(step_schedule.keys())
-        for u in dest_nodes:
-            entry = step_schedule[u]
-            load_U = entry['load_U']
-            u_t = max(u_t, load_U)
-        U += u_t
+    U = schedule_U(A)
 
     TL = nx.diameter(G)
     TB = U * d / n
     return TL, TB
+
+
+def schedule_U(A: Schedule) -> float:
+    """
+    sum of the per time step max load
+    """
+    U = 0
+    for t in sorted(A.keys()):
+        u_t = 0
+        for entry in A[t].values():
+            u_t = max(u_t, entry['load_U'])
+        U += u_t
+    return U
+
+
+def message_stats(A: Schedule) -> Dict[TimeStep, int]:
+    """
+    number of messages, i.e. nonzero (source, via, dest) transfers, of every time step
+    """
+    return {t: sum(len(entry['transfers']) for entry in A[t].values()) for t in sorted(A.keys())}
+
+
+def update_load_U(A: Schedule, G: nx.DiGraph | None = None) -> Schedule:
+    """
+    set load_U of every entry to the max over its via nodes of the total fraction divided by the link capacity,
+    unit capacities if G is None
+    """
+    for step_schedule in A.values():
+        for u, entry in step_schedule.items():
+            link_loads = {}
+            for (v, w), fraction in entry['transfers'].items():
+                link_loads[w] = link_loads.get(w, 0.0) + fraction
+            if G is not None:
+                for w in link_loads:
+                    link_loads[w] /= link_capacity(G, w, u)
+            entry['load_U'] = max(link_loads.values()) if link_loads else 0.0
+    return A
+
+
+def get_schedule_TL_TB(G: nx.DiGraph, A: Schedule):
+    """
+    TL, TB of any collective schedule on G,
+    TL is the number of time steps instead of the diameter
+    """
+    TL = max(A.keys(), default=0)
+    TB = schedule_U(A) * min_in_capacity(G) / G.number_of_nodes()
+    return TL, float(TB)
+
+
+# fixed point scale of the fractions in the max-flow check of `validate_schedule`
+_FLOW_SCALE = 1 << 20
+
+
+def validate_schedule(G: nx.DiGraph, A: Schedule, tol: float = 1e-6,
+                      initial: Dict[Node, List[Node]] | None = None,
+                      required: Dict[Node, List[Node]] | None = None) -> List[str]:
+    """
+    check that A is a correct allgather on G: transfers use links of G, link loads fit load_U,
+    and every node can end with the whole of every shard.
+    the last is a max-flow per (shard, dest) over the time-expanded graph, node x at step t,
+    with the transfers of the shard as link capacities and a node keeping what it holds:
+    a piece received twice counts once, so forwarding a piece back to where it came from does not add to it
+    initial, required: node -> the shards it holds at the start and must hold at the end,
+        every node's own shard and all shards by default, other collectives set them, see `broadcast`
+    return: list of errors, empty if A is correct
+    """
+    import numpy as np
+    import scipy.sparse as sp
+    from scipy.sparse.csgraph import maximum_flow
+
+    errors: List[str] = []
+    if initial is None:
+        initial = {u: [u] for u in G.nodes()}
+    if required is None:
+        required = {u: list(G.nodes()) for u in G.nodes()}
+
+    nodes = list(G.nodes())
+    index = {x: i for i, x in enumerate(nodes)}
+    N = len(nodes)
+    steps = sorted(A.keys())
+    T = len(steps)
+
+    # (shard) -> transfer edges (step position, via, dest, fraction)
+    transfers: Dict[Node, List[Tuple[int, int, int, float]]] = {}
+    for k, t in enumerate(steps):
+        for u, entry in A[t].items():
+            link_loads: Dict[Node, float] = {}
+            for (v, w), fraction in entry['transfers'].items():
+                if not G.has_edge(w, u):
+                    errors.append(f"t = {t}: no link {w} -> {u}")
+                    continue
+                transfers.setdefault(v, []).append((k, index[w], index[u], fraction))
+                link_loads[w] = link_loads.get(w, 0.0) + fraction
+
+            for w, load in link_loads.items():
+                if load / link_capacity(G, w, u) > entry['load_U'] + tol:
+                    errors.append(
+                        f"t = {t}: link {w} -> {u} carries {load / link_capacity(G, w, u):.4g} > load_U {entry['load_U']:.4g}")
+
+    holders: Dict[Node, List[Node]] = {}
+    for x, shards in initial.items():
+        for v in shards:
+            holders.setdefault(v, []).append(x)
+    wanted: Dict[Node, List[Node]] = {}
+    for u, shards in required.items():
+        for v in shards:
+            wanted.setdefault(v, []).append(u)
+
+    # vertex t * N + x is node x after step t, the last vertex feeds the holders at step 0
+    source = (T + 1) * N
+    keep_rows = np.arange(T * N)
+    for v, dests in wanted.items():
+        rows = [keep_rows, np.full(len(holders.get(v, [])), source)]
+        cols = [keep_rows + N, np.array([index[x] for x in holders.get(v, [])], dtype=np.int64)]
+        caps = [np.full(T * N, _FLOW_SCALE), np.full(len(holders.get(v, [])), _FLOW_SCALE)]
+        edges = transfers.get(v, [])
+        if edges:
+            k, w, u, fraction = (np.array(a) for a in zip(*edges))
+            rows.append(k * N + w)
+            cols.append((k + 1) * N + u)
+            caps.append(np.ceil(np.minimum(fraction.astype(np.float64), 1.) * _FLOW_SCALE))
+        graph = sp.csr_array((np.concatenate(caps).astype(np.int32),
+                              (np.concatenate(rows).astype(np.int64), np.concatenate(cols).astype(np.int64))),
+                             shape=(source + 1, source + 1))
+
+        for u in dests:
+            if u in holders.get(v, []):
+                continue
+            delivered = maximum_flow(graph, source, T * N + index[u]).flow_value / _FLOW_SCALE
+            if delivered < 1 - tol:
+                errors.append(f"{u} ends with {delivered:.4g} of shard {v}")
+
+    return errors
+
+
+def save_schedule(A: Schedule, path: str) -> None:
+    """
+    JSON with nodes written as Python literals, see `load_schedule`
+    """
+    import json
+    data = {str(t): {repr(u): {'load_U': entry['load_U'],
+                               'transfers': [[repr(v), repr(w), fraction] for (v, w), fraction in entry['transfers'].items()]}
+                     for u, entry in step.items()}
+            for t, step in A.items()}
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def load_schedule(path: str) -> Schedule:
+    import ast
+    import json
+    with open(path) as f:
+        data = json.load(f)
+    A: Schedule = {}
+    for t, step in data.items():
+        A[TimeStep(int(t))] = {ast.literal_eval(u): ScheduleEntry(
+            load_U=entry['load_U'],
+            transfers={TransferKey(ast.literal_eval(v), ast.literal_eval(w)): Fraction(fraction)
+                       for v, w, fraction in entry['transfers']})
+            for u, entry in step.items()}
+    return A
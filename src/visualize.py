@@ -4,6 +4,7 @@ from typing import Dict, Tuple, Any
 
 # 假设这些类型定义都来自于 schedule_type 模块
 from schedule_type import *
+import render
 
 
 def visualize_digraph(G: nx.DiGraph, title: str | None = None):
@@ -50,10 +51,7 @@ def visualize_schedule(G: nx.DiGraph, schedule: Schedule, source_node: Node):
         return
 
     # 1. 准备布局，在所有时间片使用相同的布局，保持一致性
-    try:
-        pos = nx.spring_layout(G, seed=42)
-    except nx.NetworkXException:
-        pos = nx.spring_layout(G)
+    pos = dict(zip(G.nodes(), render.layout(G)))
 
     # 2. 遍历每个时间步并绘图
     for t in time_steps:
@@ -96,8 +94,9 @@ def visualize_schedule(G: nx.DiGraph, schedule: Schedule, source_node: Node):
         all_edges = G.edges()
         active_edges = list(active_transfers.keys())
         # 注意：inactive_edges 应该是不在 active_edges 列表中的所有边，无论它们是否在 schedule 中有其他流量
+        active_set = set(active_edges)
         inactive_edges = [
-            edge for edge in all_edges if edge not in active_edges]
+            edge for edge in all_edges if edge not in active_set]
 
         edge_labels = {}
 